@@ -1,19 +1,18 @@
-import io, logging, os, re, zipfile
+import logging, os
 from app import app, db
-from app.database import handle_db_connection
-from app.excel_generator import generate_report_excel
-from app.models import Admin, ClaimApproval, ClaimAttachment, ClaimReport, Department, Head, Lecturer, LecturerClaim, LecturerSubject, Other, ProgramOfficer, Rate, RequisitionApproval, RequisitionAttachment, RequisitionReport, Subject 
-from app.shared_routes import delete_requisition_and_attachment, get_current_utc, get_drive_service, send_email, upload_to_drive
+from app.archive_jobs import archived_requisition_ids, enqueue_archive_job, serialize_archive_job
+from app.claim_rollup import remove_claims_from_rollup
+from app.database import defer_until_commit, get_connection_health_stats, handle_db_connection
+from app.drive_archive import DELETED_OUTCOMES, archive_download_name, build_archive_file, collect_archive_items, delete_stored_files, get_archivable_requisitions, get_archive_path
+from app.models import Admin, ArchiveJob, ClaimApproval, ClaimMonthlyTotal, ClaimReport, Department, Head, Lecturer, LecturerSubject, Other, ProgramOfficer, Rate, ReportJob, RequisitionApproval, RequisitionReport, ScheduledTask, Subject 
+from app.report_jobs import enqueue_report_job, serialize_report_job
+from app.scheduler import serialize_scheduled_task
+from app.shared_routes import delete_requisition_and_attachment, get_current_utc, get_remaining_hours, send_void_email
 from datetime import date, datetime, timedelta, timezone
-from dateutil.relativedelta import relativedelta
 from flask import jsonify, redirect, render_template, request, send_file, session, url_for
 from flask_bcrypt import Bcrypt
-from io import BytesIO
-from googleapiclient.http import MediaIoBaseDownload
-from openpyxl import load_workbook
-from openpyxl.workbook.protection import WorkbookProtection
-from openpyxl.utils.protection import hash_password
-from sqlalchemy import desc, extract, func
+from sqlalchemy import desc, func
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import joinedload
 
 bcrypt = Bcrypt()
@@ -55,20 +54,15 @@ def adminHomepage():
             "count": subject_count
         })
 
-    # Aggregate claims: sum per department per year+month
+    # Aggregate claims: sum per department per year+month (from the monthly rollup)
     claim_trends = (
         db.session.query(
-            Lecturer.department_id,
-            extract('year', LecturerClaim.date).label('year'),
-            extract('month', LecturerClaim.date).label('month'),
-            func.sum(LecturerClaim.total_cost).label("total_claims")
+            ClaimMonthlyTotal.department_id,
+            ClaimMonthlyTotal.year,
+            ClaimMonthlyTotal.month,
+            func.sum(ClaimMonthlyTotal.total_claims).label("total_claims")
         )
-        .join(Lecturer, Lecturer.lecturer_id == LecturerClaim.lecturer_id)
-        .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-        .filter(ClaimApproval.status == "Completed")   # only completed claims
-        .group_by(Lecturer.department_id,
-                extract('year', LecturerClaim.date),
-                extract('month', LecturerClaim.date))
+        .group_by(ClaimMonthlyTotal.department_id, ClaimMonthlyTotal.year, ClaimMonthlyTotal.month)
         .all()
     )
 
@@ -80,29 +74,11 @@ def adminHomepage():
             "total_claims": float(total_claims)
         })
 
-    # Aggregate claims: sum per department per month/year
     dept_map = {d.department_id: d.department_code for d in departments}
 
-    # Aggregate claims: sum per department per month/year
-    peak_claims = (
-        db.session.query(
-            Lecturer.department_id,
-            extract('year', LecturerClaim.date).label('year'),
-            extract('month', LecturerClaim.date).label('month'),
-            func.sum(LecturerClaim.total_cost).label("total_claims")
-        )
-        .join(Lecturer, Lecturer.lecturer_id == LecturerClaim.lecturer_id)
-        .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-        .filter(ClaimApproval.status == "Completed")   # only completed claims
-        .group_by(Lecturer.department_id,
-                extract('year', LecturerClaim.date),
-                extract('month', LecturerClaim.date))
-        .all()
-    )
-
     # Convert to dict by year → then filter top 6 months
     year_claims = {}
-    for dept_id, year, month, total_claims in peak_claims:
+    for dept_id, year, month, total_claims in claim_trends:
         year = int(year)
         year_claims.setdefault(year, []).append({
             "department_id": dept_id,
@@ -213,10 +189,7 @@ def adminApprovalsPage():
     departments = Department.query.all()
     lecturers = Lecturer.query.order_by(Lecturer.name).all()
 
-    requisitionApprovals = RequisitionApproval.query.order_by(RequisitionApproval.approval_id.desc()).all()
-    requisitionAttachments = RequisitionAttachment.query.order_by(RequisitionAttachment.requisition_id.desc()).all()
-    claimApprovals = ClaimApproval.query.order_by(ClaimApproval.approval_id.desc()).all()
-    claimAttachments = ClaimAttachment.query.order_by(ClaimAttachment.claim_id.desc()).all()
+    # Requisition/claim approvals and attachments are loaded page by page via /api/approvals
 
     # Get all LecturerSubject records linked to completed requisitions
     subjects = (
@@ -231,29 +204,16 @@ def adminApprovalsPage():
         .join(Subject, LecturerSubject.subject_id == Subject.subject_id)
         .join(RequisitionApproval, LecturerSubject.requisition_id == RequisitionApproval.approval_id)
         .filter(RequisitionApproval.status == 'Completed')
+        .options(joinedload(LecturerSubject.rate))
         .order_by(desc(RequisitionApproval.approval_id))
         .all()
     )
 
+    remaining_hours = get_remaining_hours([row[0] for row in subjects])
+
     claimDetails = []
 
     for ls, lecturer, code, title, level in subjects:
-        claimed = (
-            db.session.query(
-                func.coalesce(func.sum(LecturerClaim.lecture_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.tutorial_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.practical_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.blended_hours), 0)
-            )
-            .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-            .filter(
-                LecturerClaim.lecturer_id == lecturer.lecturer_id,
-                LecturerClaim.subject_id == ls.subject_id,
-                ClaimApproval.status == 'Completed'
-            )
-            .first()
-        )
-
         remaining = {
             'lecturer': lecturer,
             'subject_code': code,
@@ -262,20 +222,13 @@ def adminApprovalsPage():
             'start_date': ls.start_date,
             'end_date': ls.end_date,
             'hourly_rate': ls.rate.amount if ls.rate else 0,
-            'lecture_hours': ls.total_lecture_hours - claimed[0],
-            'tutorial_hours': ls.total_tutorial_hours - claimed[1],
-            'practical_hours': ls.total_practical_hours - claimed[2],
-            'blended_hours': ls.total_blended_hours - claimed[3],
+            **remaining_hours[(ls.lecturer_id, ls.requisition_id, ls.subject_id)]
         }
         claimDetails.append(remaining)
     
     return render_template('adminApprovalsPage.html', 
                            departments=departments,
                            lecturers=lecturers,
-                           requisitionApprovals=requisitionApprovals,
-                           requisitionAttachments=requisitionAttachments,
-                           claimApprovals=claimApprovals,
-                           claimAttachments=claimAttachments,
                            claimDetails=claimDetails)
 
 @app.route('/set_adminApprovalsPage_tab', methods=['POST'])
@@ -340,12 +293,13 @@ def admin_void_requisition(approval_id):
         )
 
         if recipients:
-            success = send_email(recipients, subject, body)
-            if not success:
-                logger.error(f"Failed to send void notification email to: {recipients}")
+            defer_until_commit(send_void_email, recipients, subject, body)
         
         return jsonify(success=True)
 
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
         logger.error(f"Error voiding requisition: {e}")
         return jsonify(success=False, error="Internal server error."), 500
@@ -385,117 +339,71 @@ def reportConversionResult():
         return jsonify(success=False, error="Session expired. Please log in again."), 401
 
     try:
-        report_type = request.form.get('report_type')
-        start_date = request.form.get('start_date')
-        end_date = request.form.get('end_date')
-
-        # Choose query and generator based on report type
-        if report_type == "requisition":
-            q = (
-                db.session.query(
-                    Department.department_code.label("department_code"),
-                    Lecturer.name.label("lecturer_name"),
-                    func.count(LecturerSubject.subject_id).label("total_subjects"),
-                    func.coalesce(func.sum(LecturerSubject.total_lecture_hours), 0).label("lecture_hours"),
-                    func.coalesce(func.sum(LecturerSubject.total_tutorial_hours), 0).label("tutorial_hours"),
-                    func.coalesce(func.sum(LecturerSubject.total_practical_hours), 0).label("practical_hours"),
-                    func.coalesce(func.sum(LecturerSubject.total_blended_hours), 0).label("blended_hours"),
-                    func.coalesce(func.max(Rate.amount), 0).label("rate"),
-                    func.coalesce(func.sum(LecturerSubject.total_cost), 0).label("total_cost"),
-                )
-                .join(Lecturer, Lecturer.department_id == Department.department_id)
-                .join(LecturerSubject, LecturerSubject.lecturer_id == Lecturer.lecturer_id)
-                .join(RequisitionApproval, RequisitionApproval.approval_id == LecturerSubject.requisition_id)
-                .outerjoin(Rate, Rate.rate_id == LecturerSubject.rate_id)
-                .filter(LecturerSubject.start_date >= start_date)
-                .filter(LecturerSubject.end_date <= end_date)
-                .group_by(Department.department_code, Lecturer.name)
-                .order_by(Department.department_code.asc(), Lecturer.name.asc())
-            )
-            report_model = RequisitionReport
-
-        elif report_type == "claim":
-            q = (
-                db.session.query(
-                    Department.department_code.label("department_code"),
-                    Lecturer.name.label("lecturer_name"),
-                    func.count(LecturerClaim.subject_id).label("total_subjects"),
-                    func.coalesce(func.sum(LecturerClaim.lecture_hours), 0).label("lecture_hours"),
-                    func.coalesce(func.sum(LecturerClaim.tutorial_hours), 0).label("tutorial_hours"),
-                    func.coalesce(func.sum(LecturerClaim.practical_hours), 0).label("practical_hours"),
-                    func.coalesce(func.sum(LecturerClaim.blended_hours), 0).label("blended_hours"),
-                    func.coalesce(func.max(Rate.amount), 0).label("rate"),
-                    func.coalesce(func.sum(LecturerClaim.total_cost), 0).label("total_cost"),
-                )
-                .join(Lecturer, LecturerClaim.lecturer_id == Lecturer.lecturer_id)
-                .join(Department, Lecturer.department_id == Department.department_id)
-                .join(ClaimApproval, ClaimApproval.approval_id == LecturerClaim.claim_id)
-                .outerjoin(Rate, Rate.rate_id == LecturerClaim.rate_id)
-                .filter(LecturerClaim.date >= start_date)
-                .filter(LecturerClaim.date <= end_date)
-                .group_by(Department.department_code, Lecturer.name)
-                .order_by(Department.department_code.asc(), func.coalesce(func.sum(LecturerClaim.total_cost), 0).desc())
-            )
-            report_model = ClaimReport
-
-        else:
-            return jsonify(success=False, error="Invalid report type."), 400
-
-        # Build report_details
-        report_details = [
-            {
-                "department_code": r.department_code or "",
-                "lecturer_name": r.lecturer_name or "",
-                "total_subjects": int(r.total_subjects or 0),
-                "total_lecture_hours": int(r.lecture_hours or 0),
-                "total_tutorial_hours": int(r.tutorial_hours or 0),
-                "total_practical_hours": int(r.practical_hours or 0),
-                "total_blended_hours": int(r.blended_hours or 0),
-                "rate": int(r.rate or 0),
-                "total_cost": int(r.total_cost or 0),
-            }
-            for r in q.all()
-        ]
-
-        # Check for empty result before generating
-        if not report_details:
-            return jsonify(success=False, error="No matching data found for the selected date range."), 404
-
-        # Generate Excel
-        output_path = generate_report_excel(
-            report_type=report_type,
-            start_date=start_date,
-            end_date=end_date,
-            report_details=report_details
+        # Queue the report; a worker runs the query, Excel and storage upload
+        job, created = enqueue_report_job(
+            request.form.get('report_type'),
+            request.form.get('start_date'),
+            request.form.get('end_date'),
+            admin_id=session.get('admin_id')
         )
 
-        file_name = os.path.basename(output_path)
-        file_url, file_id = upload_to_drive(output_path, file_name)
+        return jsonify(
+            success=True,
+            job_id=job.job_id,
+            deduplicated=not created,
+            status_url=url_for('reportJobStatus', job_id=job.job_id)
+        ), 202
 
-        # Save to correct model
-        new_report = report_model(
-            file_id=file_id,
-            file_name=file_name,
-            file_url=file_url,
-            start_date=start_date,
-            end_date=end_date
-        )
-        db.session.add(new_report)
-        db.session.commit()
+    except ValueError as e:
+        return jsonify(success=False, error=str(e)), 400
 
-        return jsonify(success=True, file_url=file_url)
+    except OperationalError:
+        raise  # let handle_db_connection retry
 
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error while converting report result: {e}")
+        logger.error(f"Error while queueing report: {e}")
         return jsonify(success=False, error=str(e)), 500
 
+@app.route('/api/report_jobs/<int:job_id>')
+@handle_db_connection
+def reportJobStatus(job_id):
+    if 'admin_id' not in session:
+        return jsonify(success=False, error="Session expired. Please log in again."), 401
+
+    job = ReportJob.query.get(job_id)
+    if not job:
+        return jsonify(success=False, error="Report job not found."), 404
+
+    return jsonify(success=True, job=serialize_report_job(job))
+
+def _report_download_url(view_url):
+    """Convert a Google Sheets preview link into a downloadable xlsx link."""
+    if view_url and "docs.google.com" in view_url and "/d/" in view_url:
+        file_id = view_url.split("/d/")[1].split("/")[0]
+        return f"https://docs.google.com/spreadsheets/d/{file_id}/export?format=xlsx"
+    return view_url
+
 @app.route('/reportConversionResultPage')
 def reportConversionResultPage():
     if 'admin_id' not in session:
         return redirect(url_for('loginPage'))
 
     report_type = request.args.get("type", "requisition")  # default
+
+    # Report still being generated: the page polls the job until it is done
+    job_id = request.args.get("job", type=int)
+    if job_id:
+        job = ReportJob.query.get(job_id)
+        if not job:
+            return "Report job not found", 404
+
+        return render_template("reportConversionResultPage.html",
+                               job=serialize_report_job(job),
+                               view_url=job.file_url,
+                               download_url=_report_download_url(job.file_url),
+                               report_type=job.report_type)
+
     if report_type == "claim":
         latest_report = ClaimReport.query.order_by(ClaimReport.report_id.desc()).first()
     else:
@@ -507,17 +415,10 @@ def reportConversionResultPage():
     # Keep original link for preview
     view_url = latest_report.file_url
 
-    # Default to original in case it's not Google Sheets
-    download_url = view_url
-
-    # Convert Google Sheets preview to downloadable link
-    if "docs.google.com" in view_url and "/d/" in view_url:
-        file_id = view_url.split("/d/")[1].split("/")[0]
-        download_url = f"https://docs.google.com/spreadsheets/d/{file_id}/export?format=xlsx"
-
     return render_template("reportConversionResultPage.html",
+                           job=None,
                            view_url=view_url,
-                           download_url=download_url,
+                           download_url=_report_download_url(view_url),
                            report_type=report_type)
 
 @app.route('/adminProfilePage', methods=['GET', 'POST'])
@@ -561,57 +462,6 @@ def adminProfilePage():
     return render_template('adminProfilePage.html', admin=admin, files=files, used_gb=used_gb, total_gb=total_gb) """
     return render_template('adminProfilePage.html', admin=admin)
 
-def get_requisition_base_query(cutoff_date):
-    """Return the base query for eligible requisitions based on shared conditions."""
-    # LecturerSubject aggregation
-    ls_agg = (
-        db.session.query(
-            LecturerSubject.requisition_id.label('rid'),
-            func.max(LecturerSubject.end_date).label('max_end'),
-            func.coalesce(func.sum(LecturerSubject.total_cost), 0).label('ls_total')
-        )
-        .group_by(LecturerSubject.requisition_id)
-        .subquery()
-    )
-
-    # LecturerClaim aggregation
-    lc_agg = (
-        db.session.query(
-            LecturerClaim.requisition_id.label('rid'),
-            func.coalesce(func.sum(LecturerClaim.total_cost), 0).label('lc_total')
-        )
-        .group_by(LecturerClaim.requisition_id)
-        .subquery()
-    )
-
-    # Main filter query
-    q = (
-        db.session.query(RequisitionApproval, ls_agg.c.max_end, ls_agg.c.ls_total,
-                         func.coalesce(lc_agg.c.lc_total, 0).label('lc_total'))
-        .join(ls_agg, ls_agg.c.rid == RequisitionApproval.approval_id)
-        .outerjoin(lc_agg, lc_agg.c.rid == RequisitionApproval.approval_id)
-        .filter(func.lower(func.coalesce(RequisitionApproval.status, '')) == 'completed')
-        .filter(ls_agg.c.max_end <= cutoff_date)
-        .filter((ls_agg.c.ls_total - func.coalesce(lc_agg.c.lc_total, 0)) == 0)
-    )
-    return q
-
-def get_completed_claims_for_requisition(req_id):
-    """Return completed ClaimApproval objects related to a given requisition."""
-    claim_ids = {
-        cid for (cid,) in db.session.query(LecturerClaim.claim_id)
-                                    .filter(LecturerClaim.requisition_id == req_id)
-                                    .distinct()
-                                    .all()
-    }
-    if not claim_ids:
-        return []
-
-    return [
-        ca for ca in ClaimApproval.query.filter(ClaimApproval.approval_id.in_(list(claim_ids))).all()
-        if (ca.status or '').lower() == 'completed'
-    ]
-
 @app.route('/api/download_files_zip', methods=['POST'])
 @handle_db_connection
 def download_files_zip():
@@ -630,101 +480,173 @@ def download_files_zip():
     """
     try:
         today = date.today()
-        cutoff = today - relativedelta(months=4)   # fixed to 4 months
-        stamp = format_dd_MMM_yyyy(today)
-
-        rows = get_requisition_base_query(cutoff).all()
+        rows = get_archivable_requisitions(today)
         if not rows:
             return jsonify({'error': 'No requisition or claim files meet the download criteria.'}), 400
 
-        mem_zip = BytesIO()
-        with zipfile.ZipFile(mem_zip, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            req_root = f"Requisition_{stamp}"
-            claim_root = f"Claim_{stamp}"
-
-            for req, max_end, ls_total, lc_total in rows:
-                dept_name = safe_name(
-                    getattr(req.department, 'department_code', None) or
-                    getattr(req.department, 'department_name', None) or
-                    "Unknown_Department"
-                )
-
-                # Add requisition approval XLSX
-                if req.file_url and (req.file_name or '').lower().endswith(('.xlsx', '.xlsm', '.xls')):
-                    add_drive_approval_xlsx_to_zip(
-                        zf, req.file_url,
-                        f"{req_root}/{dept_name}/Approvals/{safe_name(req.file_name)}"
-                    )
-
-                # Add requisition attachments (PDF)
-                for att in (req.requisition_attachments or []):
-                    if att.attachment_url and (att.attachment_name or '').lower().endswith('.pdf'):
-                        add_drive_attachment_pdf_to_zip(
-                            zf, att.attachment_url,
-                            f"{req_root}/{dept_name}/Attachments/{safe_name(att.attachment_name)}"
-                        )
-
-                # Add claim approvals & attachments
-                for ca in get_completed_claims_for_requisition(req.approval_id):
-                    if ca.file_url and (ca.file_name or '').lower().endswith(('.xlsx', '.xlsm', '.xls')):
-                        add_drive_approval_xlsx_to_zip(
-                            zf, ca.file_url,
-                            f"{claim_root}/{dept_name}/Approvals/{safe_name(ca.file_name)}"
-                        )
-                    for catt in (ca.claim_attachments or []):
-                        if catt.attachment_url and (catt.attachment_name or '').lower().endswith('.pdf'):
-                            add_drive_attachment_pdf_to_zip(
-                                zf, catt.attachment_url,
-                                f"{claim_root}/{dept_name}/Attachments/{safe_name(catt.attachment_name)}"
-                            )
-
-        mem_zip.seek(0)
-        return send_file(
-            mem_zip,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"Approvals and Attachments_{stamp}.zip"
-        )
+        # List every file first (DB work), then fetch them concurrently from storage
+        items = collect_archive_items(rows, today)
+
+        # Written to disk entry by entry; kept for a while so the download can resume
+        archive_id, archive_path, _ = build_archive_file(items)
+
+        response = send_archive(archive_path, archive_download_name(today))
+        response.headers['Content-Location'] = url_for('download_archive', archive_id=archive_id)
+        return response
 
     except Exception as e:
         logger.error(f"Error during ZIP download generation: {e}")
         return jsonify({'error': str(e)}), 500
 
+def send_archive(path, download_name):
+    """Stream an archive file from disk; GET requests may ask for byte ranges (206)."""
+    response = send_file(
+        path,
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=download_name,
+        conditional=True,
+        etag=True,
+        max_age=0
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@app.route('/api/archives/<archive_id>')
+def download_archive(archive_id):
+    """Download (or resume with Range) an archive built by download_files_zip or an archive job."""
+    if 'admin_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    path = get_archive_path(archive_id)
+    if not path:
+        return jsonify({'error': 'Archive not found or expired.'}), 404
+
+    built_on = date.fromtimestamp(os.path.getmtime(path))
+    return send_archive(path, archive_download_name(built_on))
+
+@app.route('/api/archive_jobs', methods=['POST'])
+@handle_db_connection
+def queueArchiveJob():
+    if 'admin_id' not in session:
+        return jsonify(success=False, error="Session expired. Please log in again."), 401
+
+    try:
+        # Queue the archive; a worker fetches the files from storage and writes the ZIP
+        job, created = enqueue_archive_job(admin_id=session.get('admin_id'))
+        return jsonify(
+            success=True,
+            job=serialize_archive_job(job),
+            deduplicated=not created,
+            status_url=url_for('archiveJobStatus', job_id=job.job_id)
+        ), 202
+
+    except OperationalError:
+        raise  # let handle_db_connection retry
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error while queueing archive: {e}")
+        return jsonify(success=False, error=str(e)), 500
+
+@app.route('/api/archive_jobs')
+@handle_db_connection
+def listArchiveJobs():
+    if 'admin_id' not in session:
+        return jsonify(success=False, error="Session expired. Please log in again."), 401
+
+    limit = min(request.args.get('limit', 5, type=int), 50)
+    jobs = ArchiveJob.query.order_by(ArchiveJob.job_id.desc()).limit(limit).all()
+    return jsonify(success=True, jobs=[serialize_archive_job(job) for job in jobs])
+
+@app.route('/api/archive_jobs/<int:job_id>')
+@handle_db_connection
+def archiveJobStatus(job_id):
+    if 'admin_id' not in session:
+        return jsonify(success=False, error="Session expired. Please log in again."), 401
+
+    job = ArchiveJob.query.get(job_id)
+    if not job:
+        return jsonify(success=False, error="Archive job not found."), 404
+
+    return jsonify(success=True, job=serialize_archive_job(job))
+
+@app.route('/api/scheduler_status')
+@handle_db_connection
+def schedulerStatus():
+    if 'admin_id' not in session:
+        return jsonify(success=False, error="Session expired. Please log in again."), 401
+
+    tasks = ScheduledTask.query.order_by(ScheduledTask.name).all()
+    return jsonify(success=True, tasks=[serialize_scheduled_task(task) for task in tasks])
+
+@app.route('/api/db_health')
+def dbHealth():
+    if 'admin_id' not in session:
+        return jsonify(success=False, error="Session expired. Please log in again."), 401
+
+    # Counters are kept per worker process; repeated calls may land on different workers
+    return jsonify(
+        success=True,
+        pid=os.getpid(),
+        stale_seconds=app.config['DB_STALE_SECONDS'],
+        keepalive_seconds=app.config['DB_KEEPALIVE_SECONDS'],
+        stats=get_connection_health_stats(),
+    )
+
 @app.route('/api/cleanup_downloaded_files', methods=['POST'])
 @handle_db_connection
 def cleanup_downloaded_files():
     try:
-        today = date.today()
-        cutoff = today - relativedelta(months=4)
+        rows = get_archivable_requisitions(date.today())
+
+        # After an archive job, only clear what actually went into that archive
+        job_id = (request.get_json(silent=True) or {}).get('job_id')
+        if job_id:
+            job = ArchiveJob.query.get(job_id)
+            if not job or job.status != "Completed":
+                return jsonify({'error': 'Archive job not found or not completed.'}), 400
+            archived = archived_requisition_ids(job)
+            rows = [row for row in rows if row.requisition.approval_id in archived]
 
-        rows = get_requisition_base_query(cutoff).all()
         if not rows:
             return jsonify({'error': 'No matching records to clean up.'}), 400
 
-        deleted_requisition_ids = []
-        deleted_claim_ids = set()
-
-        for req, max_end, ls_total, lc_total in rows:
-            # Delete requisition files
-            if req.file_url:
-                drive_delete_by_url(req.file_url)
-            for att in (req.requisition_attachments or []):
-                if att.attachment_url:
-                    drive_delete_by_url(att.attachment_url)
-
-            # Delete claim files
-            for ca in get_completed_claims_for_requisition(req.approval_id):
-                if ca.file_url:
-                    drive_delete_by_url(ca.file_url)
-                for catt in (ca.claim_attachments or []):
-                    if catt.attachment_url:
-                        drive_delete_by_url(catt.attachment_url)
-                deleted_claim_ids.add(ca.approval_id)
-
-            deleted_requisition_ids.append(req.approval_id)
+        # Gather every file per record, then delete them all in storage batches
+        requisition_urls = {}
+        claim_urls = {}
+        requisition_claims = {}
+        for req, claims in rows:
+            requisition_urls[req.approval_id] = [req.file_url] if req.file_url else []
+            requisition_urls[req.approval_id] += [att.attachment_url for att in (req.requisition_attachments or []) if att.attachment_url]
+
+            requisition_claims[req.approval_id] = []
+            for ca in claims:
+                requisition_claims[req.approval_id].append(ca.approval_id)
+                if ca.approval_id not in claim_urls:
+                    claim_urls[ca.approval_id] = [ca.file_url] if ca.file_url else []
+                    claim_urls[ca.approval_id] += [catt.attachment_url for catt in (ca.claim_attachments or []) if catt.attachment_url]
+
+        all_urls = [url for urls in requisition_urls.values() for url in urls]
+        all_urls += [url for urls in claim_urls.values() for url in urls]
+        outcomes = delete_stored_files(all_urls)
+
+        def files_removed(urls):
+            return all(outcomes[url] in DELETED_OUTCOMES for url in urls)
+
+        # Only drop a requisition with its claims once all of their files are gone.
+        # The rest stay eligible, and a later cleanup finds the removed files missing.
+        deleted_requisition_ids = [
+            rid for rid, urls in requisition_urls.items()
+            if files_removed(urls) and all(files_removed(claim_urls[cid]) for cid in requisition_claims[rid])
+        ]
+        kept_claim_ids = {cid for rid in requisition_urls if rid not in deleted_requisition_ids for cid in requisition_claims[rid]}
+        deleted_claim_ids = {cid for rid in deleted_requisition_ids for cid in requisition_claims[rid]} - kept_claim_ids
+        failed_files = sorted({url for url in all_urls if outcomes[url] not in DELETED_OUTCOMES})
 
         # DB deletions
         if deleted_claim_ids:
+            remove_claims_from_rollup(deleted_claim_ids)
             ClaimApproval.query.filter(
                 ClaimApproval.approval_id.in_(list(deleted_claim_ids))
             ).delete(synchronize_session=False)
@@ -736,10 +658,18 @@ def cleanup_downloaded_files():
 
         db.session.commit()
 
+        if failed_files:
+            logger.warning(f"Cleanup kept {len(requisition_urls) - len(deleted_requisition_ids)} requisition(s) and "
+                           f"{len(claim_urls) - len(deleted_claim_ids)} claim(s): {len(failed_files)} stored file(s) could not be deleted")
+
         return jsonify({
             'success': True,
+            'partial': bool(failed_files),
             'deleted_requisition_ids': deleted_requisition_ids,
-            'deleted_claim_ids': sorted(list(deleted_claim_ids))
+            'deleted_claim_ids': sorted(list(deleted_claim_ids)),
+            'kept_requisition_ids': sorted(set(requisition_urls) - set(deleted_requisition_ids)),
+            'kept_claim_ids': sorted(kept_claim_ids),
+            'failed_files': failed_files
         })
 
     except Exception as e:
@@ -759,157 +689,3 @@ def change_rate_status(id):
         db.session.rollback()
         logger.error(f"Error while changing rate status: {str(e)}")
         return jsonify({'error': str(e)}), 500
-
-def safe_name(s: str) -> str: 
-    if not s: 
-        return "Unknown" 
-    return re.sub(r'[\\/:*?"<>|\r\n]+', '_', s).strip() 
-
-def format_dd_MMM_yyyy(d: date) -> str: 
-    return d.strftime('%d %b %Y')
-
-# Extract fileId from common URLs
-def extract_drive_file_id(url: str) -> str | None:
-    # Sheets url
-    m = re.search(r"docs\.google\.com/spreadsheets/d/([a-zA-Z0-9-_]+)", url)
-    if m: return m.group(1)
-    # Drive file url
-    m = re.search(r"drive\.google\.com/file/d/([a-zA-Z0-9-_]+)", url)
-    if m: return m.group(1)
-    # open?id=<ID>
-    m = re.search(r"[?&]id=([a-zA-Z0-9-_]+)", url)
-    if m: return m.group(1)
-    return None
-
-# Get metadata (name, mimeType)
-def drive_get_metadata(file_id: str) -> dict:
-    svc = get_drive_service()
-    return svc.files().get(fileId=file_id, fields="id, name, mimeType").execute()
-
-# Download (export for Google-native, get_media for binary) into memory
-def drive_download_bytes(file_id: str, export_mime: str | None = None) -> bytes:
-    svc = get_drive_service()
-    if export_mime:
-        request = svc.files().export_media(fileId=file_id, mimeType=export_mime)
-    else:
-        request = svc.files().get_media(fileId=file_id)
-
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        # (optional) you can inspect status.progress() here if you want
-    fh.seek(0)
-    return fh.read()
-
-# Write approvals (Sheets -> XLSX) into ZIP by URL
-APP_SHEET_PW = os.environ.get("EXCEL_SHEET_PW", "approval_excel_sheet_password")
-APP_BOOK_PW  = os.environ.get("EXCEL_BOOK_PW", "approval_workbook_password")
-
-def add_drive_approval_xlsx_to_zip(zf, url: str, arcname: str):
-    file_id = extract_drive_file_id(url)
-    if not file_id:
-        return
-    meta = drive_get_metadata(file_id)
-
-    # Export Google Sheet → XLSX
-    if meta.get("mimeType") == "application/vnd.google-apps.spreadsheet":
-        data = drive_download_bytes(
-            file_id,
-            export_mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    else:
-        # If it isn’t a Google Sheet, try direct bytes (already an Excel file in Drive)
-        data = drive_download_bytes(file_id)
-
-    # Protect the workbook/sheets
-    data = protect_excel_bytes(data, sheet_password=APP_SHEET_PW, workbook_password=APP_BOOK_PW)
-
-    # Ensure .xlsx extension
-    if not arcname.lower().endswith(".xlsx"):
-        base, _, _ = arcname.rpartition(".")
-        arcname = (base or arcname) + ".xlsx"
-
-    zf.writestr(arcname, data)
-
-# Write attachments (PDF) into ZIP by URL
-def add_drive_attachment_pdf_to_zip(zf, url: str, arcname: str):
-    file_id = extract_drive_file_id(url)
-    if not file_id:
-        return
-    meta = drive_get_metadata(file_id)
-    mt = meta.get("mimeType", "")
-
-    # Google-native → export to PDF
-    if mt.startswith("application/vnd.google-apps."):
-        data = drive_download_bytes(file_id, export_mime="application/pdf")
-        # Ensure .pdf extension
-        if not arcname.lower().endswith(".pdf"):
-            base, _, _ = arcname.rpartition(".")
-            arcname = (base or arcname) + ".pdf"
-        zf.writestr(arcname, data)
-        return
-
-    # Non-native binary (likely already a PDF on Drive) → get_media
-    data = drive_download_bytes(file_id, export_mime=None)
-    # Keep arcname; optionally force .pdf if you know all should be PDF
-    zf.writestr(arcname, data)
-
-def protect_excel_bytes(xlsx_bytes: bytes,
-                        sheet_password: str | None = None,
-                        workbook_password: str | None = None) -> bytes:
-    """
-    - Locks every sheet (no edits).
-    - Optionally sets sheet and workbook structure passwords.
-    - Returns protected XLSX bytes.
-    """
-    bio = io.BytesIO(xlsx_bytes)
-    wb = load_workbook(bio, data_only=False)
-
-    for ws in wb.worksheets:
-        # Lock the sheet and disallow edits
-        ws.protection.sheet = True
-        ws.protection.enable()
-        ws.protection.formatCells = False
-        ws.protection.formatColumns = False
-        ws.protection.formatRows = False
-        ws.protection.insertColumns = False
-        ws.protection.insertRows = False
-        ws.protection.insertHyperlinks = False
-        ws.protection.deleteColumns = False
-        ws.protection.deleteRows = False
-        ws.protection.sort = False
-        ws.protection.autoFilter = False
-        ws.protection.pivotTables = False
-        ws.protection.objects = True
-        ws.protection.scenarios = True
-        # Allow selecting cells so users can view content comfortably
-        ws.protection.selectLockedCells = True
-        ws.protection.selectUnlockedCells = True
-
-        if sheet_password:
-            # Sets hashed password inside the file (no prompt unless unprotecting)
-            ws.protection.set_password(sheet_password)
-
-    # Protect workbook structure (e.g., adding/removing sheets)
-    wb.security = WorkbookProtection(lockStructure=True, lockWindows=False)
-    if workbook_password:
-        wb.security.workbookPassword = hash_password(workbook_password)
-
-    out = io.BytesIO()
-    wb.save(out)
-    out.seek(0)
-    return out.read()
-
-def drive_delete_by_url(url: str) -> bool:
-    file_id = extract_drive_file_id(url)
-    if not file_id:
-        return False
-    try:
-        svc = get_drive_service()
-        svc.files().delete(fileId=file_id).execute()
-        return True
-    except Exception as e:
-        logging.error(f"Drive delete failed for {url}: {e}")
-        return False
\ No newline at end of file
@@ -0,0 +1,151 @@
+import json, logging, time
+from app import app, db
+from app.drive_archive import archive_download_name, build_archive_file, collect_archive_items, get_archivable_requisitions, get_archive_path
+from app.job_queue import finish_job, run_job_worker, set_job_stage
+from app.models import ArchiveJob
+from app.shared_routes import get_current_utc
+from datetime import date
+from flask import url_for
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Archive Jobs (DB-backed queue)
+# ============================================================
+# POST /api/archive_jobs records an archive_job row and returns at once;
+# run_archive_worker.py processes list the eligible files, fetch them from
+# Drive into a ZIP under ARCHIVE_FOLDER and record its archive_id, committing
+# progress as files are written so the admin homepage can poll the job.
+# Only one archive build runs at a time: every active job shares one
+# active_key, so repeated clicks attach to the job already in progress.
+ACTIVE_KEY = "archive"
+
+# Progress reported when each stage starts; fetch advances towards 99 per file
+STAGE_PROGRESS = {"queued": 0, "collect": 5, "fetch": 10, "done": 100}
+
+# Minimum seconds between progress commits while files are being fetched
+PROGRESS_INTERVAL = 2.0
+
+def enqueue_archive_job(admin_id=None):
+    """
+    Queue an archive build. Returns (job, created); created is False when
+    an archive job is already queued or running.
+    """
+    existing = ArchiveJob.query.filter_by(active_key=ACTIVE_KEY).first()
+    if existing:
+        return existing, False
+
+    job = ArchiveJob(
+        status="Queued",
+        stage="queued",
+        progress=STAGE_PROGRESS["queued"],
+        active_key=ACTIVE_KEY,
+        requested_by=admin_id,
+        created_at=get_current_utc()
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued an archive between our check and insert
+        db.session.rollback()
+        existing = ArchiveJob.query.filter_by(active_key=ACTIVE_KEY).first()
+        if existing is None:
+            raise
+        return existing, False
+
+    logger.info(f"Queued archive job {job.job_id}")
+    return job, True
+
+def archived_requisition_ids(job):
+    """Requisition ids packed into a completed job's archive."""
+    return set(json.loads(job.requisition_ids)) if job.requisition_ids else set()
+
+def serialize_archive_job(job):
+    """Status payload polled by the admin homepage. Call within a request context."""
+    available = job.status == "Completed" and get_archive_path(job.archive_id) is not None
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "message": job.message,
+        "total_files": job.total_files,
+        "done_files": job.done_files,
+        "archive_bytes": job.archive_bytes,
+        "download_name": job.download_name,
+        "download_url": url_for('download_archive', archive_id=job.archive_id) if available else None,
+        "expired": job.status == "Completed" and not available,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "done": job.status in ("Completed", "Failed"),
+    }
+
+# ============================================================
+#  Worker
+# ============================================================
+def _fetch_progress(job):
+    """on_progress callback for build_archive_file: records done/total, committing at most every PROGRESS_INTERVAL."""
+    last_commit = time.monotonic()
+
+    def on_progress(done, total):
+        nonlocal last_commit
+        now = time.monotonic()
+        if done < total and now - last_commit < PROGRESS_INTERVAL:
+            return
+        last_commit = now
+        job.done_files = done
+        span = 99 - STAGE_PROGRESS["fetch"]
+        set_job_stage(job, "fetch", STAGE_PROGRESS["fetch"] + span * done // max(total, 1))
+
+    return on_progress
+
+def run_archive_job(job):
+    """Collect, fetch and write the archive for one claimed job, recording progress on the row."""
+    try:
+        set_job_stage(job, "collect", STAGE_PROGRESS["collect"])
+        today = date.today()
+        rows = get_archivable_requisitions(today)
+        if not rows:
+            finish_job(job, "Failed", "No requisition or claim files meet the download criteria.")
+            return
+
+        items = collect_archive_items(rows, today)
+        job.total_files = len(items)
+        job.done_files = 0
+        set_job_stage(job, "fetch", STAGE_PROGRESS["fetch"])
+
+        archive_id, _, metrics = build_archive_file(items, on_progress=_fetch_progress(job))
+
+        job.archive_id = archive_id
+        job.archive_bytes = metrics["archive_bytes"]
+        job.download_name = archive_download_name(today)
+        job.requisition_ids = json.dumps([req.approval_id for req, _ in rows])
+        job.done_files = len(items)
+        finish_job(job, "Completed")
+        logger.info(f"Archive job {job.job_id} completed: {archive_id} ({metrics['files']} files, {metrics['archive_bytes']} bytes)")
+
+    except OperationalError:
+        # Leave the job Running; it is requeued once its heartbeat goes stale
+        db.session.rollback()
+        raise
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Archive job {job.job_id} failed: {e}")
+        finish_job(job, "Failed", str(e))
+
+def run_archive_worker(worker_id=None, poll_seconds=None, once=False):
+    """
+    Process archive jobs until stopped. With once=True, drain the queue and return
+    the number of jobs processed. Must run inside an app context.
+    """
+    return run_job_worker(
+        ArchiveJob, run_archive_job,
+        poll_seconds=poll_seconds or app.config['ARCHIVE_JOB_POLL_SECONDS'],
+        stale_seconds=app.config['ARCHIVE_JOB_STALE_SECONDS'],
+        max_attempts=app.config['ARCHIVE_JOB_MAX_ATTEMPTS'],
+        interrupted_message="Archive build was interrupted. Please try again.",
+        worker_id=worker_id,
+        once=once
+    )
@@ -0,0 +1,117 @@
+import hashlib, json, logging, os, tempfile, threading
+from app import app
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Attachment Byte Cache (on disk, LRU)
+# ============================================================
+# Notification and reminder emails attach the same request PDFs over and over
+# (every approver, every reminder). The email worker reads them through this
+# cache instead of downloading each one again: entries are keyed by storage
+# backend and file id, and each read first asks the backend for the file's
+# current version (Drive modifiedTime/md5Checksum, or the blob's SHA-256), so
+# a replaced file is never served stale. One metadata request replaces a full
+# download on every hit. Entries live under app/temp/attachment_cache and the
+# least recently used are evicted once the folder holds more than
+# ATTACHMENT_CACHE_MAX_BYTES (0 disables the cache).
+CACHE_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), "temp", "attachment_cache")
+
+_lock = threading.Lock()
+_store_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "bytes_served_from_cache": 0}
+
+def _bump(counter, amount=1):
+    with _lock:
+        _stats[counter] += amount
+
+def get_attachment_cache_stats():
+    """Hit/miss counters for this process, with the hit rate."""
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+    return stats
+
+def _entry_path(storage_name, file_id):
+    key = hashlib.sha256(f"{storage_name}:{file_id}".encode()).hexdigest()
+    return os.path.join(CACHE_FOLDER, key)
+
+def _load(path, version):
+    """Cached bytes for `path` if they are still at `version`, else None."""
+    try:
+        with open(path + ".json") as fh:
+            meta = json.load(fh)
+        if meta.get("version") != version:
+            return None
+        with open(path + ".bin", "rb") as fh:
+            data = fh.read()
+    except (OSError, ValueError):
+        return None
+    if len(data) != meta.get("size"):
+        return None
+    os.utime(path + ".bin")  # mtime doubles as the last-used time for LRU eviction
+    return data
+
+def _store(path, version, data):
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=CACHE_FOLDER, suffix=".tmp")
+    with os.fdopen(fd, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path + ".bin")
+    fd, tmp = tempfile.mkstemp(dir=CACHE_FOLDER, suffix=".tmp")
+    with os.fdopen(fd, "w") as fh:
+        json.dump({"version": version, "size": len(data)}, fh)
+    os.replace(tmp, path + ".json")
+
+def _evict(max_bytes):
+    """Drop least recently used entries until the folder fits in max_bytes."""
+    entries = []
+    total = 0
+    for name in os.listdir(CACHE_FOLDER):
+        if not name.endswith(".bin"):
+            continue
+        try:
+            st = os.stat(os.path.join(CACHE_FOLDER, name))
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, name[:-4]))
+        total += st.st_size
+
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+        for ext in (".bin", ".json"):
+            try:
+                os.remove(os.path.join(CACHE_FOLDER, key + ext))
+            except FileNotFoundError:
+                pass
+        total -= size
+        _bump("evictions")
+
+def read_attachment(storage, file_id):
+    """Bytes of a stored attachment, served from the cache while its version is unchanged."""
+    max_bytes = app.config['ATTACHMENT_CACHE_MAX_BYTES']
+    if not max_bytes:
+        return storage.read_bytes(file_id)
+
+    version = storage.describe(file_id)["version"]
+    path = _entry_path(storage.name, file_id)
+    data = _load(path, version)
+    if data is not None:
+        _bump("hits")
+        _bump("bytes_served_from_cache", len(data))
+        return data
+
+    _bump("misses")
+    if os.path.exists(path + ".json"):
+        _bump("stale")
+    data = storage.read_bytes(file_id)
+    if len(data) <= max_bytes:
+        try:
+            with _store_lock:
+                _store(path, version, data)
+                _evict(max_bytes)
+        except OSError as e:
+            logger.warning(f"Could not cache attachment {file_id}: {e}")
+    return data
@@ -0,0 +1,166 @@
+import logging
+from app import db
+from app.models import ClaimApproval, ClaimMonthlyTotal, Lecturer, LecturerClaim
+from sqlalchemy import event, extract, func, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Monthly Claim Rollup
+# ============================================================
+# claim_monthly_total holds SUM(total_cost) of completed claims per
+# department × lecturer × year × month so dashboards can read plain
+# indexed rows instead of grouping lecturer_claim on date functions.
+# It is kept up to date incrementally when a claim is completed and
+# when a completed claim is voided or rejected; rebuild_claim_rollup()
+# reconstructs it from lecturer_claim. Like the dashboards before it, the
+# rollup files a lecturer's claims under their current department, so a
+# lecturer's buckets move with them when their department changes.
+
+def _monthly_claim_query():
+    """Source aggregate over lecturer_claim, grouped like the rollup."""
+    return (
+        db.session.query(
+            Lecturer.department_id,
+            LecturerClaim.lecturer_id,
+            extract('year', LecturerClaim.date).label('year'),
+            extract('month', LecturerClaim.date).label('month'),
+            func.coalesce(func.sum(LecturerClaim.total_cost), 0).label('total_claims'),
+            func.count().label('claim_rows')
+        )
+        .join(Lecturer, Lecturer.lecturer_id == LecturerClaim.lecturer_id)
+        .filter(LecturerClaim.date.isnot(None))
+        .group_by(
+            Lecturer.department_id,
+            LecturerClaim.lecturer_id,
+            extract('year', LecturerClaim.date),
+            extract('month', LecturerClaim.date)
+        )
+    )
+
+def _apply_claims(approval_ids, sign):
+    rows = _monthly_claim_query().filter(LecturerClaim.claim_id.in_(approval_ids)).all()
+
+    for dept_id, lecturer_id, year, month, total, count in rows:
+        year, month = int(year), int(month)
+        bucket = (
+            ClaimMonthlyTotal.query
+            .filter(
+                ClaimMonthlyTotal.department_id.is_(None) if dept_id is None
+                else ClaimMonthlyTotal.department_id == dept_id,
+                ClaimMonthlyTotal.lecturer_id == lecturer_id,
+                ClaimMonthlyTotal.year == year,
+                ClaimMonthlyTotal.month == month
+            )
+            .with_for_update()
+            .first()
+        )
+
+        if bucket is None:
+            if sign < 0:
+                logger.warning(f"Claim rollup has no bucket for lecturer {lecturer_id} {year}-{month:02d}; run rebuild_claim_rollup.py")
+                continue
+            bucket = ClaimMonthlyTotal(
+                department_id=dept_id, lecturer_id=lecturer_id,
+                year=year, month=month, total_claims=0, claim_rows=0
+            )
+            db.session.add(bucket)
+
+        bucket.total_claims = (bucket.total_claims or 0) + sign * int(total or 0)
+        bucket.claim_rows = (bucket.claim_rows or 0) + sign * int(count or 0)
+
+        if bucket.claim_rows <= 0:
+            db.session.delete(bucket)
+
+def add_claim_to_rollup(approval_id):
+    """Count a claim that has just been marked Completed. Caller commits."""
+    _apply_claims([approval_id], 1)
+
+def remove_claim_from_rollup(approval):
+    """
+    Take a claim back out of the rollup when it is voided or rejected.
+    Must run before its lecturer_claim rows are deleted. Only claims that
+    were Completed before the pending status change were ever counted.
+    """
+    history = inspect(approval).attrs.status.history
+    previous = history.deleted[0] if history.deleted else approval.status
+    if previous != "Completed":
+        return
+    _apply_claims([approval.approval_id], -1)
+
+def remove_claims_from_rollup(approval_ids):
+    """Take completed claims that are about to be deleted out of the rollup."""
+    if approval_ids:
+        _apply_claims(list(approval_ids), -1)
+
+def _move_lecturer_buckets(session, flush_context, instances):
+    """before_flush: refile the buckets of lecturers whose department changes under the new one."""
+    moved = {
+        obj.lecturer_id: obj.department_id
+        for obj in session.dirty
+        if isinstance(obj, Lecturer) and obj.lecturer_id is not None
+        and inspect(obj).attrs.department_id.history.has_changes()
+    }
+    if not moved:
+        return
+
+    with session.no_autoflush:
+        for lecturer_id, department_id in moved.items():
+            session.query(ClaimMonthlyTotal).filter(ClaimMonthlyTotal.lecturer_id == lecturer_id).update(
+                {ClaimMonthlyTotal.department_id: department_id or None}, synchronize_session=False
+            )
+    logger.info(f"Moved claim rollup buckets of {len(moved)} lecturer(s) to their new department")
+
+event.listen(Session, "before_flush", _move_lecturer_buckets)
+
+def detach_department_buckets(department_ids):
+    """
+    Before departments are deleted: their lecturers are left without one
+    (ON DELETE SET NULL), so refile their buckets under no department instead
+    of letting the cascade drop them. Caller commits.
+    """
+    if department_ids:
+        ClaimMonthlyTotal.query.filter(ClaimMonthlyTotal.department_id.in_(list(department_ids))).update(
+            {ClaimMonthlyTotal.department_id: None}, synchronize_session=False
+        )
+
+def rebuild_claim_rollup():
+    """
+    Recompute claim_monthly_total from lecturer_claim and replace it.
+    Returns (buckets, mismatches) where mismatches lists the buckets whose
+    stored totals differed from the source before the rebuild.
+    """
+    source = {
+        (dept_id, lecturer_id, int(year), int(month)): (int(total or 0), int(count))
+        for dept_id, lecturer_id, year, month, total, count in (
+            _monthly_claim_query()
+            .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
+            .filter(ClaimApproval.status == "Completed")
+            .all()
+        )
+    }
+    stored = {
+        (t.department_id, t.lecturer_id, t.year, t.month): (t.total_claims or 0, t.claim_rows or 0)
+        for t in ClaimMonthlyTotal.query.all()
+    }
+
+    mismatches = [
+        {"key": key, "stored": stored.get(key), "source": source.get(key)}
+        for key in sorted(set(source) | set(stored), key=lambda k: (k[0] or 0, k[1], k[2], k[3]))
+        if stored.get(key) != source.get(key)
+    ]
+
+    ClaimMonthlyTotal.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(ClaimMonthlyTotal, [
+        {
+            "department_id": dept_id, "lecturer_id": lecturer_id,
+            "year": year, "month": month,
+            "total_claims": total, "claim_rows": count
+        }
+        for (dept_id, lecturer_id, year, month), (total, count) in source.items()
+    ])
+    db.session.commit()
+
+    logger.info(f"Rebuilt claim rollup: {len(source)} buckets, {len(mismatches)} mismatches")
+    return len(source), mismatches
@@ -1,63 +1,406 @@
-import logging, time
+import logging, os, random, threading, time
 from app import db
+from flask import g, has_app_context
 from functools import wraps
-from sqlalchemy import text
-from sqlalchemy.exc import OperationalError, StatementError
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError, OperationalError
+from werkzeug.exceptions import ServiceUnavailable
 
 logger = logging.getLogger(__name__)
 
+# ============================================================
+#  Connection Health (pool-level liveness)
+# ============================================================
+# Pooled connections are only verified on checkout when they have been idle
+# longer than DB_STALE_SECONDS. Fresh connections are handed out without a
+# round trip to MySQL. A light keep-alive thread stops the pool going cold
+# between bursts of traffic, and logs the ping counters every
+# DB_HEALTH_LOG_SECONDS; admins can also read them from /api/db_health.
+_health_lock = threading.Lock()
+_health_stats = {
+    'pings_performed': 0,
+    'pings_skipped': 0,
+    'ping_failures': 0,
+    'keepalive_runs': 0,
+    'keepalive_failures': 0,
+}
+_health_config = {
+    'stale_seconds': 30,
+    'keepalive_seconds': 0,
+    'log_seconds': 0,
+}
+_keepalive_pid = None
+
+def _bump(counter, amount=1):
+    with _health_lock:
+        _health_stats[counter] += amount
+
+def get_connection_health_stats():
+    """Return a snapshot of ping/keep-alive counters for this worker process."""
+    with _health_lock:
+        return dict(_health_stats)
+
+def _ping_dbapi_connection(dbapi_connection):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    finally:
+        cursor.close()
+
+def _on_connect(dbapi_connection, connection_record):
+    # A brand-new connection has just been verified by the handshake
+    connection_record.info['last_used'] = time.monotonic()
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _ensure_keepalive_started()
+
+    last_used = connection_record.info.get('last_used')
+    idle_for = time.monotonic() - last_used if last_used is not None else None
+
+    if idle_for is not None and idle_for < _health_config['stale_seconds']:
+        _bump('pings_skipped')
+        return
+
+    _bump('pings_performed')
+    try:
+        _ping_dbapi_connection(dbapi_connection)
+    except Exception as e:
+        _bump('ping_failures')
+        logger.warning(f"[BACKEND] Stale pooled connection failed liveness check: {e}")
+        # Tells the pool to discard this connection and hand out a fresh one
+        raise DisconnectionError() from e
+
+    connection_record.info['last_used'] = time.monotonic()
+
+def _on_checkin(dbapi_connection, connection_record):
+    if dbapi_connection is not None:
+        connection_record.info['last_used'] = time.monotonic()
+
+def _keepalive_loop(engine, interval):
+    last_logged = time.monotonic()
+    while True:
+        time.sleep(interval)
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql('SELECT 1')
+            _bump('keepalive_runs')
+        except Exception as e:
+            _bump('keepalive_failures')
+            logger.warning(f"[BACKEND] Database keep-alive failed: {e}")
+
+        log_seconds = _health_config['log_seconds']
+        if log_seconds and time.monotonic() - last_logged >= log_seconds:
+            last_logged = time.monotonic()
+            logger.info(f"[BACKEND] Connection health (pid {os.getpid()}): {get_connection_health_stats()}")
+
+def _ensure_keepalive_started():
+    """Start the keep-alive thread once per process (safe across gunicorn forks)."""
+    global _keepalive_pid
+    interval = _health_config['keepalive_seconds']
+    if not interval or _keepalive_pid == os.getpid():
+        return
+
+    with _health_lock:
+        if _keepalive_pid == os.getpid():
+            return
+        _keepalive_pid = os.getpid()
+
+    thread = threading.Thread(
+        target=_keepalive_loop,
+        args=(_health_config['engine'], interval),
+        name='db-keepalive',
+        daemon=True
+    )
+    thread.start()
+    logger.info(f"[BACKEND] Database keep-alive started (every {interval}s).")
+
+def init_connection_health(app):
+    """
+    Register checkout/checkin listeners on the app's engine.
+    Replaces both pool_pre_ping and the per-request 'SELECT 1' check.
+    """
+    _health_config['stale_seconds'] = app.config.get('DB_STALE_SECONDS', 30)
+    _health_config['keepalive_seconds'] = app.config.get('DB_KEEPALIVE_SECONDS', 0)
+    _health_config['log_seconds'] = app.config.get('DB_HEALTH_LOG_SECONDS', 0)
+
+    with app.app_context():
+        engine = db.engine
+
+    _health_config['engine'] = engine
+    event.listen(engine, 'connect', _on_connect)
+    event.listen(engine, 'checkout', _on_checkout)
+    event.listen(engine, 'checkin', _on_checkin)
+    logger.debug("[BACKEND] Connection health listeners registered.")
+
+# ============================================================
+#  Retry Policy & Circuit Breaker
+# ============================================================
+_retry_config = {
+    'budget_seconds': 5.0,     # stop retrying once this much time has been spent
+    'base_delay': 0.1,         # first backoff step
+    'max_delay': 2.0,          # cap for a single backoff step
+}
+
+class CircuitBreaker:
+    """
+    Tracks consecutive database failures across requests in this worker.
+    While open, requests are rejected immediately instead of queuing on the pool.
+    After `reset_seconds` a single trial request is let through (half-open).
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("[BACKEND] Database circuit breaker closed.")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error(f"[BACKEND] Database circuit breaker opened after {self.failures} failure(s).")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.trial_in_flight = False
+
+    def release_trial(self):
+        """Let the next request act as the trial when the current one failed for a non-DB reason."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def retry_after(self):
+        """Seconds until the next trial request is allowed (for the Retry-After header)."""
+        with self._lock:
+            if self.state != self.OPEN or self.opened_at is None:
+                return 1
+            remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+            return max(1, int(remaining + 0.999))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+            }
+
+db_breaker = CircuitBreaker()
+
+def init_retry_policy(app):
+    """Load retry and circuit breaker settings from app.config."""
+    _retry_config['budget_seconds'] = app.config.get('DB_RETRY_BUDGET_SECONDS', 5.0)
+    _retry_config['base_delay'] = app.config.get('DB_RETRY_BASE_DELAY', 0.1)
+    _retry_config['max_delay'] = app.config.get('DB_RETRY_MAX_DELAY', 2.0)
+    db_breaker.failure_threshold = app.config.get('DB_BREAKER_FAILURE_THRESHOLD', 5)
+    db_breaker.reset_seconds = app.config.get('DB_BREAKER_RESET_SECONDS', 30)
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given (0-based) retry attempt."""
+    ceiling = min(_retry_config['max_delay'], _retry_config['base_delay'] * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+def invalidate_failed_connection():
+    """
+    Discard only the connection(s) held by the current session, instead of
+    disposing the whole pool for every worker thread.
+    """
+    try:
+        db.session.invalidate()
+    except Exception as e:
+        logger.warning(f"[BACKEND] Failed to invalidate session connection: {e}")
+    finally:
+        db.session.remove()
+
+def _reject_while_db_down():
+    raise ServiceUnavailable(
+        description="The database is temporarily unavailable. Please try again shortly.",
+        retry_after=db_breaker.retry_after()
+    )
+
+# ============================================================
+#  Unit of Work (side effects vs. DB transaction)
+# ============================================================
+# Slow external side effects (Excel generation, Drive uploads, emails) must not
+# be repeated when handle_db_connection retries a view because the DB part failed.
+# Inside a unit of work:
+#   - unit_of_work_step() runs a side effect once and hands the stored result back
+#     on every retry of the same request;
+#   - defer_until_commit() holds callbacks (e.g. notification emails) until the
+#     transaction has committed;
+#   - compensations registered with a step undo its artefact if the request
+#     ultimately fails (e.g. delete an uploaded Drive file).
+def _current_unit_of_work():
+    if not has_app_context():
+        return None
+    return g.get('_unit_of_work')
+
+def unit_of_work_active():
+    """True inside a handle_db_connection call, whose session is committed when the view returns."""
+    return _current_unit_of_work() is not None
+
+def unit_of_work_step(key, fn, *args, compensate=None, **kwargs):
+    """
+    Run a side-effecting step once per unit of work and return its result.
+    Retries of the same request reuse the stored result instead of calling `fn` again.
+    `compensate(result)` is called if the request ultimately fails.
+    """
+    uow = _current_unit_of_work()
+    if uow is None:
+        return fn(*args, **kwargs)
+
+    if key in uow['steps']:
+        logger.info(f"[BACKEND] Reusing result of step '{key}' on retry.")
+        return uow['steps'][key]
+
+    result = fn(*args, **kwargs)
+    uow['steps'][key] = result
+    if compensate is not None:
+        uow['compensations'].append((key, compensate, result))
+    return result
+
+def defer_until_commit(fn, *args, **kwargs):
+    """Queue `fn` to run after the transaction commits (runs immediately outside a unit of work)."""
+    uow = _current_unit_of_work()
+    if uow is None:
+        return fn(*args, **kwargs)
+    uow['deferred'].append((fn, args, kwargs))
+
+def rollback_unit_of_work():
+    """
+    Roll back the session and undo completed side-effect steps.
+    For views that catch their own errors instead of letting them reach the decorator.
+    """
+    db.session.rollback()
+    uow = _current_unit_of_work()
+    if uow is not None:
+        _run_compensations(uow)
+
+def _run_deferred(uow):
+    deferred, uow['deferred'] = uow['deferred'], []
+    # The transaction is over: callbacks (and anything they defer) run on their own
+    g.pop('_unit_of_work', None)
+    for fn, args, kwargs in deferred:
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"[BACKEND] Post-commit step '{getattr(fn, '__name__', fn)}' failed: {e}")
+
+def _run_compensations(uow):
+    compensations, uow['compensations'] = uow['compensations'], []
+    uow['steps'].clear()
+    uow['deferred'] = []
+    for key, compensate, result in reversed(compensations):
+        try:
+            compensate(result)
+            logger.info(f"[BACKEND] Compensated step '{key}'.")
+        except Exception as e:
+            logger.warning(f"[BACKEND] Compensation for step '{key}' failed: {e}")
+
+# ============================================================
+#  Route Decorator
+# ============================================================
 def handle_db_connection(f):
     """
     Decorator that ensures a stable database connection for any Flask route or function.
-    Automatically retries failed connections up to 3 times before raising an error.
+    Liveness is handled by the pool on checkout; a real OperationalError invalidates only
+    the failed connection and is retried with jittered exponential backoff until the
+    retry time budget runs out. While the circuit breaker is open, requests fail fast with 503.
+    Each call runs as a unit of work, so retries replay only the DB part of the view.
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        max_retries = 3
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                # Verify DB connection
-                db.session.execute(text('SELECT 1'))
-                logger.debug("[BACKEND] Database connection check successful.")
-
-                # Execute the wrapped function
-                result = f(*args, **kwargs)
-
-                # Commit if no issues
-                db.session.commit()
-                logger.debug("[BACKEND] Database transaction committed successfully.")
-                return result
-
-            except (OperationalError, StatementError) as e:
-                db.session.rollback()
-                logger.warning(
-                    f"[BACKEND] Database operational/statement error: {e}. "
-                    f"Attempt {retry_count + 1} of {max_retries}."
-                )
-
-                # Retry logic
-                if retry_count < max_retries - 1:
-                    retry_count += 1
-                    time.sleep(0.5)  # Short delay before retry
-                    db.session.remove()
-                    db.engine.dispose()
-                    logger.info("[BACKEND] Retrying database connection...")
-                    continue
-                else:
-                    logger.error(f"[BACKEND] Database connection failed after {max_retries} retries: {e}")
-                    raise
+        if not db_breaker.allow_request():
+            logger.warning(f"[BACKEND] Circuit open, shedding '{f.__name__}' with 503.")
+            _reject_while_db_down()
 
-            except Exception as e:
-                # Catch-all for other errors
-                db.session.rollback()
-                logger.error(f"[BACKEND] Unexpected database error in function '{f.__name__}': {e}")
-                raise
+        # Nested decorated calls share the outer unit of work
+        owns_unit_of_work = has_app_context() and _current_unit_of_work() is None
+        if owns_unit_of_work:
+            g._unit_of_work = {'steps': {}, 'deferred': [], 'compensations': []}
+        uow = _current_unit_of_work()
 
-        # Fallback (should not reach here)
-        logger.critical("[BACKEND] Unexpected code path reached in handle_db_connection.")
-        return f(*args, **kwargs)
+        started = time.monotonic()
+        attempt = 0
+
+        try:
+            while True:
+                try:
+                    # Execute the wrapped function
+                    result = f(*args, **kwargs)
+
+                    # Commit if no issues
+                    db.session.commit()
+                    db_breaker.record_success()
+                    logger.debug("[BACKEND] Database transaction committed successfully.")
+
+                    if owns_unit_of_work:
+                        _run_deferred(uow)
+                    return result
+
+                except OperationalError as e:
+                    logger.warning(
+                        f"[BACKEND] Database operational error in '{f.__name__}': {e}. "
+                        f"Attempt {attempt + 1}."
+                    )
+                    invalidate_failed_connection()
+                    if uow is not None:
+                        uow['deferred'] = []  # the retry queues them again
+
+                    delay = backoff_delay(attempt)
+                    elapsed = time.monotonic() - started
+                    if elapsed + delay > _retry_config['budget_seconds']:
+                        db_breaker.record_failure()
+                        logger.error(
+                            f"[BACKEND] Giving up on '{f.__name__}' after {attempt + 1} attempt(s) "
+                            f"in {elapsed:.2f}s: {e}"
+                        )
+                        if owns_unit_of_work:
+                            _run_compensations(uow)
+                        raise
+
+                    attempt += 1
+                    time.sleep(delay)
+                    logger.info(f"[BACKEND] Retrying '{f.__name__}' after {delay:.2f}s backoff...")
+
+                except Exception as e:
+                    # Catch-all for other errors
+                    db.session.rollback()
+                    db_breaker.release_trial()
+                    if owns_unit_of_work:
+                        _run_compensations(uow)
+                    logger.error(f"[BACKEND] Unexpected database error in function '{f.__name__}': {e}")
+                    raise
+        finally:
+            if owns_unit_of_work:
+                g.pop('_unit_of_work', None)
 
     return decorated_function
 
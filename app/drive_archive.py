@@ -0,0 +1,561 @@
+import io, logging, os, random, re, threading, time, uuid, zipfile
+from app import app, db
+from app.models import ClaimApproval, LecturerClaim, LecturerSubject, RequisitionApproval
+from app.storage import get_storage
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from dateutil.relativedelta import relativedelta
+from googleapiclient.errors import HttpError
+from openpyxl import load_workbook
+from openpyxl.utils.protection import hash_password
+from openpyxl.workbook.protection import WorkbookProtection
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Workbook Protection
+# ============================================================
+# Approval workbooks are locked before they go into an archive
+APP_SHEET_PW = os.environ.get("EXCEL_SHEET_PW", "approval_excel_sheet_password")
+APP_BOOK_PW  = os.environ.get("EXCEL_BOOK_PW", "approval_workbook_password")
+
+def protect_excel_bytes(xlsx_bytes: bytes,
+                        sheet_password: str | None = None,
+                        workbook_password: str | None = None) -> bytes:
+    """
+    - Locks every sheet (no edits).
+    - Optionally sets sheet and workbook structure passwords.
+    - Returns protected XLSX bytes.
+    """
+    bio = io.BytesIO(xlsx_bytes)
+    wb = load_workbook(bio, data_only=False)
+
+    for ws in wb.worksheets:
+        # Lock the sheet and disallow edits
+        ws.protection.sheet = True
+        ws.protection.enable()
+        ws.protection.formatCells = False
+        ws.protection.formatColumns = False
+        ws.protection.formatRows = False
+        ws.protection.insertColumns = False
+        ws.protection.insertRows = False
+        ws.protection.insertHyperlinks = False
+        ws.protection.deleteColumns = False
+        ws.protection.deleteRows = False
+        ws.protection.sort = False
+        ws.protection.autoFilter = False
+        ws.protection.pivotTables = False
+        ws.protection.objects = True
+        ws.protection.scenarios = True
+        # Allow selecting cells so users can view content comfortably
+        ws.protection.selectLockedCells = True
+        ws.protection.selectUnlockedCells = True
+
+        if sheet_password:
+            # Sets hashed password inside the file (no prompt unless unprotecting)
+            ws.protection.set_password(sheet_password)
+
+    # Protect workbook structure (e.g., adding/removing sheets)
+    wb.security = WorkbookProtection(lockStructure=True, lockWindows=False)
+    if workbook_password:
+        wb.security.workbookPassword = hash_password(workbook_password)
+
+    out = io.BytesIO()
+    wb.save(out)
+    out.seek(0)
+    return out.read()
+
+def _with_extension(arcname, ext):
+    if not arcname.lower().endswith(ext):
+        base, _, _ = arcname.rpartition(".")
+        arcname = (base or arcname) + ext
+    return arcname
+
+# ============================================================
+#  Archive Fetch Pipeline
+# ============================================================
+# Archive files are fetched from storage (app.storage) by a bounded thread pool
+# (on Drive each thread uses its own cached client) and written to the ZIP in
+# the order they were listed. At most DRIVE_FETCH_WORKERS * 2 fetched files are
+# held in memory at once. On Drive every request goes through one shared rate
+# limiter, and transient errors are retried with backoff before the archive
+# is abandoned.
+
+# kind: "approval" (workbook, exported to XLSX and protected) or "attachment" (PDF)
+ArchiveItem = namedtuple("ArchiveItem", "arcname url kind")
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class RateLimiter:
+    """Token bucket shared by all fetch threads: `rate` requests per second, bursts up to `rate`."""
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class ArchiveMetrics:
+    """Counters and per-stage seconds for one archive build, safe to update from fetch threads."""
+    STAGES = ("metadata", "download", "protect", "write", "delete", "throttled", "backoff")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.skipped = 0
+        self.bytes_fetched = 0
+        self.bytes_written = 0
+        self.retries = 0
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.started = time.perf_counter()
+
+    def add(self, stage=None, seconds=0.0, **counters):
+        with self.lock:
+            if stage:
+                self.seconds[stage] += seconds
+            for name, amount in counters.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "files": self.files,
+                "skipped": self.skipped,
+                "bytes_fetched": self.bytes_fetched,
+                "bytes_written": self.bytes_written,
+                "retries": self.retries,
+                "seconds": {stage: round(value, 3) for stage, value in self.seconds.items()},
+                "wall_seconds": round(time.perf_counter() - self.started, 3),
+            }
+
+def _is_retryable(error):
+    if isinstance(error, HttpError):
+        status = getattr(error.resp, "status", None)
+        if status in RETRYABLE_STATUSES:
+            return True
+        # Drive reports quota exhaustion as 403 rateLimitExceeded / userRateLimitExceeded
+        return status == 403 and b"ateLimitExceeded" in (error.content or b"")
+    return isinstance(error, (OSError, TimeoutError))
+
+def storage_call(fn, limiter, metrics, stage, label):
+    """Run one storage request under the rate limiter, retrying transient errors with backoff."""
+    attempts = app.config['DRIVE_FETCH_RETRIES'] + 1
+    for attempt in range(attempts):
+        metrics.add("throttled", limiter.acquire())
+        start = time.perf_counter()
+        try:
+            result = fn()
+            metrics.add(stage, time.perf_counter() - start)
+            return result
+        except Exception as e:
+            metrics.add(stage, time.perf_counter() - start)
+            if attempt == attempts - 1 or not _is_retryable(e):
+                raise
+            delay = random.uniform(0, min(app.config['DRIVE_FETCH_MAX_DELAY'], app.config['DRIVE_FETCH_BASE_DELAY'] * (2 ** attempt)))
+            logger.warning(f"Storage {stage} failed for {label} ({e}); retry {attempt + 1} in {delay:.1f}s")
+            metrics.add("backoff", delay, retries=1)
+            time.sleep(delay)
+
+def _request_rate(rate):
+    """Shared request budget: DRIVE_REQUESTS_PER_SECOND on Drive, unlimited for local/S3 storage."""
+    if rate is not None:
+        return rate
+    return app.config['DRIVE_REQUESTS_PER_SECOND'] if get_storage().name == "drive" else 0
+
+def fetch_archive_item(item, limiter, metrics):
+    """Fetch one archive file; returns (arcname, bytes), or None when the URL is not in storage."""
+    storage = get_storage()
+    file_id = storage.file_id_from_url(item.url)
+    if not file_id:
+        metrics.add(skipped=1)
+        return None
+
+    meta = storage_call(lambda: storage.describe(file_id), limiter, metrics, "metadata", item.arcname)
+
+    if item.kind == "approval":
+        # Google Sheets are exported to XLSX; stored workbooks are already Excel files
+        data = storage_call(lambda: storage.read_bytes(file_id, meta["export_mime"]), limiter, metrics, "download", item.arcname)
+
+        start = time.perf_counter()
+        data = protect_excel_bytes(data, sheet_password=APP_SHEET_PW, workbook_password=APP_BOOK_PW)
+        metrics.add("protect", time.perf_counter() - start)
+        arcname = _with_extension(item.arcname, ".xlsx")
+    elif meta["export_mime"]:
+        # Google-native → export to PDF
+        data = storage_call(lambda: storage.read_bytes(file_id, meta["export_mime"]), limiter, metrics, "download", item.arcname)
+        arcname = _with_extension(item.arcname, ".pdf")
+    else:
+        # Stored binary (already a PDF) → raw bytes
+        data = storage_call(lambda: storage.read_bytes(file_id), limiter, metrics, "download", item.arcname)
+        arcname = item.arcname
+
+    metrics.add(bytes_fetched=len(data))
+    return arcname, data
+
+def write_archive(zf, items, workers=None, rate=None, on_progress=None):
+    """
+    Fetch `items` concurrently and write them into the open ZipFile `zf` in list
+    order. Raises the first fetch error (after retries). Returns the metrics summary.
+    on_progress(done, total) is called from this thread after each item.
+    """
+    workers = workers or app.config['DRIVE_FETCH_WORKERS']
+    limiter = RateLimiter(_request_rate(rate))
+    metrics = ArchiveMetrics()
+    window = deque()
+    items = list(items)
+    done = 0
+
+    def write(future):
+        nonlocal done
+        result = future.result()
+        done += 1
+        if result is not None:
+            arcname, data = result
+            start = time.perf_counter()
+            zf.writestr(arcname, data)
+            metrics.add("write", time.perf_counter() - start, files=1, bytes_written=len(data))
+        if on_progress:
+            on_progress(done, len(items))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storage-fetch") as pool:
+        try:
+            for item in items:
+                window.append(pool.submit(fetch_archive_item, item, limiter, metrics))
+                if len(window) >= workers * 2:
+                    write(window.popleft())
+            while window:
+                write(window.popleft())
+        except Exception:
+            for future in window:
+                future.cancel()
+            raise
+
+    summary = metrics.summary()
+    logger.info(f"Archive built: {summary}")
+    return summary
+
+# ============================================================
+#  Archive Files (on disk, resumable)
+# ============================================================
+# Archives are written entry by entry straight into a file under
+# app/temp/archives instead of an in-memory buffer, so memory stays bounded
+# by the fetch window whatever the archive size. Finished archives are kept
+# for ARCHIVE_RETENTION_SECONDS and served with Range support, so an
+# interrupted download can resume from GET /api/archives/<archive_id>.
+# Once the folder holds more than ARCHIVE_MAX_BYTES the oldest are evicted.
+ARCHIVE_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), "temp", "archives")
+_ARCHIVE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+def prune_archives(max_age=None, max_bytes=None, keep=None):
+    """
+    Delete archives (and abandoned partial files) older than the retention period,
+    then evict the oldest finished archives until the folder fits in max_bytes.
+    The archive `keep` is never evicted for size.
+    """
+    max_age = app.config['ARCHIVE_RETENTION_SECONDS'] if max_age is None else max_age
+    max_bytes = app.config['ARCHIVE_MAX_BYTES'] if max_bytes is None else max_bytes
+    if not os.path.isdir(ARCHIVE_FOLDER):
+        return 0
+
+    removed = 0
+    cutoff = time.time() - max_age
+    remaining = []
+    for name in os.listdir(ARCHIVE_FOLDER):
+        path = os.path.join(ARCHIVE_FOLDER, name)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime < cutoff:
+                os.remove(path)
+                removed += 1
+            else:
+                remaining.append((stat.st_mtime, stat.st_size, name, path))
+        except FileNotFoundError:
+            pass  # removed by another worker
+
+    total = sum(size for _, size, _, _ in remaining)
+    for mtime, size, name, path in sorted(remaining):
+        if total <= max_bytes:
+            break
+        # Partial files belong to builds still in progress
+        if not name.endswith(".zip") or name == f"{keep}.zip":
+            continue
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    if removed:
+        logger.info(f"Pruned {removed} expired archive file(s)")
+    return removed
+
+def build_archive_file(items, on_progress=None):
+    """
+    Fetch `items` into a new ZIP file under ARCHIVE_FOLDER.
+    Returns (archive_id, path, metrics summary).
+    """
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    prune_archives()
+
+    archive_id = uuid.uuid4().hex
+    path = os.path.join(ARCHIVE_FOLDER, f"{archive_id}.zip")
+    part_path = path + ".part"
+    try:
+        with open(part_path, "wb") as fh, zipfile.ZipFile(fh, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            metrics = write_archive(zf, items, on_progress=on_progress)
+        os.replace(part_path, path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    metrics["archive_bytes"] = os.path.getsize(path)
+    logger.info(f"Archive {archive_id} written: {metrics['archive_bytes']} bytes")
+    prune_archives(keep=archive_id)
+    return archive_id, path, metrics
+
+def get_archive_path(archive_id):
+    """Path of a finished archive, or None if the id is malformed or the file has expired."""
+    if not archive_id or not _ARCHIVE_ID.match(archive_id):
+        return None
+    path = os.path.join(ARCHIVE_FOLDER, f"{archive_id}.zip")
+    return path if os.path.isfile(path) else None
+
+# ============================================================
+#  Archive Contents
+# ============================================================
+# A requisition is archived once it is Completed, its last subject ended at
+# least ARCHIVE_AGE_MONTHS ago and it has been fully claimed. Its files and
+# those of its completed claims are laid out as:
+#
+#   Requisition_{dd MMM yyyy}/<Department>/Approvals/*.xlsx
+#                                         /Attachments/*.pdf
+#   Claim_{dd MMM yyyy}/<Department>/Approvals/*.xlsx
+#                                   /Attachments/*.pdf
+ARCHIVE_AGE_MONTHS = 4
+
+def safe_name(s: str) -> str: 
+    if not s: 
+        return "Unknown" 
+    return re.sub(r'[\\/:*?"<>|\r\n]+', '_', s).strip() 
+
+def format_dd_MMM_yyyy(d: date) -> str: 
+    return d.strftime('%d %b %Y')
+
+def archive_download_name(d: date) -> str:
+    return f"Approvals and Attachments_{format_dd_MMM_yyyy(d)}.zip"
+
+def get_requisition_base_query(cutoff_date):
+    """Return the base query for eligible requisitions based on shared conditions."""
+    # LecturerSubject aggregation
+    ls_agg = (
+        db.session.query(
+            LecturerSubject.requisition_id.label('rid'),
+            func.max(LecturerSubject.end_date).label('max_end'),
+            func.coalesce(func.sum(LecturerSubject.total_cost), 0).label('ls_total')
+        )
+        .group_by(LecturerSubject.requisition_id)
+        .subquery()
+    )
+
+    # LecturerClaim aggregation
+    lc_agg = (
+        db.session.query(
+            LecturerClaim.requisition_id.label('rid'),
+            func.coalesce(func.sum(LecturerClaim.total_cost), 0).label('lc_total')
+        )
+        .group_by(LecturerClaim.requisition_id)
+        .subquery()
+    )
+
+    # Main filter query
+    q = (
+        db.session.query(RequisitionApproval, ls_agg.c.max_end, ls_agg.c.ls_total,
+                         func.coalesce(lc_agg.c.lc_total, 0).label('lc_total'))
+        .join(ls_agg, ls_agg.c.rid == RequisitionApproval.approval_id)
+        .outerjoin(lc_agg, lc_agg.c.rid == RequisitionApproval.approval_id)
+        .filter(func.lower(func.coalesce(RequisitionApproval.status, '')) == 'completed')
+        .filter(ls_agg.c.max_end <= cutoff_date)
+        .filter((ls_agg.c.ls_total - func.coalesce(lc_agg.c.lc_total, 0)) == 0)
+    )
+    return q
+
+# An eligible requisition with its completed claims; department, attachments
+# and claim attachments are already loaded
+ArchiveRequisition = namedtuple("ArchiveRequisition", "requisition claims")
+
+def load_completed_claims(req_ids):
+    """Completed ClaimApprovals (with attachments) per requisition id, in two round trips."""
+    claims_by_req = {rid: [] for rid in req_ids}
+    if not req_ids:
+        return claims_by_req
+
+    links = (
+        db.session.query(LecturerClaim.requisition_id, LecturerClaim.claim_id)
+        .filter(LecturerClaim.requisition_id.in_(list(req_ids)))
+        .distinct()
+        .all()
+    )
+    claim_ids = {cid for _, cid in links}
+    if not claim_ids:
+        return claims_by_req
+
+    claims = {
+        ca.approval_id: ca
+        for ca in ClaimApproval.query
+        .options(selectinload(ClaimApproval.claim_attachments))
+        .filter(ClaimApproval.approval_id.in_(list(claim_ids)))
+        .filter(func.lower(func.coalesce(ClaimApproval.status, '')) == 'completed')
+        .order_by(ClaimApproval.approval_id)
+        .all()
+    }
+    for rid, cid in sorted(links):
+        if cid in claims:
+            claims_by_req[rid].append(claims[cid])
+    return claims_by_req
+
+def get_archivable_requisitions(today):
+    """
+    ArchiveRequisitions eligible for archiving on `today`, loaded in a fixed
+    number of queries however many requisitions qualify.
+    """
+    cutoff = today - relativedelta(months=ARCHIVE_AGE_MONTHS)
+    requisitions = [
+        req for req, max_end, ls_total, lc_total in get_requisition_base_query(cutoff)
+        .options(joinedload(RequisitionApproval.department), selectinload(RequisitionApproval.requisition_attachments))
+        .order_by(RequisitionApproval.approval_id)
+        .all()
+    ]
+    claims_by_req = load_completed_claims([req.approval_id for req in requisitions])
+    return [ArchiveRequisition(req, claims_by_req[req.approval_id]) for req in requisitions]
+
+def collect_archive_items(rows, today):
+    """List the ArchiveItems for the eligible ArchiveRequisitions (no queries or storage calls)."""
+    stamp = format_dd_MMM_yyyy(today)
+    req_root = f"Requisition_{stamp}"
+    claim_root = f"Claim_{stamp}"
+    items = []
+
+    for req, claims in rows:
+        dept_name = safe_name(
+            getattr(req.department, 'department_code', None) or
+            getattr(req.department, 'department_name', None) or
+            "Unknown_Department"
+        )
+
+        # Requisition approval XLSX
+        if req.file_url and (req.file_name or '').lower().endswith(('.xlsx', '.xlsm', '.xls')):
+            items.append(ArchiveItem(f"{req_root}/{dept_name}/Approvals/{safe_name(req.file_name)}", req.file_url, "approval"))
+
+        # Requisition attachments (PDF)
+        for att in (req.requisition_attachments or []):
+            if att.attachment_url and (att.attachment_name or '').lower().endswith('.pdf'):
+                items.append(ArchiveItem(f"{req_root}/{dept_name}/Attachments/{safe_name(att.attachment_name)}", att.attachment_url, "attachment"))
+
+        # Claim approvals & attachments
+        for ca in claims:
+            if ca.file_url and (ca.file_name or '').lower().endswith(('.xlsx', '.xlsm', '.xls')):
+                items.append(ArchiveItem(f"{claim_root}/{dept_name}/Approvals/{safe_name(ca.file_name)}", ca.file_url, "approval"))
+            for catt in (ca.claim_attachments or []):
+                if catt.attachment_url and (catt.attachment_name or '').lower().endswith('.pdf'):
+                    items.append(ArchiveItem(f"{claim_root}/{dept_name}/Attachments/{safe_name(catt.attachment_name)}", catt.attachment_url, "attachment"))
+
+    return items
+
+# ============================================================
+#  Batched Storage Deletions
+# ============================================================
+# Cleanup deletes files through the storage backend's delete_batch: on Drive
+# up to DRIVE_DELETE_BATCH_SIZE deletes per batch HTTP request, with up to
+# DRIVE_FETCH_WORKERS batches in flight under one rate limiter. Each file
+# gets its own outcome, and files failing with a transient error are retried
+# in a later batch, so callers can keep the records whose files are still
+# stored.
+
+# Outcomes that mean the file is no longer stored
+DELETED_OUTCOMES = ("deleted", "missing", "skipped")
+
+def delete_stored_files(urls, workers=None, rate=None):
+    """
+    Delete the stored files behind `urls`. Returns {url: outcome} where outcome is
+    "deleted", "missing" (already gone), "skipped" (not a storage URL) or "failed".
+    """
+    workers = workers or app.config['DRIVE_FETCH_WORKERS']
+    batch_size = app.config['DRIVE_DELETE_BATCH_SIZE']
+    limiter = RateLimiter(_request_rate(rate))
+    metrics = ArchiveMetrics()
+    storage = get_storage()
+
+    outcomes = {}
+    urls_by_id = {}
+    for url in urls:
+        file_id = storage.file_id_from_url(url) if url else None
+        if file_id:
+            urls_by_id.setdefault(file_id, []).append(url)
+        else:
+            outcomes[url] = "skipped"
+
+    file_outcomes = {}
+    pending = list(urls_by_id)
+    attempts = app.config['DRIVE_FETCH_RETRIES'] + 1
+    for attempt in range(attempts):
+        if not pending:
+            break
+        if attempt:
+            delay = random.uniform(0, min(app.config['DRIVE_FETCH_MAX_DELAY'], app.config['DRIVE_FETCH_BASE_DELAY'] * (2 ** (attempt - 1))))
+            logger.warning(f"Retrying {len(pending)} storage delete(s) in {delay:.1f}s")
+            metrics.add("backoff", delay, retries=len(pending))
+            time.sleep(delay)
+
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        retry = []
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches)), thread_name_prefix="storage-delete") as pool:
+            futures = {pool.submit(storage_call, lambda batch=batch: storage.delete_batch(batch), limiter, metrics, "delete", f"batch of {len(batch)}"): batch for batch in batches}
+            for future, batch in futures.items():
+                try:
+                    errors = future.result()
+                except Exception as e:
+                    # The batch request itself failed after retries; nothing in it is known to be deleted
+                    logger.error(f"Storage delete batch of {len(batch)} failed: {e}")
+                    errors = dict.fromkeys(batch, e)
+
+                for file_id in batch:
+                    error = errors.get(file_id)
+                    if error is None and file_id in errors:
+                        file_outcomes[file_id] = "deleted"
+                    elif isinstance(error, FileNotFoundError):
+                        file_outcomes[file_id] = "missing"
+                    elif error is not None and _is_retryable(error) and attempt < attempts - 1:
+                        retry.append(file_id)
+                    else:
+                        logger.error(f"Storage delete failed for {file_id}: {error}")
+                        file_outcomes[file_id] = "failed"
+        pending = retry
+
+    for file_id, file_urls in urls_by_id.items():
+        for url in file_urls:
+            outcomes[url] = file_outcomes.get(file_id, "failed")
+
+    counts = {}
+    for outcome in file_outcomes.values():
+        counts[outcome] = counts.get(outcome, 0) + 1
+    logger.info(f"Storage deletions: {counts} in {metrics.summary()['wall_seconds']}s ({metrics.retries} retried)")
+    return outcomes
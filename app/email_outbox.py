@@ -0,0 +1,251 @@
+import json, logging, os, random, re, requests, smtplib, socket, time
+from app import app, db, mail
+from app.attachment_cache import get_attachment_cache_stats, read_attachment
+from app.database import backoff_delay, unit_of_work_active
+from app.models import EmailOutbox
+from app.storage import get_storage
+from datetime import datetime, timedelta, timezone
+from flask_mail import Message
+from sqlalchemy import insert, update
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Email Outbox (DB-backed)
+# ============================================================
+# Request handlers never talk to SMTP: send_email only records an
+# email_outbox row. Inside a handle_db_connection view the row is part of the
+# view's transaction, so a rolled-back request sends nothing and a retried one
+# sends once; elsewhere (scheduled tasks, workers) it is inserted on its own.
+# run_email_worker.py drains the table: it claims up to
+# EMAIL_OUTBOX_BATCH_SIZE due rows with SELECT ... FOR UPDATE SKIP LOCKED,
+# reads their attachments through app.attachment_cache and sends them over
+# one SMTP connection that stays open between batches (Flask-Mail reconnects
+# after MAIL_MAX_EMAILS). Failed sends are retried with exponential backoff until
+# EMAIL_OUTBOX_MAX_ATTEMPTS; each row records its status, attempts and error.
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def outbox_values(recipients, subject, body, attachments=None):
+    """Column values for one email_outbox row, or None when there is nobody to send to."""
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    recipients = [r for r in dict.fromkeys(recipients or []) if r]
+    if not recipients:
+        logger.warning(f"Email '{subject}' has no recipients; not queued")
+        return None
+
+    now = _now()
+    return {
+        "recipients": json.dumps(recipients),
+        "subject": subject[:255],
+        "body": body,
+        "attachments": json.dumps([
+            {"filename": att.get("filename", "attachment.pdf"), "url": att.get("url")} for att in attachments
+        ]) if attachments else None,
+        "status": "Queued",
+        "attempts": 0,
+        "created_at": now,
+        "next_attempt_at": now,
+    }
+
+def enqueue_email(recipients, subject, body, attachments=None):
+    """
+    Queue an email for the outbox worker. attachments: list of dicts with
+    'filename' and 'url', fetched when the email is sent.
+    """
+    values = outbox_values(recipients, subject, body, attachments)
+    if values is None:
+        return False
+
+    if unit_of_work_active():
+        # Committed together with the view's own changes
+        db.session.add(EmailOutbox(**values))
+    else:
+        with db.engine.begin() as conn:
+            conn.execute(insert(EmailOutbox.__table__).values(**values))
+    logger.info(f"Queued email '{subject}' to {values['recipients']}")
+    return True
+
+# ============================================================
+#  Message Building
+# ============================================================
+# Drive share links (/file/d/<id>/view, /spreadsheets/d/<id>) held by rows written before a storage migration
+DRIVE_LINK_RE = re.compile(r"/d/([a-zA-Z0-9_-]+)")
+
+def _fetch_attachment(url):
+    """
+    Our own files are read through the attachment cache; anything else over HTTP.
+    Drive links are fetched from their direct download URL, since the share link
+    returns the viewer page.
+    """
+    storage = get_storage()
+    file_id = storage.file_id_from_url(url)
+    if file_id:
+        return read_attachment(storage, file_id)
+    m = DRIVE_LINK_RE.search(url or "")
+    if m:
+        url = f"https://drive.google.com/uc?export=download&id={m.group(1)}"
+    resp = requests.get(url, allow_redirects=True, timeout=15)
+    resp.raise_for_status()
+    return resp.content
+
+def build_message(row):
+    """Flask-Mail Message for an outbox row; attachments that cannot be fetched are skipped."""
+    msg = Message(row.subject, recipients=json.loads(row.recipients), body=row.body)
+    for att in json.loads(row.attachments or "[]"):
+        filename = att.get("filename") or "attachment.pdf"
+        try:
+            msg.attach(filename, "application/pdf", _fetch_attachment(att.get("url")))
+        except Exception as e:
+            logger.error(f"Failed to attach {filename} from {att.get('url')}: {e}")
+    return msg
+
+# ============================================================
+#  SMTP Session
+# ============================================================
+class SmtpSession:
+    """One Flask-Mail connection kept open across batches and closed after EMAIL_SMTP_IDLE_SECONDS."""
+    def __init__(self):
+        self.connection = None
+        self.last_used = 0.0
+
+    def send(self, msg):
+        if self.connection is None:
+            self.connection = mail.connect().__enter__()
+        try:
+            self.connection.send(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle connection; reconnect once and resend
+            self.close()
+            self.connection = mail.connect().__enter__()
+            self.connection.send(msg)
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self.connection is not None and time.monotonic() - self.last_used > app.config['EMAIL_SMTP_IDLE_SECONDS']:
+            self.close()
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.__exit__(None, None, None)
+            except Exception as e:
+                logger.debug(f"Closing SMTP connection failed: {e}")
+            self.connection = None
+
+# ============================================================
+#  Worker
+# ============================================================
+# Errors the server will not change its mind about; anything else is retried
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
+
+def _retry_delay(attempts):
+    """Seconds before the next attempt: exponential with jitter, capped."""
+    ceiling = min(app.config['EMAIL_OUTBOX_RETRY_MAX_DELAY'], app.config['EMAIL_OUTBOX_RETRY_BASE_DELAY'] * (2 ** (attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+def requeue_stale_emails():
+    """Put rows left in Sending by a worker that died mid-batch back in the queue."""
+    cutoff = _now() - timedelta(seconds=app.config['EMAIL_OUTBOX_STALE_SECONDS'])
+    result = db.session.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.status == "Sending", EmailOutbox.claimed_at < cutoff)
+        .values(status="Queued", worker=None)
+    )
+    db.session.commit()
+    if result.rowcount:
+        logger.warning(f"Requeued {result.rowcount} email(s) abandoned mid-send")
+    return result.rowcount
+
+def claim_email_batch(worker_id, limit):
+    """Lock up to `limit` due Queued rows for this worker."""
+    rows = (
+        EmailOutbox.query
+        .filter(EmailOutbox.status == "Queued", EmailOutbox.next_attempt_at <= _now())
+        .order_by(EmailOutbox.outbox_id.asc())
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    now = _now()
+    for row in rows:
+        row.status = "Sending"
+        row.worker = worker_id
+        row.claimed_at = now
+    db.session.commit()
+    return rows
+
+def deliver_batch(rows, smtp):
+    """Send claimed rows over `smtp`, recording each outcome. Returns (sent, failed)."""
+    sent = failed = 0
+    for row in rows:
+        row.attempts += 1
+        try:
+            smtp.send(build_message(row))
+            row.status = "Sent"
+            row.sent_at = _now()
+            row.last_error = None
+            sent += 1
+        except Exception as e:
+            smtp.close()  # start the next message on a fresh connection
+            row.last_error = f"{type(e).__name__}: {e}"[:255]
+            if isinstance(e, PERMANENT_ERRORS) or row.attempts >= app.config['EMAIL_OUTBOX_MAX_ATTEMPTS']:
+                row.status = "Failed"
+                logger.error(f"Email {row.outbox_id} failed after {row.attempts} attempt(s): {e}")
+            else:
+                delay = _retry_delay(row.attempts)
+                row.status = "Queued"
+                row.next_attempt_at = _now() + timedelta(seconds=delay)
+                logger.warning(f"Email {row.outbox_id} attempt {row.attempts} failed ({e}); retrying in {delay:.0f}s")
+            failed += 1
+        # Record each outcome at once so a crash cannot resend delivered mail
+        db.session.commit()
+    return sent, failed
+
+def run_email_worker(worker_id=None, poll_seconds=None, once=False, smtp=None):
+    """
+    Deliver queued emails until stopped. With once=True, drain the due rows and
+    return the number of emails sent. Pass an SmtpSession to reuse a connection
+    the caller keeps open (it is then left open). Must run inside an app context.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    poll_seconds = poll_seconds or app.config['EMAIL_OUTBOX_POLL_SECONDS']
+    batch_size = app.config['EMAIL_OUTBOX_BATCH_SIZE']
+    owns_smtp = smtp is None
+    smtp = smtp or SmtpSession()
+    processed = 0
+    failures = 0
+    logger.info(f"email_outbox worker {worker_id} started")
+
+    try:
+        while True:
+            try:
+                requeue_stale_emails()
+                rows = claim_email_batch(worker_id, batch_size)
+                if rows:
+                    started = time.perf_counter()
+                    sent, failed = deliver_batch(rows, smtp)
+                    processed += sent
+                    logger.info(f"Sent {sent}/{len(rows)} email(s) in {time.perf_counter() - started:.2f}s ({failed} failed); "
+                                f"attachment cache: {get_attachment_cache_stats()}")
+                failures = 0
+            except OperationalError as e:
+                db.session.rollback()
+                failures += 1
+                delay = backoff_delay(failures - 1)
+                logger.warning(f"email_outbox worker {worker_id} lost the database ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if len(rows) < batch_size:
+                if once:
+                    return processed
+                smtp.close_if_idle()
+                time.sleep(poll_seconds)
+            db.session.remove()
+    finally:
+        if owns_smtp:
+            smtp.close()
@@ -1,15 +1,19 @@
-import os, logging, pytz
+import hashlib, os, logging, pytz, threading
 from app.models import Rate
 from collections import defaultdict
-from copy import copy
+from copy import copy, deepcopy
 from datetime import datetime
 from flask import current_app
+from io import BytesIO
 from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell, MergedCell
 from openpyxl.chart import BarChart, Reference
 from openpyxl.chart.series import DataPoint
 from openpyxl.drawing.image import Image
 from openpyxl.styles import Alignment
+from openpyxl.styles.cell_style import StyleArray
 from openpyxl.utils import get_column_letter
+from openpyxl.utils.indexed_list import IndexedList
 
 logger = logging.getLogger(__name__)
 
@@ -42,6 +46,138 @@ def get_local_date_str(timezone_str='Asia/Kuala_Lumpur'):
     now = datetime.now(tz)
     return now.strftime('%d/%m/%Y')
 
+# ============================================================
+#  Template Cache
+# ============================================================
+# Each template in app/files is parsed once per process and handed out as
+# a cheap in-memory copy. A template is re-parsed when its file mtime changes.
+TEMPLATE_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), "files")
+REQUISITION_TEMPLATE = "Part-Time Lecturer Requisition Form - template.xlsx"
+CLAIM_TEMPLATE = "Part-Time Lecturer Claim Form - template.xlsx"
+
+# Workbook-level style tables; copies get their own so new styles never leak back
+_WORKBOOK_STYLE_TABLES = ('_fonts', '_fills', '_borders', '_alignments', '_protections', '_number_formats', '_cell_styles')
+
+_template_cache = {}
+_template_lock = threading.Lock()
+_template_stats = {"hits": 0, "misses": 0, "reloads": 0}
+
+class _CachedTemplate:
+    def __init__(self, path, mtime_ns, version, workbook):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.version = version  # sha256 of the template file
+        self.workbook = workbook
+        self.blocks = {}
+
+def _get_cached_template(template_name):
+    path = os.path.join(TEMPLATE_FOLDER, template_name)
+    mtime_ns = os.stat(path).st_mtime_ns
+
+    with _template_lock:
+        entry = _template_cache.get(template_name)
+        if entry and entry.mtime_ns == mtime_ns:
+            _template_stats["hits"] += 1
+            return entry
+
+        _template_stats["reloads" if entry else "misses"] += 1
+        with open(path, "rb") as f:
+            data = f.read()
+        entry = _CachedTemplate(path, mtime_ns, hashlib.sha256(data).hexdigest(), load_workbook(BytesIO(data)))
+        _template_cache[template_name] = entry
+        logger.info(f"Loaded Excel template '{template_name}'")
+        return entry
+
+def _shifted_row(row, shifts):
+    """Final row of a template row once `shifts` [(at_row, amount), ...] are applied."""
+    return row + sum(amount for at_row, amount in shifts if row >= at_row)
+
+def _copy_workbook(wb, row_shifts=None):
+    """
+    Copy a loaded workbook without re-parsing it. Cells are rebuilt directly,
+    the rest of the workbook (sheet settings, merges, charts) is deep-copied
+    while the immutable style objects are shared.
+
+    row_shifts maps a sheet title to [(at_row, amount), ...]: cells on or
+    below at_row are placed `amount` rows lower, leaving blank rows to be
+    written into, like insert_rows() would but without moving cells twice.
+    As with insert_rows(), merged ranges, row heights and charts stay put.
+    """
+    row_shifts = row_shifts or {}
+    memo = {id(getattr(wb, attr)): IndexedList(getattr(wb, attr)) for attr in _WORKBOOK_STYLE_TABLES}
+    for ws in wb.worksheets:
+        memo[id(ws._cells)] = {}
+    wb_copy = deepcopy(wb, memo)
+
+    for src_ws, dst_ws in zip(wb.worksheets, wb_copy.worksheets):
+        shifts = row_shifts.get(src_ws.title)
+        cells = {}
+        for (row, col), cell in src_ws._cells.items():
+            if shifts:
+                row = _shifted_row(row, shifts)
+            if isinstance(cell, MergedCell):
+                new_cell = MergedCell(dst_ws, row, col)
+            else:
+                new_cell = Cell(dst_ws, row=row, column=col)
+                new_cell._value = cell._value
+                new_cell.data_type = cell.data_type
+                if cell._hyperlink is not None:
+                    new_cell._hyperlink = copy(cell._hyperlink)
+                if cell._comment is not None:
+                    new_cell.comment = copy(cell._comment)
+            new_cell._style = copy(cell._style)
+            cells[(row, col)] = new_cell
+        dst_ws._cells = cells
+
+    return wb_copy
+
+def load_template(template_name, row_shifts=None):
+    """Return a private, editable copy of a template workbook from app/files."""
+    return _copy_workbook(_get_cached_template(template_name).workbook, row_shifts)
+
+def _template_cell(ws, row, col):
+    """Existing cell of a cached template sheet, or None; never creates cells."""
+    return ws._cells.get((row, col))
+
+def get_template_block(template_name, first_row, last_row, last_col):
+    """
+    Value/style snapshot of a rectangular block of a template's active sheet,
+    extracted once per template version. Rows are lists of
+    {'value', 'style', 'formula'} dicts; treat them as read-only.
+    """
+    entry = _get_cached_template(template_name)
+    key = (first_row, last_row, last_col)
+
+    block = entry.blocks.get(key)
+    if block is None:
+        ws = entry.workbook.active
+        block = []
+        for row in range(first_row, last_row + 1):
+            row_data = []
+            for col in range(1, last_col + 1):
+                cell = _template_cell(ws, row, col)
+                value = cell.value if cell is not None else None
+                row_data.append({
+                    'value': value,
+                    'style': copy(cell._style) if cell is not None else StyleArray(),
+                    'formula': value if isinstance(value, str) and value.startswith('=') else None
+                })
+            block.append(row_data)
+        entry.blocks[key] = block
+    return block
+
+def get_template_version(template_name):
+    """Content hash of a template file; changes whenever the template is edited."""
+    return _get_cached_template(template_name).version
+
+def get_template_cache_stats():
+    with _template_lock:
+        return dict(_template_stats, cached=sorted(_template_cache))
+
+def clear_template_cache():
+    with _template_lock:
+        _template_cache.clear()
+
 # ============================================================
 #  Requisition Excel Generator
 # ============================================================
@@ -52,10 +188,7 @@ def generate_requisition_excel(department_code, name, designation, ic_number, su
     """
     
     try:
-        # Load template and define paths
-        template_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 
-                                   "files", 
-                                   "Part-Time Lecturer Requisition Form - template.xlsx")
+        # Define paths
         output_folder = os.path.join(os.path.abspath(os.path.dirname(__file__)), "temp")
         output_filename = f"Part-Time Lecturer Requisition Form - {name} ({subject_level}).xlsx"
         output_path = os.path.join(output_folder, output_filename)
@@ -64,8 +197,8 @@ def generate_requisition_excel(department_code, name, designation, ic_number, su
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
-        # Load the workbook and active sheet
-        template_wb = load_workbook(template_path)
+        # Copy of the cached template workbook and its active sheet
+        template_wb = load_template(REQUISITION_TEMPLATE)
         template_ws = template_wb.active
 
         # Insert lecturer and department details
@@ -74,18 +207,8 @@ def generate_requisition_excel(department_code, name, designation, ic_number, su
         template_ws['C7'].value = designation
         template_ws['H6'].value = ic_number
 
-        # Store the template of the first course record (A9:L22)
-        first_record_template = []
-        for row in range(9, 23):
-            row_data = []
-            for col in range(1, 13):  # Columns A to L
-                cell = template_ws.cell(row=row, column=col)
-                row_data.append({
-                    'value': cell.value,
-                    'style': copy(cell._style),
-                    'formula': cell.value if isinstance(cell.value, str) and cell.value.startswith('=') else None
-                })
-            first_record_template.append(row_data)
+        # Template of the first course record (A9:L22), extracted once per template version
+        first_record_template = get_template_block(REQUISITION_TEMPLATE, 9, 22, 12)
 
         # Track total cost cells to later calculate grand total
         total_cost_cells = ['I20']  # First record's total cost cell
@@ -255,10 +378,7 @@ def update_requisition_formulas(ws, start_row):
 # =============== Claim Excel =============== #
 def generate_claim_excel(name, department_code, subject_level, claim_details, po_name, head_name, dean_name, hr_name):
     try:
-        # Load template
-        template_path = os.path.join(os.path.abspath(os.path.dirname(__file__)), 
-                                   "files", 
-                                   "Part-Time Lecturer Claim Form - template.xlsx")
+        # Define paths
         output_folder = os.path.join(os.path.abspath(os.path.dirname(__file__)), "temp")
         output_filename = f"Part-Time Lecturer Claim Form - {name} ({subject_level}).xlsx"
         output_path = os.path.join(output_folder, output_filename)
@@ -267,8 +387,8 @@ def generate_claim_excel(name, department_code, subject_level, claim_details, po
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
-        # Load workbook
-        template_wb = load_workbook(template_path)
+        # Copy of the cached template workbook
+        template_wb = load_template(CLAIM_TEMPLATE)
         template_ws = template_wb.active
 
         # Add image to worksheet
@@ -371,19 +491,27 @@ DEPT_DETAILS_START_ROW = 8        # first detail row on dept sheets (row 7 is he
 DEPT_SUMMARY_DATA_START = 12      # first row of summary data
 DEPT_SUMMARY_TOTAL_COL = "B"      # default column for "Total" values in depts summary
 
+REPORT_TEMPLATES = {
+    "claim": "Claim Report - template.xlsx",
+    "requisition": "Requisition Report - template.xlsx",
+}
+
 DEPARTMENT_SHEETS = ["CADP", "CAE", "CEPS", "LCMPU", "SOBIZ", "SOC", "SOE", "SOHOS"]
 COLORS = ["B7950B", "D35400", "C0392B", "27AE60", "16A085", "2980B9", "8E44AD", "7F8C8D"]
 
-def copy_row_style(ws, src_row, dst_row):
+def row_styles(ws, row):
+    """(column, style) pairs of the styled cells in `row`, read without creating cells."""
+    return sorted(
+        ((col, cell._style) for (r, col), cell in ws._cells.items() if r == row and cell.has_style),
+        key=lambda item: item[0]
+    )
+
+def apply_row_styles(ws, styles, dst_row):
     """
-    Clone cell styles from src_row to dst_row (number formats, borders, fills, fonts, alignments).
+    Clone cell styles captured by row_styles() onto dst_row (number formats, borders, fills, fonts, alignments).
     """
-    max_col = ws.max_column
-    for col in range(1, max_col + 1):
-        s = ws.cell(src_row, col)
-        d = ws.cell(dst_row, col)
-        if s.has_style:
-            d._style = copy(s._style)
+    for col, style in styles:
+        ws.cell(dst_row, col)._style = copy(style)
 
 # Insert one detail record
 def insert_overall_details(ws, report, start_row):
@@ -404,96 +532,89 @@ def insert_overall_details(ws, report, start_row):
     ws[f'H{start_row}'].value = report.get('rate', 0)
     ws[f'I{start_row}'].value = report.get('total_cost', 0)
 
-def merge_same_department(ws, first_row: int, total_rows: int, col: str = "A"):
+def department_runs(values):
     """
-    Merge consecutive cells in `col` (e.g., 'A') when they have the same non-empty value,
-    and center the text. Clears tail cells BEFORE merging to avoid MergedCell write errors.
+    (first, last) index pairs of consecutive equal, non-empty values that span
+    more than one row; these are the cells merged in the Details block.
     """
-    if total_rows <= 0:
-        return
-
-    start = first_row
-    end   = first_row + total_rows - 1
-    r = start
-
-    while r <= end:
-        val = ws[f"{col}{r}"].value
-        if val is None or str(val).strip() == "":
-            r += 1
-            continue
+    runs = []
+    i = 0
+    while i < len(values):
+        val = values[i]
+        j = i
+        if val is not None and str(val).strip() != "":
+            while j + 1 < len(values) and values[j + 1] == val:
+                j += 1
+            if j > i:
+                runs.append((i, j))
+        i = j + 1
+    return runs
+
+def merge_department_runs(ws, first_row, runs, col="A"):
+    """
+    Merge each run from department_runs() in `col` and center the text.
+    Clears tail cells BEFORE merging to avoid MergedCell write errors.
+    """
+    for run_start, run_end in runs:
+        for r in range(first_row + run_start + 1, first_row + run_end + 1):
+            ws[f"{col}{r}"].value = None
 
-        run_start = r
-        # extend while next row has the same value
-        while r + 1 <= end and ws[f"{col}{r+1}"].value == val:
-            r += 1
-        run_end = r
+        ws.merge_cells(f"{col}{first_row + run_start}:{col}{first_row + run_end}")
+        top = ws[f"{col}{first_row + run_start}"]
+        top.alignment = Alignment(horizontal="center", vertical="center")
 
-        if run_end > run_start:
-            # 1) clear tail cells BEFORE we merge
-            for rr in range(run_start + 1, run_end + 1):
-                ws[f"{col}{rr}"].value = None
+def write_overall_details(ws, report_details, detail_styles):
+    """
+    Fill the Details block in the rows reserved by the layout plan, styling
+    each row like the template's first detail row, then merge equal departments.
+    """
+    for i, rec in enumerate(report_details):
+        row_idx = OVERALL_DETAILS_START_ROW + i
+        if i > 0:
+            apply_row_styles(ws, detail_styles, row_idx)
+        insert_overall_details(ws, rec, row_idx)
 
-            # 2) merge and center
-            ws.merge_cells(f"{col}{run_start}:{col}{run_end}")
-            top = ws[f"{col}{run_start}"]
-            top.alignment = Alignment(horizontal="center", vertical="center")
+    runs = department_runs([rec.get('department_code', '') for rec in report_details])
+    merge_department_runs(ws, OVERALL_DETAILS_START_ROW, runs, col="A")
 
-        r += 1
+def aggregate_by_department(report_details):
+    """ { 'CADP': {'lecturers': {...}, 'subjects': n, 'cost': n}, ... } for the Summary Table """
+    agg = defaultdict(lambda: {"lecturers": set(), "subjects": 0, "cost": 0})
+    for r in report_details:
+        dep = (r.get("department_code") or "-").strip()
+        agg[dep]["lecturers"].add(r.get("lecturer_name", "") or "")
+        agg[dep]["subjects"] += int(r.get("total_subjects") or 0)
+        agg[dep]["cost"]     += int(r.get("total_cost") or 0)
+    return agg
 
 # Build the Summary Table
-def write_overall_summary(ws, report_details, data_start_row, put_chart=True):
+def write_overall_summary(ws, template_rows, extra_rows, agg, put_chart=True):
     """
-    Fills the Summary Table below the 'Summary Table' header.
+    Fills the Summary Table at the rows planned by plan_report_layout().
+    template_rows: [(row, department), ...] already labelled in the template (0 if missing from the data)
+    extra_rows:    [(row, department), ...] departments only found in the data, written below them
     Columns:
       A = Department
       B = No. of Lecturers (distinct)
       C = No. of Subjects (sum)
       D = Total Cost (sum)
     """
+    empty = {"lecturers": set(), "subjects": 0, "cost": 0}
+    for row, dep in template_rows + extra_rows:
+        stats = agg.get(dep, empty)
+        ws[f"B{row}"].value = len(stats["lecturers"])
+        ws[f"C{row}"].value = stats["subjects"]
+        ws[f"D{row}"].value = stats["cost"]
 
-    # Aggregate from details
-    agg = defaultdict(lambda: {"lecturers": set(), "subjects": 0, "cost": 0})
-    for r in report_details:
-        dep = (r.get("department_code") or "-").strip()
-        agg[dep]["lecturers"].add(r.get("lecturer_name", "") or "")
-        agg[dep]["subjects"] += int(r.get("total_subjects") or 0)
-        agg[dep]["cost"]     += int(r.get("total_cost") or 0)
-
-    # Read existing department labels in the template (col A)
-    existing_rows = []
-    row = data_start_row
-    while True:
-        v = ws[f"A{row}"].value
-        if v is None or (isinstance(v, str) and v.strip() == ""):
-            break
-        existing_rows.append((row, str(v).strip()))
-        row += 1
-
-    # Fill rows for existing template departments (with 0 if missing)
-    last = data_start_row - 1
-    for rix, dep in existing_rows:
-        stats = agg.get(dep, {"lecturers": set(), "subjects": 0, "cost": 0})
-        ws[f"B{rix}"].value = len(stats["lecturers"])
-        ws[f"C{rix}"].value = stats["subjects"]
-        ws[f"D{rix}"].value = stats["cost"]
-        last = rix
-
-    # Append any departments from data not in template
-    template_deps = {dep for _, dep in existing_rows}
-    for dep, stats in sorted(agg.items()):
-        if dep not in template_deps:
-            last += 1
-            ws.insert_rows(last, amount=1)
-            ws[f"A{last}"].value = dep
-            ws[f"B{last}"].value = len(stats["lecturers"])
-            ws[f"C{last}"].value = stats["subjects"]
-            ws[f"D{last}"].value = stats["cost"]
-
-    first_row = data_start_row
-    last_row  = last
+    for row, dep in extra_rows:
+        ws[f"A{row}"].value = dep
 
     # Chart
-    if put_chart and last_row >= first_row:
+    summary_rows = template_rows + extra_rows
+    if put_chart and summary_rows:
+        first_row = summary_rows[0][0]
+        last_row  = summary_rows[-1][0]
+
         chart = BarChart()
         chart.type = "col"
         chart.title = "Total Cost by Department"
@@ -536,37 +657,28 @@ def group_details_by_department(report_details):
 def find_row_by_label(ws, label, col=1, start_row=1, end_row=200):
     tgt = str(label).strip().lower()
     for r in range(start_row, end_row+1):
-        v = ws.cell(r, col).value
-        if v is not None and str(v).strip().lower() == tgt:
+        cell = _template_cell(ws, r, col)
+        if cell is not None and cell.value is not None and str(cell.value).strip().lower() == tgt:
             return r
     return None
 
 def find_total_col(ws, header_row, header_text="Total"):
     tgt = str(header_text).strip().lower()
     for c in range(1, ws.max_column+1):
-        if str(ws.cell(header_row, c).value or "").strip().lower() == tgt:
+        cell = _template_cell(ws, header_row, c)
+        if cell is not None and str(cell.value or "").strip().lower() == tgt:
             return get_column_letter(c)
     return None  # caller can default
 
-def write_department_details(ws, dept_rows):
+def write_department_details(ws, dept_rows, detail_styles):
     """
-    Fill a department sheet's Details block.
-    - Insert (n-1) rows starting at DEPT_DETAILS_START_ROW
-    - Copy styles from the template row (DEPT_DETAILS_START_ROW)
-    - Shift summary rows down if rows are inserted
+    Fill a department sheet's Details block in the rows reserved by the
+    layout plan, styling each row like the template row (DEPT_DETAILS_START_ROW).
     """
-
-    n = len(dept_rows)
-    if n == 0:
-        return
-
-    if n > 1:
-        ws.insert_rows(DEPT_DETAILS_START_ROW + 1, amount=n - 1)
-
     for i, rec in enumerate(dept_rows):
         r = DEPT_DETAILS_START_ROW + i
         if i > 0:
-            copy_row_style(ws, DEPT_DETAILS_START_ROW, r)
+            apply_row_styles(ws, detail_styles, r)
         ws[f'A{r}'].value = rec.get('lecturer_name', '')
         ws[f'B{r}'].value = rec.get('total_subjects', 0)
         ws[f'C{r}'].value = rec.get('total_lecture_hours', 0)
@@ -583,23 +695,11 @@ def apply_colors(series, num_points, colors=COLORS):
         dp.graphicalProperties.solidFill = colors[idx % len(colors)]
         series.dPt.append(dp)
 
-def write_department_summary(ws, dept_rows, total_col=None):
+def write_department_summary(ws, dept_rows, first_label_row, total_col):
     """
-    Robust to any number of inserted detail rows.
-    Finds:
-      - first_label_row = row where column A == "No. of Lecturers"
-      - header_row = first_label_row - 1
-      - total_col = column with header "Total" on header_row
+    Write the per-department totals into the summary block, whose first
+    label row ("No. of Lecturers") and "Total" column come from the layout plan.
     """
-    # locate summary block for THIS sheet
-    first_label_row = find_row_by_label(ws, "No. of Lecturers", col=1, start_row=8, end_row=100)
-    if first_label_row is None:
-        first_label_row = DEPT_SUMMARY_DATA_START  # fallback to template constant
-    header_row = first_label_row - 1
-
-    if total_col is None:
-        total_col = find_total_col(ws, header_row) or DEPT_SUMMARY_TOTAL_COL
-
     # compute totals
     lecturers = {r.get("lecturer_name","") for r in dept_rows}
     num_lecturers = len(lecturers)
@@ -663,12 +763,12 @@ def write_department_summary(ws, dept_rows, total_col=None):
         # If chart creation fails for any reason, don't break report generation
         logger.warning(f"Chart creation skipped: {e}")
 
-def fill_department_sheet(ws, dept_code, dept_rows, start_date, end_date):
+def fill_department_sheet(ws, dept_code, dept_rows, start_date, end_date, dept_layout):
     """
     For a given dept sheet:
       - set Faculty/Centre (B3) and Date (B4)
       - write details (row 8..)
-      - write the per-department summary (rows 12..18)
+      - write the per-department summary (rows 12..18 before shifting)
     """
     # Add image to worksheet
     ws.merge_cells('H2:H4')
@@ -684,33 +784,132 @@ def fill_department_sheet(ws, dept_code, dept_rows, start_date, end_date):
     ws['B3'].value = dept_code
     ws['B4'].value = f"{format_date(start_date)} - {format_date(end_date)}"
 
-    write_department_details(ws, dept_rows)
-    write_department_summary(ws, dept_rows)  # auto-detects Total column
+    write_department_details(ws, dept_rows, dept_layout["detail_styles"])
+    write_department_summary(ws, dept_rows, dept_layout["label_row"], dept_layout["total_col"])
+
+# Report layout planning
+def get_report_template_layout(template_name):
+    """
+    Anchors of a report template, read once per template version:
+    detail row styles, the Overall summary labels and, per department sheet,
+    the detail row styles, the "No. of Lecturers" row and the "Total" column.
+    Returns (cached workbook, layout); treat both as read-only.
+    """
+    entry = _get_cached_template(template_name)
+
+    layout = entry.blocks.get("report_layout")
+    if layout is None:
+        wb = entry.workbook
+        ws = wb["Overall"]
+
+        # Existing department labels in the Summary Table (col A)
+        summary_rows = []
+        row = OVERALL_SUMMARY_DATA_START
+        while True:
+            cell = _template_cell(ws, row, 1)
+            v = cell.value if cell is not None else None
+            if v is None or (isinstance(v, str) and v.strip() == ""):
+                break
+            summary_rows.append((row, str(v).strip()))
+            row += 1
+
+        departments = {}
+        for dept_code in DEPARTMENT_SHEETS:
+            if dept_code not in wb.sheetnames:
+                continue  # skip if template sheet missing
+            dept_ws = wb[dept_code]
+            label_row = find_row_by_label(dept_ws, "No. of Lecturers", col=1, start_row=DEPT_DETAILS_START_ROW, end_row=100)
+            if label_row is None:
+                label_row = DEPT_SUMMARY_DATA_START  # fallback to template constant
+            departments[dept_code] = {
+                "detail_styles": row_styles(dept_ws, DEPT_DETAILS_START_ROW),
+                "label_row": label_row,
+                "total_col": find_total_col(dept_ws, label_row - 1) or DEPT_SUMMARY_TOTAL_COL,
+            }
+
+        layout = {
+            "detail_styles": row_styles(ws, OVERALL_DETAILS_START_ROW),
+            "summary_rows": summary_rows,
+            "departments": departments,
+        }
+        entry.blocks["report_layout"] = layout
+
+    return entry.workbook, layout
+
+def plan_report_layout(layout, report_details):
+    """
+    Work out the final position of every block before anything is written:
+      - row_shifts: per-sheet blank rows to open up when copying the template
+      - summary / extra_summary: Overall summary rows for template and data-only departments
+      - departments: per-sheet detail rows, summary label row and Total column
+    """
+    n = len(report_details)
+    overall_shifts = []
+    if n > 1:
+        # (n-1) rows after the first detail row push the summary down
+        overall_shifts.append((OVERALL_DETAILS_START_ROW + 1, n - 1))
+
+    # Departments from data not in the template go right below the template ones
+    agg = aggregate_by_department(report_details)
+    template_deps = {dep for _, dep in layout["summary_rows"]}
+    extra_deps = [dep for dep in sorted(agg) if dep not in template_deps]
+    last_template_row = layout["summary_rows"][-1][0] if layout["summary_rows"] else OVERALL_SUMMARY_DATA_START - 1
+    if extra_deps:
+        overall_shifts.append((last_template_row + 1, len(extra_deps)))
+
+    first_extra_row = _shifted_row(last_template_row, overall_shifts) + 1
+    plan = {
+        "row_shifts": {"Overall": overall_shifts},
+        "summary_aggregate": agg,
+        "summary": [(_shifted_row(row, overall_shifts), dep) for row, dep in layout["summary_rows"]],
+        "extra_summary": [(first_extra_row + i, dep) for i, dep in enumerate(extra_deps)],
+        "departments": {},
+    }
+
+    bucket = group_details_by_department(report_details)
+    for dept_code, dept_layout in layout["departments"].items():
+        rows = bucket.get(dept_code, [])
+        shifts = [(DEPT_DETAILS_START_ROW + 1, len(rows) - 1)] if len(rows) > 1 else []
+        plan["row_shifts"][dept_code] = shifts
+        plan["departments"][dept_code] = {
+            "rows": rows,
+            "detail_styles": dept_layout["detail_styles"],
+            "label_row": _shifted_row(dept_layout["label_row"], shifts),
+            "total_col": dept_layout["total_col"],
+        }
+
+    return plan
 
 # Main generator
 def generate_report_excel(report_type, start_date, end_date, report_details):
+    """
+    Build a report in one forward pass: the final layout is planned from the
+    cached template first, the template is copied with the detail and summary
+    rows already opened up, and every sheet is then written top to bottom
+    without inserting rows.
+    """
     try:
         # Load template
         base_dir = os.path.abspath(os.path.dirname(__file__))
         output_folder = os.path.join(base_dir, "temp")
 
         if report_type == "claim":
-            template_name = "Claim Report - template.xlsx"
+            template_name = REPORT_TEMPLATES["claim"]
             output_filename = f"Claim Report_{format_file_date(start_date)} - {format_file_date(end_date)}.xlsx"
         else:  # default to requisition
-            template_name = "Requisition Report - template.xlsx"
+            template_name = REPORT_TEMPLATES["requisition"]
             output_filename = f"Requisition Report_{format_file_date(start_date)} - {format_file_date(end_date)}.xlsx"
 
-        # Ensure output directory exists
-        template_path = os.path.join(base_dir, "files", template_name)
         output_path = os.path.join(output_folder, output_filename)
 
         # Ensure output directory exists
         if not os.path.exists(output_folder):
             os.makedirs(output_folder)
 
-        # Workbook
-        wb = load_workbook(template_path)
+        # Plan the final layout, then copy the cached template into it
+        template_wb, layout = get_report_template_layout(template_name)
+        plan = plan_report_layout(layout, report_details)
+        wb = _copy_workbook(template_wb, plan["row_shifts"])
         ws = wb["Overall"]
 
         # Add image to worksheet
@@ -727,40 +926,12 @@ def generate_report_excel(report_type, start_date, end_date, report_details):
         ws['B3'].value = f"{format_date(start_date)} - {format_date(end_date)}"
 
         # ===== Overall sheet =====
-        summary_data_start = OVERALL_SUMMARY_DATA_START # Default summary start row
-
-        # Insert Details
-        n = len(report_details)
-        if n > 1:
-            # insert (n-1) rows after the first detail row to push summary down
-            ws.insert_rows(OVERALL_DETAILS_START_ROW + 1, amount=n - 1)
-
-            # Compute local anchors
-            shift = max(0, n - 1)
-            summary_data_start = OVERALL_SUMMARY_DATA_START + shift
-
-        # style-copy + write each row
-        for i, rec in enumerate(report_details):
-            row_idx = OVERALL_DETAILS_START_ROW + i
-            if i > 0:
-                copy_row_style(ws, OVERALL_DETAILS_START_ROW, row_idx)
-            insert_overall_details(ws, rec, row_idx)
-
-        # merge equal departments in column A
-        merge_same_department(ws, OVERALL_DETAILS_START_ROW, len(report_details), col="A")
-
-        # Insert Summary
-        write_overall_summary(ws, report_details, data_start_row=summary_data_start, put_chart=True)
+        write_overall_details(ws, report_details, layout["detail_styles"])
+        write_overall_summary(ws, plan["summary"], plan["extra_summary"], plan["summary_aggregate"], put_chart=True)
 
         # ===== Department sheets =====
-        bucket = group_details_by_department(report_details)
-
-        for dept_code in DEPARTMENT_SHEETS:
-            if dept_code not in wb.sheetnames:
-                continue  # skip if template sheet missing
-            ws = wb[dept_code]
-            rows = bucket.get(dept_code, [])
-            fill_department_sheet(ws, dept_code, rows, start_date, end_date)
+        for dept_code, dept_plan in plan["departments"].items():
+            fill_department_sheet(wb[dept_code], dept_code, dept_plan["rows"], start_date, end_date, dept_plan)
 
         # Protect sheets
         for name in ["Overall"] + [s for s in DEPARTMENT_SHEETS if s in wb.sheetnames]:
@@ -0,0 +1,339 @@
+import json, logging, os, random, re, threading, time, uuid
+from datetime import datetime, timezone
+from email.parser import Parser
+from httplib2 import Response
+from urllib.parse import parse_qs, urlparse
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Fake Google Drive (local stand-in for benchmarks and offline runs)
+# ============================================================
+# With DRIVE_BACKEND = "fake", get_drive_service() builds the normal Drive v3
+# client on top of FakeDriveHttp instead of an authorised httplib2.Http. The
+# client library still builds every request (simple, multipart and resumable
+# uploads, ranged media downloads, exports, batch requests), so all Drive
+# call sites run unchanged. Only the HTTP transport is replaced: files live
+# under FAKE_DRIVE_ROOT as <id>.bin plus <id>.json metadata.
+#
+# Every HTTP round trip can be slowed down by FAKE_DRIVE_LATENCY (+/- JITTER)
+# seconds and by FAKE_DRIVE_BYTES_PER_SECOND for the payload. It can also fail
+# with FAKE_DRIVE_ERROR_STATUS at FAKE_DRIVE_ERROR_RATE (seeded by
+# FAKE_DRIVE_SEED), so retry and backoff paths can be measured too.
+API_ROOT = "https://www.googleapis.com"
+SHEETS_MIME = "application/vnd.google-apps.spreadsheet"
+
+_store_locks = {}
+_store_locks_guard = threading.Lock()
+
+# Totals across every FakeDriveHttp in the process
+_stats_lock = threading.Lock()
+_stats = {"requests": 0, "errors_injected": 0, "bytes_in": 0, "bytes_out": 0}
+
+def _count(**deltas):
+    with _stats_lock:
+        for key, value in deltas.items():
+            _stats[key] += value
+
+def get_fake_drive_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def _split_multipart(body, content_type):
+    """Split a multipart body into [(headers dict, payload bytes)] without touching binary payloads."""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+    parts = []
+    for chunk in body.split(b"--" + boundary)[1:]:
+        if chunk.startswith(b"--"):
+            break  # closing delimiter
+        chunk = chunk[2:] if chunk.startswith(b"\r\n") else chunk[1:] if chunk.startswith(b"\n") else chunk
+        crlf, lf = chunk.find(b"\r\n\r\n"), chunk.find(b"\n\n")
+        if crlf != -1 and (lf == -1 or crlf < lf):
+            head, payload = chunk[:crlf], chunk[crlf + 4:]
+        else:
+            head, payload = chunk[:lf], chunk[lf + 2:]
+        # The line break before the next delimiter belongs to the delimiter
+        payload = payload[:-2] if payload.endswith(b"\r\n") else payload[:-1] if payload.endswith(b"\n") else payload
+        headers = Parser().parsestr(head.decode("latin-1")).items()
+        # Unfold long header lines (e.g. batch Content-IDs)
+        parts.append(({k.lower(): re.sub(r"\r?\n(?=[ \t])", "", v) for k, v in headers}, payload))
+    return parts
+
+class FakeDriveStore:
+    """Drive files on local disk; safe to share between threads of one process."""
+    def __init__(self, root, quota_bytes=15 * 1024 ** 3):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        os.makedirs(root, exist_ok=True)
+        with _store_locks_guard:
+            self.lock = _store_locks.setdefault(os.path.abspath(root), threading.Lock())
+
+    def _path(self, file_id, ext):
+        if not re.match(r"^[A-Za-z0-9_-]+$", file_id or ""):
+            raise KeyError(file_id)
+        return os.path.join(self.root, f"{file_id}.{ext}")
+
+    def get_meta(self, file_id):
+        try:
+            with open(self._path(file_id, "json")) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            raise KeyError(file_id)
+
+    def get_data(self, file_id):
+        try:
+            with open(self._path(file_id, "bin"), "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            raise KeyError(file_id)
+
+    def put(self, meta, data=None):
+        """Create or update a file; returns its metadata."""
+        with self.lock:
+            file_id = meta.get("id") or uuid.uuid4().hex
+            try:
+                current = self.get_meta(file_id)
+            except KeyError:
+                current = {"id": file_id, "name": "Untitled", "mimeType": "application/octet-stream",
+                           "createdTime": _now(), "size": "0"}
+            current.update({k: v for k, v in meta.items() if k != "id"})
+            current["modifiedTime"] = _now()
+            if current["mimeType"] == SHEETS_MIME:
+                current["webViewLink"] = f"https://docs.google.com/spreadsheets/d/{file_id}/edit"
+            else:
+                current["webViewLink"] = f"https://drive.google.com/file/d/{file_id}/view"
+
+            if data is not None:
+                tmp = self._path(file_id, "bin") + ".tmp"
+                with open(tmp, "wb") as fh:
+                    fh.write(data)
+                os.replace(tmp, self._path(file_id, "bin"))
+                current["size"] = str(len(data))
+            elif not os.path.exists(self._path(file_id, "bin")):
+                open(self._path(file_id, "bin"), "wb").close()
+
+            with open(self._path(file_id, "json"), "w") as fh:
+                json.dump(current, fh)
+            return current
+
+    def delete(self, file_id):
+        with self.lock:
+            meta = self.get_meta(file_id)
+            for ext in ("bin", "json"):
+                try:
+                    os.remove(self._path(file_id, ext))
+                except FileNotFoundError:
+                    pass
+            return meta
+
+    def list(self):
+        metas = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".json"):
+                try:
+                    metas.append(self.get_meta(name[:-5]))
+                except (KeyError, ValueError):
+                    pass  # deleted or being written
+        return metas
+
+    def usage(self):
+        return sum(int(meta.get("size") or 0) for meta in self.list())
+
+class FakeDriveHttp:
+    """httplib2.Http stand-in that serves the Drive v3 REST API from a FakeDriveStore."""
+    def __init__(self, store, latency=0.0, jitter=0.0, bytes_per_second=0, error_rate=0.0, error_status=503, seed=None):
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.bytes_per_second = bytes_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.sessions = {}
+
+    @classmethod
+    def from_config(cls, config):
+        seed = config.get('FAKE_DRIVE_SEED')
+        return cls(
+            FakeDriveStore(config['FAKE_DRIVE_ROOT'], config.get('FAKE_DRIVE_QUOTA_BYTES', 15 * 1024 ** 3)),
+            latency=config.get('FAKE_DRIVE_LATENCY', 0.0),
+            jitter=config.get('FAKE_DRIVE_JITTER', 0.0),
+            bytes_per_second=config.get('FAKE_DRIVE_BYTES_PER_SECOND', 0),
+            error_rate=config.get('FAKE_DRIVE_ERROR_RATE', 0.0),
+            error_status=config.get('FAKE_DRIVE_ERROR_STATUS', 503),
+            # Distinct but reproducible streams per thread
+            seed=None if seed is None else f"{seed}:{threading.current_thread().name}",
+        )
+
+    # httplib2.Http attributes the client library may touch
+    timeout = None
+    redirect_codes = frozenset()
+
+    def close(self):
+        pass
+
+    # --------------------------------------------------------
+    #  Transport
+    # --------------------------------------------------------
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        elif body is not None and not isinstance(body, bytes):
+            body = body.read()  # _StreamSlice for chunked resumable uploads
+        body = body or b""
+
+        _count(requests=1, bytes_in=len(body))
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if self.bytes_per_second:
+            delay += len(body) / self.bytes_per_second
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            _count(errors_injected=1)
+            resp, content = self._error(self.error_status, "Injected failure")
+        else:
+            resp, content = self._dispatch(method, uri, body, headers)
+
+        if self.bytes_per_second:
+            delay += len(content) / self.bytes_per_second
+        if delay > 0:
+            time.sleep(delay)
+        _count(bytes_out=len(content))
+        return resp, content
+
+    def _response(self, status, content=b"", content_type="application/json", **extra):
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode("utf-8")
+        headers = {"status": str(status), "content-type": content_type, "content-length": str(len(content))}
+        headers.update({k.replace("_", "-"): v for k, v in extra.items()})
+        return Response(headers), content
+
+    def _error(self, status, message, reason="backendError"):
+        body = {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+        return self._response(status, body)
+
+    def _dispatch(self, method, uri, body, headers):
+        parsed = urlparse(uri)
+        path = parsed.path
+        query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        try:
+            if path == "/batch/drive/v3" and method == "POST":
+                return self._batch(body, headers)
+            if path.startswith("/upload/fake-session/") and method == "PUT":
+                return self._resumable_chunk(path.rsplit("/", 1)[1], body, headers)
+            if path == "/upload/drive/v3/files" and method == "POST":
+                return self._upload(None, query, body, headers, uri)
+            m = re.match(r"^/upload/drive/v3/files/([^/]+)$", path)
+            if m and method == "PATCH":
+                return self._upload(m.group(1), query, body, headers, uri)
+            if path == "/drive/v3/files" and method == "POST":
+                return self._response(200, self.store.put(json.loads(body or b"{}")))
+            if path == "/drive/v3/files" and method == "GET":
+                page_size = int(query.get("pageSize", 100))
+                return self._response(200, {"files": self.store.list()[:page_size]})
+            if path == "/drive/v3/about" and method == "GET":
+                usage = self.store.usage()
+                return self._response(200, {"storageQuota": {
+                    "limit": str(self.store.quota_bytes), "usage": str(usage),
+                    "usageInDrive": str(usage), "usageInDriveTrash": "0"}})
+            m = re.match(r"^/drive/v3/files/([^/]+)(/export|/permissions)?$", path)
+            if m:
+                file_id, sub = m.groups()
+                if sub == "/export" and method == "GET":
+                    self.store.get_meta(file_id)
+                    return self._media(file_id, headers, query.get("mimeType", "application/octet-stream"))
+                if sub == "/permissions" and method == "POST":
+                    self.store.get_meta(file_id)
+                    return self._response(200, dict(json.loads(body or b"{}"), id=uuid.uuid4().hex[:12], kind="drive#permission"))
+                if method == "GET" and query.get("alt") == "media":
+                    return self._media(file_id, headers, self.store.get_meta(file_id)["mimeType"])
+                if method == "GET":
+                    return self._response(200, self.store.get_meta(file_id))
+                if method == "PATCH":
+                    self.store.get_meta(file_id)
+                    return self._response(200, self.store.put(dict(json.loads(body or b"{}"), id=file_id)))
+                if method == "DELETE":
+                    self.store.delete(file_id)
+                    return self._response(204, b"")
+            return self._error(400, f"Fake Drive does not handle {method} {path}", "badRequest")
+        except KeyError as e:
+            return self._error(404, f"File not found: {e.args[0]}.", "notFound")
+
+    # --------------------------------------------------------
+    #  Media
+    # --------------------------------------------------------
+    def _media(self, file_id, headers, mime_type):
+        data = self.store.get_data(file_id)
+        m = re.match(r"bytes=(\d+)-(\d*)", headers.get("range", ""))
+        if not m:
+            return self._response(200, data, mime_type)
+        start = int(m.group(1))
+        end = min(int(m.group(2)) if m.group(2) else len(data) - 1, len(data) - 1)
+        return self._response(206, data[start:end + 1], mime_type, content_range=f"bytes {start}-{end}/{len(data)}")
+
+    def _upload(self, file_id, query, body, headers, uri):
+        upload_type = query.get("uploadType", "media")
+        if upload_type == "resumable":
+            session_id = uuid.uuid4().hex
+            meta = json.loads(body) if body else {}
+            self.sessions[session_id] = {"file_id": file_id, "meta": meta, "data": bytearray()}
+            return self._response(200, b"", location=f"{API_ROOT}/upload/fake-session/{session_id}")
+
+        if upload_type == "multipart":
+            (meta_headers, meta_body), (_, data) = _split_multipart(body, headers["content-type"])[:2]
+            meta = json.loads(meta_body or b"{}")
+        else:
+            meta, data = {}, body
+        return self._store_upload(file_id, meta, data, headers.get("content-type"))
+
+    def _resumable_chunk(self, session_id, body, headers):
+        upload = self.sessions.get(session_id)
+        if upload is None:
+            return self._error(404, "Upload session expired.", "notFound")
+        upload["data"] += body
+        m = re.match(r"bytes (\d+)-(\d+)/(\d+|\*)", headers.get("content-range", ""))
+        total = m.group(3) if m else str(len(upload["data"]))
+        if total != "*" and len(upload["data"]) >= int(total):
+            del self.sessions[session_id]
+            return self._store_upload(upload["file_id"], upload["meta"], bytes(upload["data"]), None)
+        return self._response(308, b"", range=f"bytes=0-{len(upload['data']) - 1}")
+
+    def _store_upload(self, file_id, meta, data, media_type):
+        if file_id:
+            self.store.get_meta(file_id)
+            meta = dict(meta, id=file_id)
+        elif "mimeType" not in meta and media_type:
+            meta = dict(meta, mimeType=media_type)
+        return self._response(200, self.store.put(meta, bytes(data)))
+
+    # --------------------------------------------------------
+    #  Batch
+    # --------------------------------------------------------
+    def _batch(self, body, headers):
+        boundary = "batch_" + uuid.uuid4().hex
+        out = []
+        for part_headers, payload in _split_multipart(body, headers["content-type"]):
+            request_line, _, rest = payload.decode("utf-8").partition("\n")
+            method, path, _ = request_line.split(" ", 2)
+            head, _, part_body = rest.replace("\r\n", "\n").partition("\n\n")
+            inner_headers = {k.lower(): v for k, v in Parser().parsestr(head).items()}
+
+            if self.error_rate and self.random.random() < self.error_rate:
+                _count(errors_injected=1)
+                resp, content = self._error(self.error_status, "Injected failure")
+            else:
+                resp, content = self._dispatch(method, API_ROOT + path, part_body.encode("utf-8"), inner_headers)
+
+            content_id = part_headers.get("content-id", "<>")
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id[1:]}\r\n\r\n"
+                f"HTTP/1.1 {resp.status} {resp.reason or 'OK'}\r\n"
+                f"Content-Type: {resp['content-type']}\r\n\r\n"
+                f"{content.decode('utf-8')}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        return self._response(200, "".join(out).encode("utf-8"), f"multipart/mixed; boundary={boundary}")
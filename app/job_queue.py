@@ -0,0 +1,128 @@
+import logging, os, socket, time
+from app import db
+from app.database import backoff_delay
+from app.shared_routes import get_current_utc, to_utc_aware
+from datetime import timedelta
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  DB-backed Job Queue
+# ============================================================
+# Shared mechanics for the job tables (report_job, archive_job). Each has
+# status (Queued / Running / Completed / Failed), stage, progress, message,
+# active_key, worker, attempts and started/heartbeat/finished timestamps.
+# Workers claim jobs with SELECT ... FOR UPDATE SKIP LOCKED, commit progress
+# as they go, and requeue jobs whose worker stopped sending heartbeats.
+# active_key is set while a job is Queued or Running; its unique index folds
+# identical requests into one job and is cleared when the job finishes.
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def set_job_stage(job, stage, progress):
+    """Record the stage a job has reached; doubles as its heartbeat."""
+    job.stage = stage
+    job.progress = progress
+    job.heartbeat_at = get_current_utc()
+    db.session.commit()
+
+def finish_job(job, status, message=None):
+    job.status = status
+    job.message = message[:255] if message else None
+    job.active_key = None  # a new request starts a fresh job
+    job.finished_at = get_current_utc()
+    if status == "Completed":
+        job.stage = "done"
+        job.progress = 100
+    db.session.commit()
+
+def requeue_stale_jobs(model, stale_seconds, max_attempts, interrupted_message):
+    """
+    Put Running jobs whose worker stopped sending heartbeats back in the queue,
+    or fail them once they have used up max_attempts.
+    """
+    cutoff = to_utc_aware(get_current_utc() - timedelta(seconds=stale_seconds))
+    stale = (
+        model.query
+        .filter(model.status == "Running", model.heartbeat_at < cutoff)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for job in stale:
+        if job.attempts >= max_attempts:
+            logger.warning(f"{model.__tablename__} {job.job_id} abandoned by {job.worker}; giving up after {job.attempts} attempts")
+            job.status = "Failed"
+            job.message = interrupted_message
+            job.active_key = None
+            job.finished_at = get_current_utc()
+        else:
+            logger.warning(f"{model.__tablename__} {job.job_id} abandoned by {job.worker}; requeueing")
+            job.status = "Queued"
+            job.stage = "queued"
+            job.progress = 0
+            job.worker = None
+    db.session.commit()
+    return len(stale)
+
+def claim_next_job(model, worker_id):
+    """Lock the oldest queued job for this worker, or return None if the queue is empty."""
+    job = (
+        model.query
+        .filter(model.status == "Queued")
+        .order_by(model.job_id.asc())
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is None:
+        db.session.rollback()
+        return None
+
+    now = get_current_utc()
+    job.status = "Running"
+    job.worker = worker_id
+    job.attempts = (job.attempts or 0) + 1
+    job.started_at = now
+    job.heartbeat_at = now
+    db.session.commit()
+    return job
+
+def run_job_worker(model, run_job, poll_seconds, stale_seconds, max_attempts, interrupted_message, worker_id=None, once=False):
+    """
+    Process jobs of `model` with run_job(job) until stopped. With once=True, drain
+    the queue and return the number of jobs processed. Must run inside an app context.
+    run_job handles its own failures; an OperationalError leaves the job Running
+    so it is requeued once its heartbeat goes stale.
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+    failures = 0
+    logger.info(f"{model.__tablename__} worker {worker_id} started")
+
+    while True:
+        try:
+            requeue_stale_jobs(model, stale_seconds, max_attempts, interrupted_message)
+            job = claim_next_job(model, worker_id)
+            failures = 0
+        except OperationalError as e:
+            db.session.rollback()
+            failures += 1
+            delay = backoff_delay(failures - 1)
+            logger.warning(f"{model.__tablename__} worker {worker_id} lost the database ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_seconds)
+            continue
+
+        try:
+            run_job(job)
+        except OperationalError as e:
+            db.session.rollback()
+            logger.warning(f"{model.__tablename__} {job.job_id} interrupted by a database error: {e}")
+        processed += 1
+        db.session.remove()
@@ -1,14 +1,18 @@
-import logging, os, re, tempfile
+import logging, os
 from app import app, db
-from app.database import handle_db_connection
+from app.claim_rollup import add_claim_to_rollup, remove_claim_from_rollup
+from app.database import defer_until_commit, handle_db_connection, rollback_unit_of_work, unit_of_work_step
 from app.excel_generator import generate_claim_excel
-from app.models import Admin, ClaimApproval, ClaimAttachment, Department, Head, Lecturer, LecturerClaim, LecturerSubject, Other, ProgramOfficer, Rate, RequisitionApproval, Subject 
-from app.shared_routes import format_utc, get_current_utc, get_drive_service, is_already_reviewed, is_already_voided, process_signature_and_upload, send_email, sweetalert_response, to_utc_aware, upload_to_drive
-from datetime import datetime, timedelta
+from app.models import Admin, ClaimApproval, ClaimAttachment, ClaimMonthlyTotal, Department, Head, Lecturer, LecturerClaim, LecturerSubject, Other, ProgramOfficer, Rate, RequisitionApproval, Subject 
+from app.reminders import send_overdue_reminders
+from app.shared_routes import get_current_utc, get_remaining_hours, is_already_reviewed, is_already_voided, process_signature_and_upload, send_email, send_void_email, sweetalert_response
+from app.storage import delete_file, delete_uploaded_attachments, get_storage, upload_attachments, upload_file
+from datetime import datetime
 from flask import abort, jsonify, redirect, render_template, request, session, url_for
 from flask_bcrypt import Bcrypt
-from googleapiclient.http import MediaFileUpload
-from sqlalchemy import and_, desc, extract, func
+from sqlalchemy import and_, desc, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
 
 bcrypt = Bcrypt()
 logger = logging.getLogger(__name__)
@@ -92,18 +96,16 @@ def lecturerHomepage():
         for subj_code, assigned, taught in hours_data
     ]
 
-    # Claim Trends
+    # Claim Trends (from the monthly rollup)
     claim_trends = (
         db.session.query(
-            extract('year', LecturerClaim.date).label('year'),
-            extract('month', LecturerClaim.date).label('month'),
-            func.sum(LecturerClaim.total_cost).label("total_claims")
+            ClaimMonthlyTotal.year,
+            ClaimMonthlyTotal.month,
+            func.sum(ClaimMonthlyTotal.total_claims).label("total_claims")
         )
-        .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-        .filter(LecturerClaim.lecturer_id == lecturer_id)
-        .filter(ClaimApproval.status == "Completed")   # optional: only approved claims
-        .group_by(extract('year', LecturerClaim.date), extract('month', LecturerClaim.date))
-        .order_by(extract('year', LecturerClaim.date), extract('month', LecturerClaim.date))
+        .filter(ClaimMonthlyTotal.lecturer_id == lecturer_id)
+        .group_by(ClaimMonthlyTotal.year, ClaimMonthlyTotal.month)
+        .order_by(ClaimMonthlyTotal.year, ClaimMonthlyTotal.month)
         .all()
     )
 
@@ -393,20 +395,33 @@ def claimFormConversionResult():
         if missing_roles:
             return jsonify(success=False, error=f"Missing required role(s): {', '.join(missing_roles)}"), 400
 
-        # Generate Excel file
-        output_path, sign_col = generate_claim_excel(
-            name=name,
-            department_code=department_code,
-            subject_level=subject_level,
-            claim_details=claim_details,
-            po_name=po_name,
-            head_name=head_name,
-            dean_name=dean_name,
-            hr_name=hr_name
+        # Generate Excel and upload it once; a DB retry reuses the same Drive file
+        def build_and_upload_claim():
+            output_path, sign_col = generate_claim_excel(
+                name=name,
+                department_code=department_code,
+                subject_level=subject_level,
+                claim_details=claim_details,
+                po_name=po_name,
+                head_name=head_name,
+                dean_name=dean_name,
+                hr_name=hr_name
+            )
+            file_name = os.path.basename(output_path)
+            file_url, file_id = upload_file(output_path, file_name)
+            return file_url, file_id, file_name, sign_col
+
+        file_url, file_id, file_name, sign_col = unit_of_work_step(
+            'claim_file', build_and_upload_claim,
+            compensate=lambda uploaded: delete_file(uploaded[1])
         )
 
-        file_name = os.path.basename(output_path)
-        file_url, file_id = upload_to_drive(output_path, file_name)
+        # ======= Handle Attachments ========
+        attachment_urls = unit_of_work_step(
+            'claim_attachments', upload_attachments,
+            request.files.getlist('upload_claim_attachment'),
+            compensate=delete_uploaded_attachments
+        )
 
         # Save to database
         approval = ClaimApproval(
@@ -456,63 +471,30 @@ def claimFormConversionResult():
             )
             db.session.add(lc)
 
-        db.session.commit()
-
-        # ======= Handle Attachments ========
-        attachments = request.files.getlist('upload_claim_attachment')
-        attachment_urls = []
-
-        if attachments:
-            drive_service = get_drive_service()
-            lecturer_id = session.get('lecturer_id')
-            if not lecturer_id:
-                return jsonify({
-                    'success': False,
-                    'error': 'Lecturer session not found. Please login again.'
-                }), 400
-
-            for attachment in attachments:
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    attachment.save(tmp.name)
-
-                    file_metadata = {'name': attachment.filename}
-                    media = MediaFileUpload(tmp.name, mimetype=attachment.mimetype, resumable=True)
-                    uploaded = drive_service.files().create(
-                        body=file_metadata,
-                        media_body=media,
-                        fields='id'
-                    ).execute()
-
-                    # Set public view permission
-                    drive_service.permissions().create(
-                        fileId=uploaded['id'],
-                        body={'type': 'anyone', 'role': 'reader'},
-                    ).execute()
-
-                    file_url = f"https://drive.google.com/file/d/{uploaded['id']}/view"
-                    attachment_urls.append((attachment.filename, file_url))
-                    os.unlink(tmp.name)
-
-            # Save to ClaimAttachment table
-            for filename, url in attachment_urls:
-                claim_attachment = ClaimAttachment(
-                    attachment_name=filename,
-                    attachment_url=url,
-                    lecturer_id=lecturer_id,
-                    claim_id=approval_id
-                )
-                db.session.add(claim_attachment)
+        # Save to ClaimAttachment table
+        for filename, url in attachment_urls:
+            claim_attachment = ClaimAttachment(
+                attachment_name=filename,
+                attachment_url=url,
+                lecturer_id=session.get('lecturer_id'),
+                claim_id=approval_id
+            )
+            db.session.add(claim_attachment)
 
-            db.session.commit()
+        # Single transaction, committed by handle_db_connection
+        db.session.flush()
 
         return jsonify({
             'success': True,
             'file_url': file_url,
             'attachments': [{'name': fn, 'url': url} for fn, url in attachment_urls]
         })
-        
+
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
-        db.session.rollback()
+        rollback_unit_of_work()
         logger.error(f"Error while converting claim result: {e}")
         return jsonify(success=False, error=str(e)), 500
 
@@ -562,30 +544,16 @@ def lecturerClaimsPage():
         .join(RequisitionApproval, LecturerSubject.requisition_id == RequisitionApproval.approval_id)
         .filter(LecturerSubject.lecturer_id == lecturer_id)
         .filter(RequisitionApproval.status == 'Completed')  # Only completed requisitions
+        .options(joinedload(LecturerSubject.rate))
         .order_by(desc(RequisitionApproval.approval_id))
         .all()
     )
 
+    remaining_hours = get_remaining_hours([row[0] for row in subjects])
+
     claimDetails = []
 
     for ls, code, title, level in subjects:
-        # ✅ Only sum claims linked to COMPLETED claim approvals
-        claimed = (
-            db.session.query(
-                func.coalesce(func.sum(LecturerClaim.lecture_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.tutorial_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.practical_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.blended_hours), 0)
-            )
-            .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-            .filter(
-                LecturerClaim.lecturer_id == lecturer_id,
-                LecturerClaim.subject_id == ls.subject_id,
-                ClaimApproval.status == 'Completed'   # ✅ New condition
-            )
-            .first()
-        )
-
         remaining = {
             'subject_code': code,
             'subject_title': title,
@@ -593,10 +561,7 @@ def lecturerClaimsPage():
             'start_date': ls.start_date,
             'end_date': ls.end_date,
             'hourly_rate': ls.rate.amount if ls.rate else 0,
-            'lecture_hours': ls.total_lecture_hours - claimed[0],
-            'tutorial_hours': ls.total_tutorial_hours - claimed[1],
-            'practical_hours': ls.total_practical_hours - claimed[2],
-            'blended_hours': ls.total_blended_hours - claimed[3],
+            **remaining_hours[(ls.lecturer_id, ls.requisition_id, ls.subject_id)]
         }
         claimDetails.append(remaining)
 
@@ -644,18 +609,20 @@ def lecturer_review_claim(approval_id):
         approval.last_updated = get_current_utc()
         db.session.commit()
 
-        try:
-            notify_approval(approval, approval.program_officer.email if approval.program_officer else None, "po_review_claim", "Program Officer")
-        except Exception as e:
-            logger.error(f"Failed to notify PO: {e}")    
+        # Notify only once the status change is committed
+        defer_until_commit(notify_approval, approval, approval.program_officer.email if approval.program_officer else None, "po_review_claim", "Program Officer")
 
         return jsonify(success=True)
 
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
         logger.error(f"Error uploading signature: {e}")
         return jsonify(success=False, error=str(e)), 500
     
 @app.route('/api/po_review_claim/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def po_review_claim(approval_id):
     approval = ClaimApproval.query.get(approval_id)
     if not approval:
@@ -694,7 +661,12 @@ def po_review_claim(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving claim {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -721,6 +693,7 @@ def po_review_claim(approval_id):
     return "Invalid action", 400
 
 @app.route('/api/head_review_claim/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def head_review_claim(approval_id):
     approval = ClaimApproval.query.get(approval_id)
     if not approval:
@@ -759,7 +732,12 @@ def head_review_claim(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving claim {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -786,6 +764,7 @@ def head_review_claim(approval_id):
     return "Invalid action", 400
 
 @app.route('/api/dean_review_claim/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def dean_review_claim(approval_id):
     approval = ClaimApproval.query.get(approval_id)
     if not approval:
@@ -826,7 +805,12 @@ def dean_review_claim(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving claim {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -853,6 +837,7 @@ def dean_review_claim(approval_id):
     return "Invalid action", 400
 
 @app.route('/api/hr_review_claim/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def hr_review_claim(approval_id):
     approval = ClaimApproval.query.get(approval_id)
     if not approval:
@@ -878,6 +863,7 @@ def hr_review_claim(approval_id):
             process_signature_and_upload(approval, request.form.get('signature_data'), "G")
             approval.status = "Completed"
             approval.last_updated = get_current_utc()
+            add_claim_to_rollup(approval.approval_id)
             db.session.commit()
 
             """ # ---- Save LecturerClaim rows related to this approval ----
@@ -959,7 +945,12 @@ def hr_review_claim(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving claim {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -1042,12 +1033,13 @@ def void_claim(approval_id):
         )
 
         if recipients:
-            success = send_email(recipients, subject, body)
-            if not success:
-                logger.error(f"Failed to send void notification email to: {recipients}")
+            defer_until_commit(send_void_email, recipients, subject, body)
         
         return jsonify(success=True)
 
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
         logger.error(f"Error voiding claim: {e}")
         return jsonify(success=False, error="Internal server error."), 500
@@ -1074,45 +1066,41 @@ def delete_claim_and_attachment(approval_id, suffix):
         name, ext = os.path.splitext(approval.file_name)
         new_file_name = f"{name}_{suffix}{ext}"
 
-        # Update Google Drive file name
+        # Update the stored file's name
         if approval.file_id:
             try:
-                drive_service = get_drive_service()
-                file_metadata = {"name": new_file_name}
-                drive_service.files().update(fileId=approval.file_id, body=file_metadata).execute()
-                logger.info(f"Renamed Google Drive file {approval.file_name} -> {new_file_name}")
+                get_storage().rename(approval.file_id, new_file_name)
+                logger.info(f"Renamed stored file {approval.file_name} -> {new_file_name}")
             except Exception as e:
-                logger.error(f"Failed to rename Google Drive file '{approval.file_name}': {e}")
+                logger.error(f"Failed to rename stored file '{approval.file_name}': {e}")
 
         # Update DB field
         approval.file_name = new_file_name
     
+    # Take a previously completed claim out of the dashboard rollup
+    remove_claim_from_rollup(approval)
+
     # Delete linked LecturerClaim entries
     LecturerClaim.query.filter_by(claim_id=approval_id).delete(synchronize_session=False)
 
     # Delete related attachments
     try:
-        drive_service = get_drive_service()
+        storage = get_storage()
         attachments_to_delete = ClaimAttachment.query.filter_by(claim_id=approval_id).all()
         for attachment in attachments_to_delete:
-            try:
-                # Extract file ID from Google Drive URL
-                match = re.search(r'/d/([a-zA-Z0-9_-]+)', attachment.attachment_url)
-                if not match:
-                    logger.warning(f"Invalid Google Drive URL format for attachment {attachment.attachment_name}")
-                    continue
-                drive_attachment_id = match.group(1)
-
-                # Delete file from Google Drive
-                drive_service.files().delete(fileId=drive_attachment_id).execute()
+            # Extract file ID from the stored file URL
+            attachment_file_id = storage.file_id_from_url(attachment.attachment_url)
+            if not attachment_file_id:
+                logger.warning(f"Unrecognised file URL for attachment {attachment.attachment_name}")
+                continue
 
-                # Delete attachment record from database
+            # Keep the record if the file could not be deleted
+            if storage.delete(attachment_file_id):
                 db.session.delete(attachment)
-
-            except Exception as e:
-                logger.error(f"Failed to delete Drive attachment '{attachment.attachment_name}': {e}")
+            else:
+                logger.error(f"Failed to delete stored attachment '{attachment.attachment_name}'")
     except Exception as e:
-        logger.error(f"Failed to initialize Drive service or delete attachments: {e}")
+        logger.error(f"Failed to initialize storage or delete attachments: {e}")
 
     # Commit DB changes
     db.session.commit()
@@ -1197,93 +1185,5 @@ def send_rejection_email(role, approval, reason):
     send_email(recipients, subject, body)
 
 def check_overdue_claims():
-    now = get_current_utc()
-    overdue_time = now - timedelta(hours=48)
-
-    # Ensure overdue_time is UTC-aware
-    overdue_time = to_utc_aware(overdue_time)
-
-    # Filter pending > 48h
-    approvals = ClaimApproval.query.filter(
-        ClaimApproval.status.like("Pending%"),
-        ClaimApproval.last_updated < overdue_time
-    ).all()
-
-
-    for approval in approvals:
-        try:
-            last_reminder = to_utc_aware(approval.last_reminder_sent)
-            last_updated = to_utc_aware(approval.last_updated)
-
-            # Skip if status updated within last 48h
-            if last_updated and (now - last_updated) < timedelta(hours=48):
-                continue
-
-            # Skip if reminder already sent within last 48h
-            if last_reminder and (now - last_reminder) < timedelta(hours=48):
-                continue
-
-            # Collect attachments
-            attachments = get_claim_attachments(approval.approval_id)
-            attachment_list = [
-                {'filename': att.attachment_name, 'url': att.attachment_url}
-                for att in attachments
-            ]
-
-            recipients, greeting, review_url = [], None, None
-
-            # Map status → recipient and URL
-            if approval.status == "Pending Acknowledgement by Lecturer" and approval.program_officer:
-                recipients.append(approval.program_officer.email)
-                greeting = "Lecturer"
-                review_url = url_for("lecturer_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by PO" and approval.program_officer:
-                recipients.append(approval.program_officer.email)
-                greeting = "Program Officer"
-                review_url = url_for("po_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by HOP" and approval.head:
-                recipients.append(approval.head.email)
-                greeting = "Head of Programme"
-                review_url = url_for("head_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by Dean / HOS" and approval.department:
-                if approval.department.dean_email:
-                    recipients.append(approval.department.dean_email)
-                greeting = "Dean / HOS"
-                review_url = url_for("dean_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by HR":
-                hr = Other.query.filter_by(role="Human Resources").first()
-                if hr and hr.email:
-                    recipients.append(hr.email)
-                greeting = "HR"
-                review_url = url_for("hr_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            if recipients and review_url:
-                # Subject + body
-                subject = f"REMINDER: Part-time Lecturer Claim Approval Request - {approval.lecturer.name} ({approval.subject_level})"
-                body = (
-                    f"Dear {greeting},\n\n"
-                    f"This claim request has been pending since {format_utc(last_updated)}.\n"
-                    f"Please review and take action using the link below:\n"
-                    f"{review_url}\n\n"
-                )
-
-                if attachment_list:
-                    body += "Attachments are included for your reference.\n\n"
-
-                body += "Thank you,\nThe CourseXcel Team"
-                send_email(recipients, subject, body, attachments=attachment_list)
-
-                # Update reminder timestamp
-                approval.last_reminder_sent = now
-                db.session.commit()
-
-                logger.info(f"Reminder sent to {recipients} for approval {approval.approval_id}")
-            else:
-                logger.warning(f"No recipients found for approval {approval.approval_id} with status {approval.status}")
-
-        except Exception as e:
-            logger.error(f"Failed to send reminder for {approval.approval_id}: {e}")
+    """Queue reminders for overdue claim approvals (see app.reminders)."""
+    return send_overdue_reminders(requisitions=False, claims=True)
@@ -293,6 +293,25 @@ class LecturerClaim(db.Model):
     def __repr__(self):
         return f'<Lecturer Claim: {self.claim_id}>'
 
+class ClaimMonthlyTotal(db.Model):
+    __tablename__ = 'claim_monthly_total'
+
+    total_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.department_id', ondelete='CASCADE'), nullable=True)
+    lecturer_id = db.Column(db.Integer, db.ForeignKey('lecturer.lecturer_id', ondelete='CASCADE'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    total_claims = db.Column(db.Integer, default=0)
+    claim_rows = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('department_id', 'lecturer_id', 'year', 'month', name='uq_claim_monthly_total'),
+        db.Index('ix_claim_monthly_total_year_month', 'year', 'month'),
+    )
+
+    def __repr__(self):
+        return f'<Claim Monthly Total: {self.lecturer_id} {self.year}-{self.month:02d}>'
+
 class ClaimAttachment(db.Model):
     __tablename__ = 'claim_attachment'
 
@@ -316,6 +335,11 @@ class RequisitionReport(db.Model):
     file_url = db.Column(db.String(500), nullable=True)
     start_date = db.Column(db.Date, nullable=True)
     end_date = db.Column(db.Date, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # report cache key, cleared when the range changes
+
+    __table_args__ = (
+        db.Index('ix_requisition_report_content_hash', 'content_hash'),
+    )
 
     def __repr__(self):
         return f'<Requisition Report: {self.report_id}>'
@@ -329,6 +353,146 @@ class ClaimReport(db.Model):
     file_url = db.Column(db.String(500), nullable=True)
     start_date = db.Column(db.Date, nullable=True)
     end_date = db.Column(db.Date, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # report cache key, cleared when the range changes
+
+    __table_args__ = (
+        db.Index('ix_claim_report_content_hash', 'content_hash'),
+    )
 
     def __repr__(self):
         return f'<Claim Report: {self.report_id}>'
+
+class ReportJob(db.Model):
+    __tablename__ = 'report_job'
+
+    job_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    report_type = db.Column(db.String(20), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Queued')  # Queued / Running / Completed / Failed
+    stage = db.Column(db.String(20), nullable=False, default='queued')   # queued / query / render / upload / done
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(255), nullable=True)
+    active_key = db.Column(db.String(60), unique=True, nullable=True)   # set while Queued/Running, dedupes identical requests
+    report_id = db.Column(db.Integer, nullable=True)                    # requisition_report / claim_report row once done
+    file_url = db.Column(db.String(500), nullable=True)
+    requested_by = db.Column(db.Integer, db.ForeignKey('admin.admin_id', ondelete='SET NULL'), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(DateTime(timezone=True), default=func.now())
+    started_at = db.Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = db.Column(DateTime(timezone=True), nullable=True)
+    finished_at = db.Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_report_job_status', 'status', 'job_id'),
+    )
+
+    def __repr__(self):
+        return f'<Report Job: {self.job_id} {self.report_type} {self.status}>'
+
+class ArchiveJob(db.Model):
+    __tablename__ = 'archive_job'
+
+    job_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    status = db.Column(db.String(20), nullable=False, default='Queued')  # Queued / Running / Completed / Failed
+    stage = db.Column(db.String(20), nullable=False, default='queued')   # queued / collect / fetch / done
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.String(255), nullable=True)
+    active_key = db.Column(db.String(60), unique=True, nullable=True)   # set while Queued/Running, one archive build at a time
+    total_files = db.Column(db.Integer, nullable=False, default=0)
+    done_files = db.Column(db.Integer, nullable=False, default=0)
+    archive_id = db.Column(db.String(32), nullable=True)                # file under ARCHIVE_FOLDER once done
+    archive_bytes = db.Column(db.BigInteger, nullable=True)
+    download_name = db.Column(db.String(100), nullable=True)
+    requisition_ids = db.Column(db.Text, nullable=True)                 # JSON list archived, limits the follow-up cleanup
+    requested_by = db.Column(db.Integer, db.ForeignKey('admin.admin_id', ondelete='SET NULL'), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(DateTime(timezone=True), default=func.now())
+    started_at = db.Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = db.Column(DateTime(timezone=True), nullable=True)
+    finished_at = db.Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_archive_job_status', 'status', 'job_id'),
+    )
+
+    def __repr__(self):
+        return f'<Archive Job: {self.job_id} {self.status}>'
+
+class StoredBlob(db.Model):
+    __tablename__ = 'stored_blob'
+
+    backend = db.Column(db.String(10), primary_key=True)                # content-addressed backend holding the bytes (local / s3)
+    sha256 = db.Column(db.CHAR(64), primary_key=True)                   # content address of the bytes
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)        # stored_file rows pointing here
+    created_at = db.Column(DateTime(timezone=True), default=func.now())
+
+    def __repr__(self):
+        return f'<Stored Blob: {self.backend}:{self.sha256} x{self.ref_count}>'
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_file'
+
+    file_id = db.Column(db.String(64), primary_key=True)                # random token served at /files/<backend>/<file_id>
+    backend = db.Column(db.String(10), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    mime_type = db.Column(db.String(100), nullable=False)
+    sha256 = db.Column(db.CHAR(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(DateTime(timezone=True), default=func.now())
+    updated_at = db.Column(DateTime(timezone=True), default=func.now())
+
+    blob = db.relationship('StoredBlob')
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(['backend', 'sha256'], ['stored_blob.backend', 'stored_blob.sha256']),
+    )
+
+    def __repr__(self):
+        return f'<Stored File: {self.file_id} {self.name}>'
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+
+    outbox_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    recipients = db.Column(db.Text, nullable=False)                     # JSON list of addresses
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    attachments = db.Column(db.Text, nullable=True)                     # JSON list of {filename, url}, fetched at send time
+    status = db.Column(db.String(20), nullable=False, default='Queued')  # Queued / Sending / Sent / Failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(255), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(DateTime(timezone=True), default=func.now())
+    next_attempt_at = db.Column(DateTime(timezone=True), nullable=False, default=func.now())
+    claimed_at = db.Column(DateTime(timezone=True), nullable=True)
+    sent_at = db.Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<Email Outbox: {self.outbox_id} {self.status}>'
+
+class ScheduledTask(db.Model):
+    __tablename__ = 'scheduled_task'
+
+    name = db.Column(db.String(50), primary_key=True)                   # job name in app.scheduler.SCHEDULED_JOBS
+    schedule = db.Column(db.String(100), nullable=False)                # cron expression (UTC) the next run was computed from
+    next_run_at = db.Column(DateTime(timezone=True), nullable=False)
+    lease_owner = db.Column(db.String(100), nullable=True)              # scheduler instance running it right now
+    lease_expires_at = db.Column(DateTime(timezone=True), nullable=True)
+    last_started_at = db.Column(DateTime(timezone=True), nullable=True)
+    last_finished_at = db.Column(DateTime(timezone=True), nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_status = db.Column(db.String(20), nullable=True)               # Succeeded / Failed
+    last_error = db.Column(db.String(255), nullable=True)
+    last_result = db.Column(db.Text, nullable=True)                     # JSON summary returned by the job
+    run_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<Scheduled Task: {self.name} {self.last_status}>'
@@ -1,13 +1,16 @@
-import logging, os, re, tempfile
+import logging, os, re
 from app import app, db
-from app.database import handle_db_connection
-from app.models import Admin, ClaimApproval, ClaimAttachment, Department, Head, Lecturer, LecturerClaim, LecturerSubject, Other, ProgramOfficer, Rate, RequisitionApproval, RequisitionAttachment, Subject
+from app.database import defer_until_commit, handle_db_connection, rollback_unit_of_work, unit_of_work_step
+from app.models import Admin, ClaimApproval, ClaimMonthlyTotal, Department, Head, Lecturer, LecturerClaim, LecturerSubject, Other, ProgramOfficer, Rate, RequisitionApproval, RequisitionAttachment, Subject
 from app.excel_generator import generate_requisition_excel
-from app.shared_routes import delete_requisition_and_attachment, format_utc, get_current_utc, get_drive_service, is_already_reviewed, is_already_voided, process_signature_and_upload, send_email, sweetalert_response, to_utc_aware, upload_to_drive
-from datetime import datetime, timedelta
+from app.reminders import send_overdue_reminders
+from app.shared_routes import delete_requisition_and_attachment, get_current_utc, get_remaining_hours, is_already_reviewed, is_already_voided, process_signature_and_upload, send_email, send_void_email, sweetalert_response
+from app.storage import delete_file, delete_uploaded_attachments, upload_attachments, upload_file
+from datetime import datetime
 from flask import abort, jsonify, redirect, render_template, request, session, url_for
-from googleapiclient.http import MediaFileUpload
-from sqlalchemy import desc, extract, func
+from sqlalchemy import desc, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
 
 logger = logging.getLogger(__name__)
 
@@ -115,19 +118,17 @@ def poHomepage():
             "taught": int(taught or 0)
         })
 
-    # Lecturer Claim Trends
+    # Lecturer Claim Trends (from the monthly rollup)
     claim_trends = (
         db.session.query(
             Lecturer.name,
-            extract('year', LecturerClaim.date).label('year'),
-            extract('month', LecturerClaim.date).label('month'),
-            func.sum(LecturerClaim.total_cost).label("total_claims")
+            ClaimMonthlyTotal.year,
+            ClaimMonthlyTotal.month,
+            func.sum(ClaimMonthlyTotal.total_claims).label("total_claims")
         )
-        .join(Lecturer, Lecturer.lecturer_id == LecturerClaim.lecturer_id)
-        .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-        .filter(ClaimApproval.status == "Completed")
-        .filter(Lecturer.department_id == po.department_id)  # only same dept as PO
-        .group_by(Lecturer.name, extract('year', LecturerClaim.date), extract('month', LecturerClaim.date))
+        .join(Lecturer, Lecturer.lecturer_id == ClaimMonthlyTotal.lecturer_id)
+        .filter(ClaimMonthlyTotal.department_id == po.department_id)  # only same dept as PO
+        .group_by(Lecturer.name, ClaimMonthlyTotal.year, ClaimMonthlyTotal.month)
         .all()
     )
 
@@ -328,23 +329,36 @@ def requisitionFormConversionResult():
         ad_name = ad.name if ad else 'N/A'
         hr_name = hr.name if hr else 'N/A'
 
-        # Generate Excel
-        output_path, sign_col = generate_requisition_excel(
-            department_code=department_code,
-            name=name,
-            designation=designation,
-            ic_number=ic_number,
-            subject_level=request.form.get('subjectLevel1'),
-            course_details=course_details,
-            po_name=po_name,
-            head_name=head_name,
-            dean_name=dean_name,
-            ad_name=ad_name,
-            hr_name=hr_name
+        # Generate Excel and upload it once; a DB retry reuses the same Drive file
+        def build_and_upload_requisition():
+            output_path, sign_col = generate_requisition_excel(
+                department_code=department_code,
+                name=name,
+                designation=designation,
+                ic_number=ic_number,
+                subject_level=request.form.get('subjectLevel1'),
+                course_details=course_details,
+                po_name=po_name,
+                head_name=head_name,
+                dean_name=dean_name,
+                ad_name=ad_name,
+                hr_name=hr_name
+            )
+            file_name = os.path.basename(output_path)
+            file_url, file_id = upload_file(output_path, file_name)
+            return file_url, file_id, file_name, sign_col
+
+        file_url, file_id, file_name, sign_col = unit_of_work_step(
+            'requisition_file', build_and_upload_requisition,
+            compensate=lambda uploaded: delete_file(uploaded[1])
         )
 
-        file_name = os.path.basename(output_path)
-        file_url, file_id = upload_to_drive(output_path, file_name)
+        # ======= Handle Attachments ========
+        attachment_urls = unit_of_work_step(
+            'requisition_attachments', upload_attachments,
+            request.files.getlist('upload_requisition_attachment'),
+            compensate=delete_uploaded_attachments
+        )
 
         # Create Approval Record
         approval = RequisitionApproval(
@@ -402,53 +416,26 @@ def requisitionFormConversionResult():
             )
             db.session.add(lecturer_subject)
 
-        db.session.commit()
-
-        # ======= Handle Attachments ========
-        attachments = request.files.getlist('upload_requisition_attachment')
-        attachment_urls = []
-
-        if attachments:
-            drive_service = get_drive_service()
-            
-            for attachment in attachments:
-                with tempfile.NamedTemporaryFile(delete=False) as tmp:
-                    attachment.save(tmp.name)
-
-                    file_metadata = {'name': attachment.filename}
-                    media = MediaFileUpload(tmp.name, mimetype=attachment.mimetype, resumable=True)
-                    uploaded = drive_service.files().create(
-                        body=file_metadata,
-                        media_body=media,
-                        fields='id'
-                    ).execute()
-
-                    # Set public view permission
-                    drive_service.permissions().create(
-                        fileId=uploaded['id'],
-                        body={'type': 'anyone', 'role': 'reader'},
-                    ).execute()
-
-                    file_url = f"https://drive.google.com/file/d/{uploaded['id']}/view"
-                    attachment_urls.append((attachment.filename, file_url))
-                    os.unlink(tmp.name)
-
-            # Save to ClaimAttachment table
-            for filename, url in attachment_urls:
-                requisition_attachment = RequisitionAttachment(
-                    attachment_name=filename,
-                    attachment_url=url,
-                    lecturer_id=lecturer_id,
-                    requisition_id=approval_id
-                )
-                db.session.add(requisition_attachment)
+        # Save to RequisitionAttachment table
+        for filename, url in attachment_urls:
+            requisition_attachment = RequisitionAttachment(
+                attachment_name=filename,
+                attachment_url=url,
+                lecturer_id=lecturer_id,
+                requisition_id=approval_id
+            )
+            db.session.add(requisition_attachment)
 
-            db.session.commit()
+        # Single transaction, committed by handle_db_connection
+        db.session.flush()
 
         return jsonify(success=True, file_url=file_url)
-        
+
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
-        db.session.rollback()
+        rollback_unit_of_work()
         logger.error(f"Error in converting requisition result: {e}")
         return jsonify(success=False, error=str(e)), 500
 
@@ -508,30 +495,8 @@ def poApprovalsPage():
         .all()
     )
     
-    requisitionApprovals = RequisitionApproval.query.filter_by(po_id=po_id)\
-                                    .order_by(RequisitionApproval.approval_id.desc())\
-                                    .all()
-    # Requisition attachments that belong to approvals under this PO
-    requisitionAttachments = (
-        db.session.query(RequisitionAttachment)
-        .join(RequisitionApproval, RequisitionAttachment.requisition_id == RequisitionApproval.approval_id)
-        .filter(RequisitionApproval.po_id == po_id)
-        .order_by(RequisitionAttachment.attachment_id.desc())
-        .all()
-    )
+    # Requisition/claim approvals and attachments are loaded page by page via /api/approvals
 
-    claimApprovals = ClaimApproval.query.filter_by(po_id=po_id)\
-                                    .order_by(ClaimApproval.approval_id.desc())\
-                                    .all()
-    # Claim attachments that belong to approvals under this PO
-    claimAttachments = (
-        db.session.query(ClaimAttachment)
-        .join(ClaimApproval, ClaimAttachment.claim_id == ClaimApproval.approval_id)
-        .filter(ClaimApproval.po_id == po_id)
-        .order_by(ClaimAttachment.attachment_id.desc())
-        .all()
-    )
-      
     # Get all LecturerSubject records linked to completed requisitions
     subjects = (
         db.session.query(
@@ -548,28 +513,15 @@ def poApprovalsPage():
             RequisitionApproval.status == 'Completed',
             RequisitionApproval.po_id == po_id
         )
+        .options(joinedload(LecturerSubject.rate))
         .order_by(desc(RequisitionApproval.approval_id))
         .all()
     )
 
+    remaining_hours = get_remaining_hours([row[0] for row in subjects])
+
     claimDetails = []
     for ls, lecturer, code, title, level in subjects:
-        claimed = (
-            db.session.query(
-                func.coalesce(func.sum(LecturerClaim.lecture_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.tutorial_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.practical_hours), 0),
-                func.coalesce(func.sum(LecturerClaim.blended_hours), 0)
-            )
-            .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
-            .filter(
-                LecturerClaim.lecturer_id == lecturer.lecturer_id,
-                LecturerClaim.subject_id == ls.subject_id,
-                ClaimApproval.status == 'Completed'
-            )
-            .first()
-        )
-
         remaining = {
             'lecturer': lecturer,
             'subject_code': code,
@@ -578,19 +530,12 @@ def poApprovalsPage():
             'start_date': ls.start_date,
             'end_date': ls.end_date,
             'hourly_rate': ls.rate.amount if ls.rate else 0,
-            'lecture_hours': ls.total_lecture_hours - claimed[0],
-            'tutorial_hours': ls.total_tutorial_hours - claimed[1],
-            'practical_hours': ls.total_practical_hours - claimed[2],
-            'blended_hours': ls.total_blended_hours - claimed[3],
+            **remaining_hours[(ls.lecturer_id, ls.requisition_id, ls.subject_id)]
         }
         claimDetails.append(remaining)
 
     return render_template('poApprovalsPage.html', 
                            lecturers=lecturers,
-                           requisitionApprovals=requisitionApprovals,
-                           requisitionAttachments=requisitionAttachments,
-                           claimApprovals=claimApprovals,
-                           claimAttachments=claimAttachments,
                            claimDetails=claimDetails)
 
 @app.route('/set_poApprovalsPage_tab', methods=['POST'])
@@ -630,18 +575,20 @@ def po_review_requisition(approval_id):
         approval.last_updated = get_current_utc()
         db.session.commit()
 
-        try:
-            notify_approval(approval, approval.head.email if approval.head else None, "head_review_requisition", "Head of Programme")
-        except Exception as e:
-            logger.error(f"Failed to notify HOP: {e}")    
+        # Notify only once the status change is committed
+        defer_until_commit(notify_approval, approval, approval.head.email if approval.head else None, "head_review_requisition", "Head of Programme")
 
         return jsonify(success=True)
 
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
         logger.error(f"Error uploading signature: {e}")
         return jsonify(success=False, error=str(e)), 500
     
 @app.route('/api/head_review_requisition/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def head_review_requisition(approval_id):
     approval = RequisitionApproval.query.get(approval_id)
     if not approval:
@@ -680,7 +627,12 @@ def head_review_requisition(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving requisition {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -707,6 +659,7 @@ def head_review_requisition(approval_id):
     return "Invalid action", 400
   
 @app.route('/api/dean_review_requisition/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def dean_review_requisition(approval_id):
     approval = RequisitionApproval.query.get(approval_id)
     if not approval:
@@ -747,7 +700,12 @@ def dean_review_requisition(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving requisition {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -774,6 +732,7 @@ def dean_review_requisition(approval_id):
     return "Invalid action", 400
         
 @app.route('/api/ad_review_requisition/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def ad_review_requisition(approval_id):
     approval = RequisitionApproval.query.get(approval_id)
     if not approval:
@@ -813,7 +772,12 @@ def ad_review_requisition(approval_id):
                 title="Request Approved",
                 text="Request approved successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving requisition {approval_id}: {e}")
             return str(e), 500
 
     elif action == 'reject':
@@ -840,6 +804,7 @@ def ad_review_requisition(approval_id):
     return "Invalid action", 400
         
 @app.route('/api/hr_review_requisition/<approval_id>', methods=['GET', 'POST'])
+@handle_db_connection
 def hr_review_requisition(approval_id):
     approval = RequisitionApproval.query.get(approval_id)
     if not approval:
@@ -950,7 +915,12 @@ def hr_review_requisition(approval_id):
                 title="Request Confirmed",
                 text="Request confirmed successfully."
             )
+        except OperationalError:
+            raise  # let handle_db_connection retry the DB part only
         except Exception as e:
+            # Undo the signature stamped on the sheet along with the DB changes
+            rollback_unit_of_work()
+            logger.error(f"Error while approving requisition {approval_id}: {e}")
             return str(e), 500
     
     return "Invalid action", 400
@@ -1014,12 +984,13 @@ def void_requisition(approval_id):
         )
 
         if recipients:
-            success = send_email(recipients, subject, body)
-            if not success:
-                logger.error(f"Failed to send void notification email to: {recipients}")
+            defer_until_commit(send_void_email, recipients, subject, body)
         
         return jsonify(success=True)
 
+    except OperationalError:
+        raise  # let handle_db_connection retry the DB part only
+
     except Exception as e:
         logger.error(f"Error voiding requisition: {e}")
         return jsonify(success=False, error="Internal server error."), 500
@@ -1125,109 +1096,5 @@ def send_rejection_email(role, approval, reason):
     send_email(recipients, subject, body)
 
 def check_overdue_requisitions():
-    now = get_current_utc()
-    overdue_time = now - timedelta(hours=48)
-
-    # Ensure overdue_time is UTC-aware
-    overdue_time = to_utc_aware(overdue_time)
-
-    # Filter pending > 48h
-    approvals = RequisitionApproval.query.filter(
-        RequisitionApproval.status.like("Pending%"),
-        RequisitionApproval.last_updated < overdue_time
-    ).all()
-
-    for approval in approvals:
-        try:
-            last_reminder = to_utc_aware(approval.last_reminder_sent)
-            last_updated = to_utc_aware(approval.last_updated)
-
-            # Skip if status updated within last 48h
-            if last_updated and (now - last_updated) < timedelta(hours=48):
-                continue
-
-            # Skip if reminder already sent within last 48h
-            if last_reminder and (now - last_reminder) < timedelta(hours=48):
-                continue
-
-            # Collect attachments
-            attachments = get_requisition_attachments(approval.approval_id)
-            attachment_list = [
-                {"filename": att.attachment_name, "url": att.attachment_url}
-                for att in attachments
-            ]
-
-            recipients, greeting, review_url = [], None, None
-
-            # Map status → recipient and URL
-            if approval.status == "Pending Acknowledgement by PO" and approval.program_officer:
-                recipients.append(approval.program_officer.email)
-                greeting = "Program Officer"
-                review_url = url_for("po_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by HOP" and approval.head:
-                recipients.append(approval.head.email)
-                greeting = "Head of Programme"
-                review_url = url_for("head_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by Dean / HOS" and approval.department:
-                if approval.department.dean_email:
-                    recipients.append(approval.department.dean_email)
-                greeting = "Dean / HOS"
-                review_url = url_for("dean_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by Academic Director":
-                ad = Other.query.filter_by(role="Academic Director").first()
-                if ad and ad.email:
-                    recipients.append(ad.email)
-                greeting = "Academic Director"
-                review_url = url_for("ad_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            elif approval.status == "Pending Acknowledgement by HR":
-                hr = Other.query.filter_by(role="Human Resources").first()
-                if hr and hr.email:
-                    recipients.append(hr.email)
-                greeting = "HR"
-                review_url = url_for("hr_review_requisition", approval_id=approval.approval_id, _external=True)
-
-            if recipients and review_url:
-                # Subject + body
-                if greeting == "HR":
-                    subject = (
-                        f"REMINDER: Part-time Lecturer Requisition Acknowledgement Required - "
-                        f"{approval.lecturer.name} ({approval.subject_level})"
-                    )
-                    body = (
-                        f"Dear {greeting},\n\n"
-                        f"This requisition request has been pending since {format_utc(last_updated)}.\n"
-                        f"Please acknowledge it as soon as possible by clicking the link below:\n"
-                        f"{review_url}\n\n"
-                    )
-                else:
-                    subject = (
-                        f"REMINDER: Part-time Lecturer Requisition Approval Request - "
-                        f"{approval.lecturer.name} ({approval.subject_level})"
-                    )
-                    body = (
-                        f"Dear {greeting},\n\n"
-                        f"This requisition request has been pending since {format_utc(last_updated)}.\n"
-                        f"Please review and take action using the link below:\n"
-                        f"{review_url}\n\n"
-                    )
-
-                if attachment_list:
-                    body += "Attachments are included for your reference.\n\n"
-
-                body += "Thank you,\nThe CourseXcel Team"
-                send_email(recipients, subject, body, attachments=attachment_list)
-
-                # Update reminder timestamp
-                approval.last_reminder_sent = now
-                db.session.commit()
-
-                logger.info(f"Reminder sent to {recipients} for approval {approval.approval_id}")
-            else:
-                logger.warning(f"No recipients found for approval {approval.approval_id} with status {approval.status}")
-
-        except Exception as e:
-            logger.error(f"Failed to send reminder for {approval.approval_id}: {e}")
+    """Queue reminders for overdue requisition approvals (see app.reminders)."""
+    return send_overdue_reminders(requisitions=True, claims=False)
@@ -0,0 +1,237 @@
+import logging, time
+from app import app, db
+from app.email_outbox import outbox_values
+from app.models import ClaimApproval, ClaimAttachment, EmailOutbox, Other, RequisitionApproval, RequisitionAttachment
+from app.shared_routes import format_utc, get_current_utc, to_utc_aware
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from flask import url_for
+from sqlalchemy import insert, or_, update
+from sqlalchemy.orm import joinedload
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Bulk Reminder Engine
+# ============================================================
+# Approvals left pending for REMINDER_AFTER_HOURS (and not reminded within
+# that time) get a reminder for whoever must act next. One run:
+#   1. prefetches the overdue approvals with their people, their attachments
+#      and the Academic Director / HR contacts in a handful of queries;
+#   2. groups the reminders by recipient, so each person gets one email (a
+#      digest when several requests are waiting on them);
+#   3. queues every email and stamps last_reminder_sent in one transaction
+#      (one INSERT and one UPDATE per table), so a reminder is recorded
+#      exactly when its email is queued;
+# and returns per-stage timings. The emails go out through the outbox worker
+# over a single SMTP connection (app.scheduler drains it right after the run).
+
+# status -> (greeting, who acts, review route); "who" is an approval attribute or an Other.role
+REQUISITION_STEPS = {
+    "Pending Acknowledgement by PO": ("Program Officer", "program_officer", "po_review_requisition"),
+    "Pending Acknowledgement by HOP": ("Head of Programme", "head", "head_review_requisition"),
+    "Pending Acknowledgement by Dean / HOS": ("Dean / HOS", "dean", "dean_review_requisition"),
+    "Pending Acknowledgement by Academic Director": ("Academic Director", "Academic Director", "ad_review_requisition"),
+    "Pending Acknowledgement by HR": ("HR", "Human Resources", "hr_review_requisition"),
+}
+CLAIM_STEPS = {
+    "Pending Acknowledgement by Lecturer": ("Lecturer", "lecturer", "lecturerHomepage"),
+    "Pending Acknowledgement by PO": ("Program Officer", "program_officer", "po_review_claim"),
+    "Pending Acknowledgement by HOP": ("Head of Programme", "head", "head_review_claim"),
+    "Pending Acknowledgement by Dean / HOS": ("Dean / HOS", "dean", "dean_review_claim"),
+    "Pending Acknowledgement by HR": ("HR", "Human Resources", "hr_review_claim"),
+}
+OTHER_ROLES = ("Academic Director", "Human Resources")
+
+# One overdue approval waiting on one recipient
+Reminder = namedtuple("Reminder", "kind approval greeting review_url pending_since attachments")
+
+def _overdue(model, cutoff):
+    """Overdue approvals of `model` with the people a reminder needs, in one query."""
+    return (
+        model.query
+        .options(
+            joinedload(model.program_officer),
+            joinedload(model.head),
+            joinedload(model.department),
+            joinedload(model.lecturer),
+        )
+        .filter(
+            model.status.like("Pending%"),
+            model.last_updated < cutoff,
+            or_(model.last_reminder_sent.is_(None), model.last_reminder_sent < cutoff),
+        )
+        .order_by(model.approval_id)
+        .all()
+    )
+
+def _attachments_by_approval(model, key, approval_ids):
+    """{approval_id: [{'filename', 'url'}]} for all approvals in one IN query."""
+    attachments = defaultdict(list)
+    if approval_ids:
+        for att in model.query.filter(getattr(model, key).in_(approval_ids)).all():
+            attachments[getattr(att, key)].append({"filename": att.attachment_name, "url": att.attachment_url})
+    return attachments
+
+def _other_contacts():
+    """First Other.email per role, as Other.query.filter_by(role=...).first() would return."""
+    contacts = {}
+    for other in Other.query.filter(Other.role.in_(OTHER_ROLES)).order_by(Other.other_id).all():
+        if other.email:
+            contacts.setdefault(other.role, other.email)
+    return contacts
+
+def _recipient(approval, who, contacts):
+    if who == "program_officer":
+        return approval.program_officer.email if approval.program_officer else None
+    if who == "head":
+        return approval.head.email if approval.head else None
+    if who == "dean":
+        return approval.department.dean_email if approval.department else None
+    if who == "lecturer":
+        return approval.lecturer.email if approval.lecturer else None
+    return contacts.get(who)
+
+def collect_reminders(kind, approvals, steps, attachments, contacts):
+    """Group reminders by recipient email. Returns ({email: [Reminder]}, skipped approval ids)."""
+    by_recipient = defaultdict(list)
+    skipped = []
+    for approval in approvals:
+        step = steps.get(approval.status)
+        recipient = _recipient(approval, step[1], contacts) if step else None
+        if not recipient:
+            logger.warning(f"No recipients found for {kind} approval {approval.approval_id} with status {approval.status}")
+            skipped.append(approval.approval_id)
+            continue
+
+        greeting, _, route = step
+        if route == "lecturerHomepage":
+            review_url = url_for(route, _external=True)
+        else:
+            review_url = url_for(route, approval_id=approval.approval_id, _external=True)
+        by_recipient[recipient].append(Reminder(
+            kind, approval, greeting, review_url,
+            to_utc_aware(approval.last_updated), attachments.get(approval.approval_id, [])
+        ))
+    return by_recipient, skipped
+
+def _describe(reminder):
+    approval = reminder.approval
+    name = approval.lecturer.name if approval.lecturer else "Unknown lecturer"
+    return f"{name} ({approval.subject_level})"
+
+def build_reminder_email(reminders):
+    """(subject, body, attachments) for one recipient: the single reminder, or a digest of all of them."""
+    if len(reminders) == 1:
+        r = reminders[0]
+        if r.kind == "requisition" and r.greeting == "HR":
+            subject = f"REMINDER: Part-time Lecturer Requisition Acknowledgement Required - {_describe(r)}"
+            action = "Please acknowledge it as soon as possible by clicking the link below:"
+        else:
+            subject = f"REMINDER: Part-time Lecturer {r.kind.title()} Approval Request - {_describe(r)}"
+            action = "Please review and take action using the link below:"
+        body = (
+            f"Dear {r.greeting},\n\n"
+            f"This {r.kind} request has been pending since {format_utc(r.pending_since)}.\n"
+            f"{action}\n"
+            f"{r.review_url}\n\n"
+        )
+        attachments = r.attachments
+    else:
+        greetings = {r.greeting for r in reminders}
+        greeting = greetings.pop() if len(greetings) == 1 else "Colleague"
+        subject = f"REMINDER: {len(reminders)} Part-time Lecturer Requests Awaiting Your Action"
+        lines = [
+            f"- {r.kind.title()}: {_describe(r)}, pending since {format_utc(r.pending_since)}\n  {r.review_url}"
+            for r in sorted(reminders, key=lambda r: (r.kind, r.pending_since or get_current_utc()))
+        ]
+        body = (
+            f"Dear {greeting},\n\n"
+            f"The following requests are still waiting for your review:\n\n"
+            + "\n".join(lines) + "\n\n"
+            "Please review and take action using the links above.\n\n"
+        )
+        # Each attachment once, up to the digest limit; the rest stay on the review pages
+        seen = {}
+        for r in reminders:
+            for att in r.attachments:
+                seen.setdefault(att["url"], att)
+        attachments = list(seen.values())[:app.config['REMINDER_DIGEST_MAX_ATTACHMENTS']]
+        if len(seen) > len(attachments):
+            body += f"{len(seen) - len(attachments)} more attachment(s) can be viewed from the review links.\n\n"
+
+    if attachments:
+        body += "Attachments are included for your reference.\n\n"
+    body += "Thank you,\nThe CourseXcel Team"
+    return subject, body, attachments
+
+def send_overdue_reminders(requisitions=True, claims=True):
+    """
+    Queue reminder emails for every overdue requisition and/or claim approval.
+    Returns a summary with counts and per-stage seconds.
+    """
+    timings = {}
+    started = time.perf_counter()
+    now = get_current_utc()
+    cutoff = to_utc_aware(now - timedelta(hours=app.config['REMINDER_AFTER_HOURS']))
+
+    # 1) Prefetch
+    stage = time.perf_counter()
+    contacts = _other_contacts()
+    sources = []
+    if requisitions:
+        approvals = _overdue(RequisitionApproval, cutoff)
+        attachments = _attachments_by_approval(RequisitionAttachment, "requisition_id", [a.approval_id for a in approvals])
+        sources.append(("requisition", RequisitionApproval, approvals, REQUISITION_STEPS, attachments))
+    if claims:
+        approvals = _overdue(ClaimApproval, cutoff)
+        attachments = _attachments_by_approval(ClaimAttachment, "claim_id", [a.approval_id for a in approvals])
+        sources.append(("claim", ClaimApproval, approvals, CLAIM_STEPS, attachments))
+    timings["prefetch"] = time.perf_counter() - stage
+
+    # 2) Group per recipient and build one email each
+    stage = time.perf_counter()
+    by_recipient = defaultdict(list)
+    skipped = 0
+    for kind, _, approvals, steps, attachments in sources:
+        grouped, kind_skipped = collect_reminders(kind, approvals, steps, attachments, contacts)
+        for recipient, reminders in grouped.items():
+            by_recipient[recipient].extend(reminders)
+        skipped += len(kind_skipped)
+
+    emails = []
+    reminded = defaultdict(set)
+    for recipient, reminders in by_recipient.items():
+        values = outbox_values(recipient, *build_reminder_email(reminders))
+        if values is None:
+            continue
+        emails.append(values)
+        for r in reminders:
+            reminded[r.kind].add(r.approval.approval_id)
+    timings["build"] = time.perf_counter() - stage
+
+    # 3) Queue the emails and stamp the reminders together
+    stage = time.perf_counter()
+    if emails:
+        db.session.execute(insert(EmailOutbox), emails)
+        for kind, model, *_ in sources:
+            if reminded[kind]:
+                db.session.execute(
+                    update(model)
+                    .where(model.approval_id.in_(sorted(reminded[kind])))
+                    .values(last_reminder_sent=now)
+                    .execution_options(synchronize_session=False)
+                )
+    db.session.commit()
+    timings["commit"] = time.perf_counter() - stage
+
+    summary = {
+        "overdue": {kind: len(approvals) for kind, _, approvals, _, _ in sources},
+        "reminded": {kind: len(ids) for kind, ids in reminded.items()},
+        "skipped": skipped,
+        "emails": len(emails),
+        "seconds": {name: round(value, 3) for name, value in timings.items()},
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(f"Overdue reminders: {summary}")
+    return summary
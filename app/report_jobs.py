@@ -0,0 +1,327 @@
+import hashlib, json, logging, os
+from app import app, db
+from app.excel_generator import REPORT_TEMPLATES, generate_report_excel, get_template_version
+from app.job_queue import finish_job, run_job_worker, set_job_stage
+from app.models import ClaimApproval, ClaimReport, Department, Lecturer, LecturerClaim, LecturerSubject, Rate, ReportJob, RequisitionApproval, RequisitionReport
+from app.shared_routes import get_current_utc
+from app.storage import upload_file
+from datetime import date
+from sqlalchemy import event, func, inspect
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Report Jobs (DB-backed queue)
+# ============================================================
+# reportConversionResult only records a report_job row and returns its id;
+# run_report_worker.py processes pick jobs up and run the query, render and
+# upload stages, committing progress after each so the result page can poll it.
+# While a job is Queued or Running its active_key ("type:start:end") is set,
+# and the unique index on it folds identical concurrent requests into one job.
+REPORT_MODELS = {"requisition": RequisitionReport, "claim": ClaimReport}
+
+# Progress reported when each stage starts
+STAGE_PROGRESS = {"queued": 0, "query": 10, "render": 40, "upload": 70, "done": 100}
+
+def _active_key(report_type, start_date, end_date):
+    return f"{report_type}:{start_date.isoformat()}:{end_date.isoformat()}"
+
+def enqueue_report_job(report_type, start_date, end_date, admin_id=None):
+    """
+    Queue a report for the given type and date range (YYYY-MM-DD strings).
+    Returns (job, created); created is False when an identical job is
+    already queued or running. Raises ValueError for invalid input.
+    """
+    if report_type not in REPORT_MODELS:
+        raise ValueError("Invalid report type.")
+    try:
+        start = date.fromisoformat(start_date or "")
+        end = date.fromisoformat(end_date or "")
+    except ValueError:
+        raise ValueError("Invalid date range.")
+    if end < start:
+        raise ValueError("End date must be on or after the start date.")
+
+    key = _active_key(report_type, start, end)
+    existing = ReportJob.query.filter_by(active_key=key).first()
+    if existing:
+        return existing, False
+
+    job = ReportJob(
+        report_type=report_type,
+        start_date=start,
+        end_date=end,
+        status="Queued",
+        stage="queued",
+        progress=STAGE_PROGRESS["queued"],
+        active_key=key,
+        requested_by=admin_id,
+        created_at=get_current_utc()
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued the same report between our check and insert
+        db.session.rollback()
+        existing = ReportJob.query.filter_by(active_key=key).first()
+        if existing is None:
+            raise
+        return existing, False
+
+    logger.info(f"Queued report job {job.job_id} ({key})")
+    return job, True
+
+def serialize_report_job(job):
+    """Status payload polled by reportConversionResultPage."""
+    return {
+        "job_id": job.job_id,
+        "report_type": job.report_type,
+        "start_date": job.start_date.isoformat() if job.start_date else None,
+        "end_date": job.end_date.isoformat() if job.end_date else None,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "message": job.message,
+        "file_url": job.file_url,
+        "done": job.status in ("Completed", "Failed"),
+    }
+
+# ============================================================
+#  Report Data
+# ============================================================
+def build_report_query(report_type, start_date, end_date):
+    """Aggregate query behind a report of the given type."""
+    if report_type == "requisition":
+        q = (
+            db.session.query(
+                Department.department_code.label("department_code"),
+                Lecturer.name.label("lecturer_name"),
+                func.count(LecturerSubject.subject_id).label("total_subjects"),
+                func.coalesce(func.sum(LecturerSubject.total_lecture_hours), 0).label("lecture_hours"),
+                func.coalesce(func.sum(LecturerSubject.total_tutorial_hours), 0).label("tutorial_hours"),
+                func.coalesce(func.sum(LecturerSubject.total_practical_hours), 0).label("practical_hours"),
+                func.coalesce(func.sum(LecturerSubject.total_blended_hours), 0).label("blended_hours"),
+                func.coalesce(func.max(Rate.amount), 0).label("rate"),
+                func.coalesce(func.sum(LecturerSubject.total_cost), 0).label("total_cost"),
+            )
+            .join(Lecturer, Lecturer.department_id == Department.department_id)
+            .join(LecturerSubject, LecturerSubject.lecturer_id == Lecturer.lecturer_id)
+            .join(RequisitionApproval, RequisitionApproval.approval_id == LecturerSubject.requisition_id)
+            .outerjoin(Rate, Rate.rate_id == LecturerSubject.rate_id)
+            .filter(LecturerSubject.start_date >= start_date)
+            .filter(LecturerSubject.end_date <= end_date)
+            .group_by(Department.department_code, Lecturer.name)
+            .order_by(Department.department_code.asc(), Lecturer.name.asc())
+        )
+        return q
+
+    if report_type == "claim":
+        q = (
+            db.session.query(
+                Department.department_code.label("department_code"),
+                Lecturer.name.label("lecturer_name"),
+                func.count(LecturerClaim.subject_id).label("total_subjects"),
+                func.coalesce(func.sum(LecturerClaim.lecture_hours), 0).label("lecture_hours"),
+                func.coalesce(func.sum(LecturerClaim.tutorial_hours), 0).label("tutorial_hours"),
+                func.coalesce(func.sum(LecturerClaim.practical_hours), 0).label("practical_hours"),
+                func.coalesce(func.sum(LecturerClaim.blended_hours), 0).label("blended_hours"),
+                func.coalesce(func.max(Rate.amount), 0).label("rate"),
+                func.coalesce(func.sum(LecturerClaim.total_cost), 0).label("total_cost"),
+            )
+            .join(Lecturer, LecturerClaim.lecturer_id == Lecturer.lecturer_id)
+            .join(Department, Lecturer.department_id == Department.department_id)
+            .join(ClaimApproval, ClaimApproval.approval_id == LecturerClaim.claim_id)
+            .outerjoin(Rate, Rate.rate_id == LecturerClaim.rate_id)
+            .filter(LecturerClaim.date >= start_date)
+            .filter(LecturerClaim.date <= end_date)
+            .group_by(Department.department_code, Lecturer.name)
+            .order_by(Department.department_code.asc(), func.coalesce(func.sum(LecturerClaim.total_cost), 0).desc())
+        )
+        return q
+
+    raise ValueError("Invalid report type.")
+
+def fetch_report_details(report_type, start_date, end_date):
+    """Rows handed to generate_report_excel, one per department × lecturer."""
+    q = build_report_query(report_type, start_date, end_date)
+    return [
+        {
+            "department_code": r.department_code or "",
+            "lecturer_name": r.lecturer_name or "",
+            "total_subjects": int(r.total_subjects or 0),
+            "total_lecture_hours": int(r.lecture_hours or 0),
+            "total_tutorial_hours": int(r.tutorial_hours or 0),
+            "total_practical_hours": int(r.practical_hours or 0),
+            "total_blended_hours": int(r.blended_hours or 0),
+            "rate": int(r.rate or 0),
+            "total_cost": int(r.total_cost or 0),
+        }
+        for r in q.all()
+    ]
+
+# ============================================================
+#  Report Cache (content-addressed)
+# ============================================================
+# A finished report row stores content_hash = sha256 of its inputs (type,
+# range, report_details rows, template file version). A job whose inputs hash
+# to the same value reuses that row's Drive file instead of rendering and
+# uploading again. Data changes alter the hash by themselves; status changes
+# on approvals in a report's range clear content_hash explicitly.
+REPORT_CACHE_SCHEMA = 1  # bump when the report layout code changes the output
+
+def report_cache_key(report_type, start_date, end_date, report_details):
+    payload = {
+        "schema": REPORT_CACHE_SCHEMA,
+        "report_type": report_type,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "template": get_template_version(REPORT_TEMPLATES[report_type]),
+        "rows": report_details,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def find_cached_report(report_type, start_date, end_date, content_hash):
+    report_model = REPORT_MODELS[report_type]
+    return (
+        report_model.query
+        .filter_by(start_date=start_date, end_date=end_date, content_hash=content_hash)
+        .filter(report_model.file_url.isnot(None))
+        .order_by(report_model.report_id.desc())
+        .first()
+    )
+
+def _changed_range(session, key_column, date_columns, ids):
+    """(earliest, latest) date of the rows belonging to the changed approvals."""
+    lo, hi = session.query(func.min(date_columns[0]), func.max(date_columns[1])).filter(key_column.in_(ids)).one()
+    return (lo, hi) if lo and hi else None
+
+def _invalidate_cached_reports(session, flush_context, instances):
+    """before_flush: clear cache keys of reports overlapping approvals whose status changes."""
+    changed = {"requisition": set(), "claim": set()}
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, RequisitionApproval):
+            kind = "requisition"
+        elif isinstance(obj, ClaimApproval):
+            kind = "claim"
+        else:
+            continue
+        if obj in session.deleted or inspect(obj).attrs.status.history.has_changes():
+            changed[kind].add(obj.approval_id)
+
+    if not changed["requisition"] and not changed["claim"]:
+        return
+
+    with session.no_autoflush:
+        ranges = []
+        if changed["requisition"]:
+            ranges.append((RequisitionReport, _changed_range(
+                session, LecturerSubject.requisition_id,
+                (LecturerSubject.start_date, LecturerSubject.end_date), changed["requisition"])))
+        if changed["claim"]:
+            ranges.append((ClaimReport, _changed_range(
+                session, LecturerClaim.claim_id,
+                (LecturerClaim.date, LecturerClaim.date), changed["claim"])))
+
+        for report_model, date_range in ranges:
+            if date_range is None:
+                continue
+            lo, hi = date_range
+            cleared = (
+                session.query(report_model)
+                .filter(
+                    report_model.content_hash.isnot(None),
+                    report_model.start_date <= hi,
+                    report_model.end_date >= lo
+                )
+                .update({report_model.content_hash: None}, synchronize_session=False)
+            )
+            if cleared:
+                logger.info(f"Invalidated {cleared} cached {report_model.__tablename__} row(s) for {lo} - {hi}")
+
+event.listen(Session, "before_flush", _invalidate_cached_reports)
+
+# ============================================================
+#  Worker
+# ============================================================
+def _set_stage(job, stage):
+    set_job_stage(job, stage, STAGE_PROGRESS[stage])
+
+def run_report_job(job):
+    """Query, render and upload one claimed job, recording each stage on the row."""
+    output_path = None
+    try:
+        _set_stage(job, "query")
+        report_details = fetch_report_details(job.report_type, job.start_date, job.end_date)
+        if not report_details:
+            finish_job(job, "Failed", "No matching data found for the selected date range.")
+            return
+
+        # Same inputs as an earlier report: hand back its Drive file
+        content_hash = report_cache_key(job.report_type, job.start_date, job.end_date, report_details)
+        cached = find_cached_report(job.report_type, job.start_date, job.end_date, content_hash)
+        if cached:
+            job.report_id = cached.report_id
+            job.file_url = cached.file_url
+            finish_job(job, "Completed")
+            logger.info(f"Report job {job.job_id} reused report {cached.report_id}: {cached.file_url}")
+            return
+
+        _set_stage(job, "render")
+        output_path = generate_report_excel(
+            report_type=job.report_type,
+            start_date=job.start_date.isoformat(),
+            end_date=job.end_date.isoformat(),
+            report_details=report_details
+        )
+
+        _set_stage(job, "upload")
+        file_name = os.path.basename(output_path)
+        file_url, file_id = upload_file(output_path, file_name)
+
+        new_report = REPORT_MODELS[job.report_type](
+            file_id=file_id,
+            file_name=file_name,
+            file_url=file_url,
+            start_date=job.start_date,
+            end_date=job.end_date,
+            content_hash=content_hash
+        )
+        db.session.add(new_report)
+        db.session.flush()
+
+        job.report_id = new_report.report_id
+        job.file_url = file_url
+        finish_job(job, "Completed")
+        logger.info(f"Report job {job.job_id} completed: {file_url}")
+
+    except OperationalError:
+        # Leave the job Running; it is requeued once its heartbeat goes stale
+        db.session.rollback()
+        raise
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Report job {job.job_id} failed: {e}")
+        finish_job(job, "Failed", str(e))
+
+    finally:
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+
+def run_report_worker(worker_id=None, poll_seconds=None, once=False):
+    """
+    Process report jobs until stopped. With once=True, drain the queue and return
+    the number of jobs processed. Must run inside an app context.
+    """
+    return run_job_worker(
+        ReportJob, run_report_job,
+        poll_seconds=poll_seconds or app.config['REPORT_JOB_POLL_SECONDS'],
+        stale_seconds=app.config['REPORT_JOB_STALE_SECONDS'],
+        max_attempts=app.config['REPORT_JOB_MAX_ATTEMPTS'],
+        interrupted_message="Report generation was interrupted. Please try again.",
+        worker_id=worker_id,
+        once=once
+    )
@@ -0,0 +1,402 @@
+import json, logging, threading, time
+from app import app, db
+from app.database import backoff_delay
+from app.email_outbox import SmtpSession, outbox_values, run_email_worker
+from app.job_queue import default_worker_id
+from app.models import Admin, EmailOutbox, ScheduledTask
+from app.reminders import send_overdue_reminders
+from app.shared_routes import get_current_utc, to_utc_aware
+from app.storage import get_storage
+from datetime import timedelta
+from flask import url_for
+from sqlalchemy import event, or_, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  In-process Scheduler
+# ============================================================
+# run_scheduler.py runs the periodic jobs below on the cron expressions in
+# SCHEDULER_JOBS (UTC). The process stays up, so the app import, the DB pool,
+# the Drive client and an SMTP connection are paid for once instead of on
+# every run. Each job has a scheduled_task row: an instance runs a job only
+# after moving its lease to itself with a conditional UPDATE (due, and not
+# leased or lease expired), so several instances never run the same job
+# twice. While the job runs a heartbeat thread renews the lease every
+# SCHEDULER_LEASE_RENEW_SECONDS, and every commit the job makes is fenced: it
+# first renews the lease in the same transaction and is rolled back with
+# LeaseLost if another instance has taken it over, so a job that stalled past
+# its lease cannot queue a second copy of the emails. The row also records the last run's duration, status and summary,
+# served by /api/scheduler_status.
+
+# ============================================================
+#  Cron Expressions
+# ============================================================
+def _parse_field(field, low, high):
+    """Values allowed by one cron field: *, a, a-b, with optional /step, comma-separated."""
+    values = set()
+    for part in field.split(","):
+        base, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start, end = (int(v) for v in base.split("-", 1))
+        else:
+            start = int(base)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field {field!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """Five-field cron expression: minute hour day-of-month month day-of-week (0 or 7 = Sunday)."""
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression {expression!r} needs 5 fields")
+        self.expression = expression
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12)
+        self.weekdays = {d % 7 for d in _parse_field(fields[4], 0, 7)}
+        # As in cron, a restricted day-of-month and day-of-week match either way
+        self.either_day = fields[2] != "*" and fields[4] != "*"
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = (dt.weekday() + 1) % 7 in self.weekdays
+        return (day or weekday) if self.either_day else (day and weekday)
+
+    def next_after(self, dt):
+        """First matching minute strictly after dt."""
+        t = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
+
+# ============================================================
+#  Job: Overdue Approval Reminders
+# ============================================================
+def job_overdue_reminders():
+    """Queue reminder digests for overdue requisitions and claims (see app.reminders)."""
+    return send_overdue_reminders()
+
+# ============================================================
+#  Job: Drive Quota Check & Admin Alerts
+# ============================================================
+QUOTA_ALERT_SUBJECT = "CourseXcel: Google Drive storage nearing capacity"
+
+def bytes_human(n: int) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB", "PB"]:
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} EB"
+
+def drive_quota_status_bg(threshold: float | None = None):
+    """
+    Background-safe quota status for the configured storage backend (no Flask
+    'session'). Returns dict with limited, percent, usage, limit, message and
+    over_threshold.
+    """
+    thr = threshold if threshold is not None else float(app.config.get("DRIVE_QUOTA_THRESHOLD", 0.85))
+    q = get_storage().quota()
+    usage, limit = q["usage"], q["limit"]
+
+    if not limit:
+        # Unlimited or unknown (Google sometimes reports 0)
+        return {
+            "limited": False,
+            "percent": None,
+            "usage": usage,
+            "limit": limit,
+            "message": "Drive storage appears unlimited (no limit reported).",
+            "over_threshold": False,
+        }
+
+    pct = usage / limit
+    return {
+        "limited": True,
+        "percent": pct,
+        "usage": usage,
+        "limit": limit,
+        "message": f"Using {bytes_human(usage)} of {bytes_human(limit)} ({pct*100:.1f}%).",
+        "over_threshold": pct >= thr,
+    }
+
+def _quota_alert_sent_within(hours):
+    """Whether an alert was queued in the last `hours`; the outbox is the shared record across instances."""
+    since = to_utc_aware(get_current_utc() - timedelta(hours=hours))
+    return db.session.query(EmailOutbox.outbox_id).filter(
+        EmailOutbox.subject == QUOTA_ALERT_SUBJECT,
+        EmailOutbox.created_at >= since,
+    ).first() is not None
+
+def email_admin_low_storage_bg(admin_email: str, quota: dict):
+    # SERVER_NAME is configured, so links can be built outside a request
+    report_url = url_for("adminReportPage", _external=True)
+    home_url = url_for("adminHomepage", _external=True)
+
+    body = (
+        "Dear Admin,\n\n"
+        f"Our Google Drive storage is nearing capacity. {quota.get('message','')}\n\n"
+        "Please take the following actions:\n"
+        f"• Generate reports: {report_url}\n"
+        f"• Export and clear completed approvals: {home_url}\n\n"
+        "Thank you,\n"
+        "The CourseXcel Team"
+    )
+    # Queued on the session, so the alert is committed with the job's run under its lease
+    values = outbox_values(admin_email, QUOTA_ALERT_SUBJECT, body)
+    if values is None:
+        return False
+    db.session.add(EmailOutbox(**values))
+    return True
+
+def job_drive_quota_alert():
+    """Checks Drive quota and emails all admins if over threshold, at most every DRIVE_QUOTA_ALERT_EVERY_HOURS."""
+    quota = drive_quota_status_bg()
+    alerted = 0
+    if quota["limited"] and quota["over_threshold"] and not _quota_alert_sent_within(app.config['DRIVE_QUOTA_ALERT_EVERY_HOURS']):
+        for admin in Admin.query.all():
+            if getattr(admin, "email", None) and email_admin_low_storage_bg(admin.email, quota):
+                alerted += 1
+    return {"percent": round(quota["percent"], 4) if quota["percent"] is not None else None, "over_threshold": quota["over_threshold"], "alerted": alerted}
+
+SCHEDULED_JOBS = {
+    "overdue_reminders": job_overdue_reminders,
+    "drive_quota_alert": job_drive_quota_alert,
+}
+
+# ============================================================
+#  Leases & Runs
+# ============================================================
+def load_schedules():
+    """{job name: CronSchedule} from SCHEDULER_JOBS; unknown names are rejected early."""
+    schedules = {}
+    for name, expression in app.config['SCHEDULER_JOBS'].items():
+        if name not in SCHEDULED_JOBS:
+            raise ValueError(f"SCHEDULER_JOBS names an unknown job: {name}")
+        schedules[name] = CronSchedule(expression)
+    return schedules
+
+def sync_tasks(schedules):
+    """Create rows for new jobs and reschedule the ones whose cron expression changed."""
+    now = get_current_utc()
+    existing = {task.name: task for task in ScheduledTask.query.filter(ScheduledTask.name.in_(list(schedules))).all()}
+    for name, cron in schedules.items():
+        task = existing.get(name)
+        if task is None:
+            db.session.add(ScheduledTask(name=name, schedule=cron.expression, next_run_at=cron.next_after(now)))
+        elif task.schedule != cron.expression:
+            task.schedule = cron.expression
+            task.next_run_at = cron.next_after(now)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # another instance created them first
+
+def acquire_lease(name, owner, force=False):
+    """Take the job's lease if it is due (or force) and nobody holds a live lease. Returns True if taken."""
+    now = get_current_utc()
+    conditions = [
+        ScheduledTask.name == name,
+        or_(ScheduledTask.lease_owner.is_(None), ScheduledTask.lease_expires_at < now),
+    ]
+    if not force:
+        conditions.append(ScheduledTask.next_run_at <= now)
+    result = db.session.execute(
+        update(ScheduledTask)
+        .where(*conditions)
+        .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=app.config['SCHEDULER_LEASE_SECONDS']))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+class LeaseLost(Exception):
+    """Another instance took over the job's lease; the job's uncommitted work is discarded."""
+
+def renew_lease(name, owner, conn):
+    """Push the lease expiry out again if `owner` still holds it, on `conn`. Returns True if it does."""
+    result = conn.execute(
+        update(ScheduledTask)
+        .where(ScheduledTask.name == name, ScheduledTask.lease_owner == owner)
+        .values(lease_expires_at=get_current_utc() + timedelta(seconds=app.config['SCHEDULER_LEASE_SECONDS']))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def _fence_job_commit(session):
+    """Refuse a running job's commit once its lease belongs to another instance."""
+    lease = session.info.get("scheduler_lease")
+    if lease and not renew_lease(*lease, session):
+        raise LeaseLost(f"Scheduled job {lease[0]} is no longer leased to {lease[1]}")
+
+event.listen(Session, "before_commit", _fence_job_commit)
+
+class LeaseHeartbeat(threading.Thread):
+    """Renews a job's lease on its own connection until stopped or the lease is lost."""
+
+    def __init__(self, name, owner):
+        super().__init__(name=f"lease-{name}", daemon=True)
+        self.task, self.owner = name, owner
+        self.lost = threading.Event()
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(app.config['SCHEDULER_LEASE_RENEW_SECONDS']):
+            try:
+                with app.app_context(), db.engine.begin() as conn:
+                    if renew_lease(self.task, self.owner, conn):
+                        continue
+                self.lost.set()
+                logger.warning(f"Scheduled job {self.task} lost its lease; its work will not be committed")
+                return
+            except Exception as e:
+                logger.warning(f"Could not renew the lease of scheduled job {self.task}: {e}")
+
+    def stop(self):
+        self._stopping.set()
+        self.join()
+
+def run_task(name, cron, owner, force=False):
+    """Run one job under its lease and record the outcome. Returns its summary, or None if not run."""
+    if not acquire_lease(name, owner, force):
+        return None
+
+    started_at = get_current_utc()
+    started = time.perf_counter()
+    status, error, result = "Succeeded", None, None
+    heartbeat = LeaseHeartbeat(name, owner)
+    heartbeat.start()
+    db.session.info["scheduler_lease"] = (name, owner)
+    try:
+        result = SCHEDULED_JOBS[name]()
+    except LeaseLost as e:
+        db.session.rollback()
+        logger.warning(f"{e}; stopped without committing")
+        return None
+    except OperationalError:
+        db.session.rollback()
+        raise  # lease expires and the job is retried; the caller backs off
+    except Exception as e:
+        db.session.rollback()
+        status, error = "Failed", f"{type(e).__name__}: {e}"[:255]
+        logger.exception(f"Scheduled job {name} failed")
+    finally:
+        db.session.info.pop("scheduler_lease", None)
+        heartbeat.stop()
+    duration_ms = int((time.perf_counter() - started) * 1000)
+
+    finished_at = get_current_utc()
+    recorded = db.session.execute(
+        update(ScheduledTask)
+        .where(ScheduledTask.name == name, ScheduledTask.lease_owner == owner)
+        .values(
+            lease_owner=None,
+            lease_expires_at=None,
+            next_run_at=cron.next_after(finished_at),
+            last_started_at=started_at,
+            last_finished_at=finished_at,
+            last_duration_ms=duration_ms,
+            last_status=status,
+            last_error=error,
+            last_result=json.dumps(result, default=str) if result is not None else None,
+            run_count=ScheduledTask.run_count + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if recorded.rowcount != 1:
+        # Taken over mid-run: drop whatever the job left uncommitted (e.g. queued emails)
+        db.session.rollback()
+        logger.warning(f"Scheduled job {name} is no longer leased to {owner}; its run was discarded")
+        return None
+    db.session.commit()
+    logger.info(f"Scheduled job {name} {status.lower()} in {duration_ms} ms: {result if error is None else error}")
+    return {"status": status, "duration_ms": duration_ms, "result": result, "error": error}
+
+def run_due_tasks(schedules, owner, smtp, force=False):
+    """Run every due job (all of them with force), then send what they queued over `smtp`."""
+    ran = {}
+    for name, cron in schedules.items():
+        summary = run_task(name, cron, owner, force)
+        if summary is not None:
+            ran[name] = summary
+    if ran and app.config['SCHEDULER_DRAIN_OUTBOX']:
+        run_email_worker(worker_id=owner, once=True, smtp=smtp)
+    return ran
+
+def serialize_scheduled_task(task):
+    """Status payload for /api/scheduler_status."""
+    now = get_current_utc()
+    lease_expires_at = to_utc_aware(task.lease_expires_at)
+    return {
+        "name": task.name,
+        "schedule": task.schedule,
+        "next_run_at": task.next_run_at.isoformat() if task.next_run_at else None,
+        "running": bool(task.lease_owner) and lease_expires_at is not None and lease_expires_at > now,
+        "lease_owner": task.lease_owner,
+        "last_started_at": task.last_started_at.isoformat() if task.last_started_at else None,
+        "last_finished_at": task.last_finished_at.isoformat() if task.last_finished_at else None,
+        "last_duration_ms": task.last_duration_ms,
+        "last_status": task.last_status,
+        "last_error": task.last_error,
+        "last_result": json.loads(task.last_result) if task.last_result else None,
+        "run_count": task.run_count,
+    }
+
+# ============================================================
+#  Scheduler Loop
+# ============================================================
+def run_scheduler(owner=None, poll_seconds=None, once=False):
+    """
+    Run jobs as they fall due until stopped. With once=True, run every job now
+    (still under its lease) and return {name: summary}. Must run inside an app context.
+    """
+    owner = owner or default_worker_id()
+    poll_seconds = poll_seconds or app.config['SCHEDULER_POLL_SECONDS']
+    schedules = load_schedules()
+    smtp = SmtpSession()
+    synced = False
+    failures = 0
+    logger.info(f"scheduler {owner} started: {', '.join(f'{n} [{c.expression}]' for n, c in schedules.items())}")
+
+    try:
+        while True:
+            try:
+                if not synced:
+                    sync_tasks(schedules)
+                    synced = True
+                ran = run_due_tasks(schedules, owner, smtp, force=once)
+                failures = 0
+            except OperationalError as e:
+                db.session.rollback()
+                failures += 1
+                delay = backoff_delay(failures - 1)
+                logger.warning(f"scheduler {owner} lost the database ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if once:
+                return ran
+            smtp.close_if_idle()
+            db.session.remove()
+            time.sleep(poll_seconds)
+    finally:
+        smtp.close()
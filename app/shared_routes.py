@@ -1,21 +1,22 @@
-import base64, io, logging, os, pyotp, pytz, qrcode, re, requests
-from app import app, db, mail
+import base64, io, logging, os, pyotp, pytz, qrcode
+from app import app, db
 from app.auth import login_user
-from app.database import handle_db_connection
-from app.models import Admin, Department, Head, Lecturer, LecturerSubject, LoginAttempt, Other, ProgramOfficer, Rate, RequisitionApproval, RequisitionAttachment, Subject 
-from datetime import datetime, timezone
+from app.claim_rollup import detach_department_buckets
+from app.database import defer_until_commit, handle_db_connection, unit_of_work_step
+from app.email_outbox import enqueue_email
+from app.models import Admin, ClaimApproval, ClaimAttachment, Department, Head, Lecturer, LecturerClaim, LecturerSubject, LoginAttempt, Other, ProgramOfficer, Rate, RequisitionApproval, RequisitionAttachment, Subject 
+from app.storage import XLSX_MIME, delete_file, get_storage, stored_file_backend
+from datetime import datetime, timedelta, timezone
 from flask import abort, flash, jsonify, redirect, render_template, render_template_string, request, send_file, session, url_for
 from flask_bcrypt import Bcrypt
-from flask_mail import Message
-from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 from io import BytesIO
 from itsdangerous import URLSafeTimedSerializer
 from openpyxl import load_workbook
 from openpyxl.drawing.image import Image as ExcelImage
 from PIL import Image
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 bcrypt = Bcrypt()
 logger = logging.getLogger(__name__)
@@ -247,8 +248,7 @@ def forgot_password():
     token = s.dumps(email, salt='reset-password')
     reset_url = url_for('reset_password', token=token, _external=True)
 
-    msg = Message(f'CourseXcel - Password Reset Request', recipients=[email])
-    msg.body = f'''Hi,
+    body = f'''Hi,
 
 We received a request to reset your password for your CourseXcel account.
 
@@ -260,7 +260,7 @@ If you did not request this, you can safely ignore this email.
 Thank you,
 The CourseXcel Team
 '''
-    mail.send(msg)
+    send_email(email, 'CourseXcel - Password Reset Request', body)
 
     return jsonify({'success': True, 'message': 'Reset link sent to your email.'})
 
@@ -361,102 +361,32 @@ def to_utc_aware(dt):
         return dt.replace(tzinfo=timezone.utc)
     return dt.astimezone(timezone.utc)
 
-def get_drive_service():
-    SERVICE_ACCOUNT_FILE = '/home/TomazHayden/coursexcel-459515-3d151d92b61f.json'
-    SCOPES = ['https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    return build('drive', 'v3', credentials=creds)
-
-# ============================================================
-#  Google Drive Operations
-# ============================================================
-def download_from_drive(file_id):
-    logger.info(f"Downloading file from Drive: {file_id}")
-    drive_service = get_drive_service()
-
-    request = drive_service.files().export_media(
-        fileId=file_id,
-        mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
-
-    output_folder = os.path.join(os.path.abspath(os.path.dirname(__file__)), "temp")
-    os.makedirs(output_folder, exist_ok=True)
-    local_path = os.path.join(output_folder, f"{file_id}.xlsx")
-
-    fh = io.FileIO(local_path, 'wb')
-    downloader = MediaIoBaseDownload(fh, request)
-
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-        logger.debug(f"Download progress: {int(status.progress() * 100)}%")
-
-    fh.close()
-    logger.info(f"File downloaded successfully: {local_path}")
-    return local_path
-
-def upload_to_drive(file_path, file_name):
-    logger.info(f"Uploading file to Drive: {file_name}")
-    try:
-        drive_service = get_drive_service()
-
-        file_metadata = {
-            'name': file_name,
-            'mimeType': 'application/vnd.google-apps.spreadsheet'  # Convert to Google Sheets
-        }
-
-        media = MediaFileUpload(
-            file_path,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            resumable=True
-        )
-
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id'
-        ).execute()
-
-        # Make file publicly accessible
-        drive_service.permissions().create(
-            fileId=file.get('id'),
-            body={'type': 'anyone', 'role': 'reader'},
-        ).execute()
-
-        file_id = file.get('id')
-        file_url = f"https://docs.google.com/spreadsheets/d/{file_id}/edit"
-        logger.info(f"File uploaded successfully. ID: {file_id}")
-
-        return file_url, file_id
-
-    except Exception as e:
-        logger.error(f"Failed to upload to Google Drive: {e}")
-        raise
-
 # ============================================================
 #  Signature Processing
 # ============================================================
-def save_signature_image(signature_data, approval_id, temp_folder):
+# The approval sheet is exported, stamped and uploaded entirely in memory,
+# so concurrent signers never share temp files.
+def decode_signature_image(signature_data):
+    """PNG bytes for a data-URL signature, or None if it cannot be decoded."""
     try:
         header, encoded = signature_data.split(",", 1)
-        binary_data = base64.b64decode(encoded)
-        image = Image.open(BytesIO(binary_data))
-        temp_image_path = os.path.join(temp_folder, f"signature_{approval_id}.png")
-        image.save(temp_image_path)
-        logger.debug(f"Signature image saved: {temp_image_path}")
-        return temp_image_path
+        image = Image.open(BytesIO(base64.b64decode(encoded)))
+        png = BytesIO()
+        image.save(png, format="PNG")
+        return png.getvalue()
     except Exception as e:
         logger.error(f"Signature decoding error: {e}")
         return None
 
-def insert_signature_and_date(local_excel_path, signature_path, cell_prefix, row, updated_path):
+def insert_signature_and_date(xlsx_bytes, signature_png, cell_prefix, row):
+    """Return xlsx_bytes with the signature at <cell_prefix><row> and today's date three rows below."""
     logger.info(f"Inserting signature and date at row {row}")
-    wb = load_workbook(local_excel_path)
+    wb = load_workbook(BytesIO(xlsx_bytes))
     ws = wb.active
 
     # Insert signature
     sign_cell = f"{cell_prefix}{row}"
-    signature_img = ExcelImage(signature_path)
+    signature_img = ExcelImage(BytesIO(signature_png))
     signature_img.width = 100
     signature_img.height = 30
     ws.add_image(signature_img, sign_cell)
@@ -466,91 +396,82 @@ def insert_signature_and_date(local_excel_path, signature_path, cell_prefix, row
     malaysia_time = datetime.now(pytz.timezone('Asia/Kuala_Lumpur'))
     ws[date_cell] = f"Date: {malaysia_time.strftime('%d/%m/%Y')}"
 
-    wb.save(updated_path)
-    logger.info(f"Signature and date inserted, file saved: {updated_path}")
+    output = BytesIO()
+    wb.save(output)
+    logger.info(f"Signature and date inserted ({output.tell()} bytes)")
+    return output.getvalue()
+
+def stamp_signature_and_upload(approval, signature_data, col_letter):
+    """
+    Stamp the signature onto the approval sheet. With APPROVAL_UPDATE_IN_PLACE the
+    stored file's content is replaced, so its id and URL (already sent in emails)
+    stay valid; otherwise it is uploaded as a new file.
+    Returns (url, id, old id, replaced bytes or None) so a failed request can undo it.
+    """
+    signature_png = decode_signature_image(signature_data)
+    if not signature_png:
+        raise ValueError("Invalid signature image data")
 
-def process_signature_and_upload(approval, signature_data, col_letter):
-    logger.info(f"Processing signature for approval ID: {approval.approval_id}")
-    temp_folder = os.path.join("temp")
-    os.makedirs(temp_folder, exist_ok=True)
+    storage = get_storage()
+    xlsx_bytes = storage.read_bytes(approval.file_id, XLSX_MIME)
+    stamped = insert_signature_and_date(xlsx_bytes, signature_png, col_letter, approval.sign_col)
 
-    temp_image_path = save_signature_image(signature_data, approval.approval_id, temp_folder)
-    if not temp_image_path:
-        raise ValueError("Invalid signature image data")
+    if app.config['APPROVAL_UPDATE_IN_PLACE']:
+        storage.replace_bytes(approval.file_id, stamped)
+        return approval.file_url, approval.file_id, approval.file_id, xlsx_bytes
 
-    local_excel_path = download_from_drive(approval.file_id)
-    updated_excel_path = os.path.join(temp_folder, approval.file_name)
+    new_file_url, new_file_id = storage.save_bytes(stamped, approval.file_name)
+    return new_file_url, new_file_id, approval.file_id, None
 
-    try:
-        insert_signature_and_date(local_excel_path, temp_image_path, col_letter, approval.sign_col, updated_excel_path)
-        new_file_url, new_file_id = upload_to_drive(updated_excel_path, approval.file_name)
+def _undo_signed_upload(uploaded):
+    """Compensation: delete a newly uploaded copy, or put back the content replaced in place."""
+    _, new_file_id, old_file_id, replaced_bytes = uploaded
+    if new_file_id and new_file_id != old_file_id:
+        delete_file(new_file_id)
+    elif replaced_bytes is not None:
+        get_storage().replace_bytes(new_file_id, replaced_bytes)
 
-        # Delete old file if needed
-        drive_service = get_drive_service()
-        if approval.file_id and approval.file_id != new_file_id:
-            try:
-                drive_service.files().delete(fileId=approval.file_id).execute()
-                logger.info(f"Deleted old Drive file: {approval.file_id}")
-            except Exception as e:
-                logger.warning(f"Failed to delete old file {approval.file_id}: {e}")
-                
-        # Update DB record
-        approval.file_url = new_file_url
-        approval.file_id = new_file_id
-        approval.last_updated = get_current_utc()
-        db.session.commit()
+def process_signature_and_upload(approval, signature_data, col_letter):
+    logger.info(f"Processing signature for approval ID: {approval.approval_id}")
 
-    finally:
-        # Clean up temp files safely even if an exception occurs
-        for path in [temp_image_path, local_excel_path, updated_excel_path]:
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-                    logger.debug(f"Temp file removed: {path}")
-            except Exception as e:
-                logger.warning(f"Failed to remove temp file {path}: {e}")
+    # Stamping and uploading run once per request; a DB retry reuses the uploaded file
+    # If the request fails, a newly uploaded copy is deleted and an in-place update is reverted
+    new_file_url, new_file_id, old_file_id, _ = unit_of_work_step(
+        f"signature:{approval.__tablename__}:{approval.approval_id}:{col_letter}",
+        stamp_signature_and_upload, approval, signature_data, col_letter,
+        compensate=_undo_signed_upload
+    )
+
+    # Update DB record; committed with the rest of the view's changes
+    approval.file_url = new_file_url
+    approval.file_id = new_file_id
+    approval.last_updated = get_current_utc()
+
+    # Delete old file only once the new file id is stored
+    if old_file_id and old_file_id != new_file_id:
+        defer_until_commit(delete_file, old_file_id)
 
 # ============================================================
 #  Email Utility
 # ============================================================
 def send_email(recipients, subject, body, attachments=None):
-    # attachments: list of dicts, each dict has keys: 'filename' and 'url'
-
+    """
+    Queue an email; run_email_worker.py delivers it (see app.email_outbox).
+    attachments: list of dicts, each dict has keys: 'filename' and 'url'.
+    """
     try:
-        # Ensure recipients is always a list
-        logger.info(f"Preparing to send email to: {recipients}")
-        if isinstance(recipients, str):
-            recipients = [recipients]
-
-        msg = Message(subject, recipients=recipients, body=body)
-
-        # Attach files if any
-        if attachments:
-            for att in attachments:
-                url = att.get('url')
-                filename = att.get('filename', 'attachment.pdf')
-                try:
-                    # Normalize Google Drive link to direct download
-                    m = re.search(r"/d/([a-zA-Z0-9_-]+)", url or "")
-                    if m:
-                        file_id = m.group(1)
-                        url = f"https://drive.google.com/uc?export=download&id={file_id}"
-
-                    logger.info(f"Fetching attachment: {filename} from {url}")
-                    resp = requests.get(url, allow_redirects=True, timeout=15)
-                    resp.raise_for_status()
-                    msg.attach(filename, "application/pdf", resp.content)
-                except Exception as e:
-                    logger.error(f"Failed to attach {filename} from {url}: {e}")
-
-        mail.send(msg)
-        logger.info("Email sent successfully.")
-        return True
-
+        return enqueue_email(recipients, subject, body, attachments)
     except Exception as e:
-        logger.error(f"Failed to send email: {e}")
+        logger.error(f"Failed to queue email: {e}")
         return False
 
+def send_void_email(recipients, subject, body):
+    """Send a void notification, logging when delivery fails."""
+    success = send_email(recipients, subject, body)
+    if not success:
+        logger.error(f"Failed to send void notification email to: {recipients}")
+    return success
+
 # ============================================================
 #  Approval Status Helpers
 # ============================================================
@@ -570,6 +491,53 @@ def is_already_reviewed(approval, expected_statuses):
         """)
     return None
 
+# ============================================================
+#  Remaining Hours Helpers
+# ============================================================
+def get_remaining_hours(assignments):
+    """
+    Remaining lecture/tutorial/practical/blended hours for a set of
+    LecturerSubject rows, keyed by (lecturer_id, requisition_id, subject_id).
+    Claimed hours come from completed claims for the same lecturer and
+    subject, summed in one grouped query for the whole set.
+    """
+    if not assignments:
+        return {}
+
+    lecturer_ids = {ls.lecturer_id for ls in assignments}
+    subject_ids = {ls.subject_id for ls in assignments}
+
+    claimed_rows = (
+        db.session.query(
+            LecturerClaim.lecturer_id,
+            LecturerClaim.subject_id,
+            func.coalesce(func.sum(LecturerClaim.lecture_hours), 0),
+            func.coalesce(func.sum(LecturerClaim.tutorial_hours), 0),
+            func.coalesce(func.sum(LecturerClaim.practical_hours), 0),
+            func.coalesce(func.sum(LecturerClaim.blended_hours), 0)
+        )
+        .join(ClaimApproval, LecturerClaim.claim_id == ClaimApproval.approval_id)
+        .filter(
+            LecturerClaim.lecturer_id.in_(lecturer_ids),
+            LecturerClaim.subject_id.in_(subject_ids),
+            ClaimApproval.status == 'Completed'
+        )
+        .group_by(LecturerClaim.lecturer_id, LecturerClaim.subject_id)
+        .all()
+    )
+    claimed = {(lid, sid): hours for lid, sid, *hours in claimed_rows}
+
+    remaining = {}
+    for ls in assignments:
+        lecture, tutorial, practical, blended = claimed.get((ls.lecturer_id, ls.subject_id), (0, 0, 0, 0))
+        remaining[(ls.lecturer_id, ls.requisition_id, ls.subject_id)] = {
+            'lecture_hours': ls.total_lecture_hours - lecture,
+            'tutorial_hours': ls.total_tutorial_hours - tutorial,
+            'practical_hours': ls.total_practical_hours - practical,
+            'blended_hours': ls.total_blended_hours - blended,
+        }
+    return remaining
+
 # ============================================================
 #  API Routes
 # ============================================================
@@ -866,6 +834,7 @@ def delete_record(table_type):
             Subject.query.filter(Subject.subject_id.in_(ids)).delete()
 
         elif table_type == 'departments':
+            detach_department_buckets(ids)
             Department.query.filter(Department.department_id.in_(ids)).delete()
     
         elif table_type == 'lecturers':
@@ -917,7 +886,163 @@ def get_heads():
     except Exception as e:
         logger.error(f"Error retrieving heads: {e}")
         return jsonify({'success': False, 'message': str(e)})
-    
+
+# Stored files (local/S3 backends); like a Drive share link, the URL is the credential
+@app.route('/files/<file_id>', defaults={'backend': None})
+@app.route('/files/<any(local, s3):backend>/<file_id>')
+def storage_file(file_id, backend):
+    # Links without a backend predate per-backend URLs; the file's row says where it lives
+    backend = backend or stored_file_backend(file_id)
+    if backend is None:
+        abort(404)
+    try:
+        return get_storage(backend).response(file_id)
+    except FileNotFoundError:
+        abort(404)
+
+# ============================================================
+#  Approvals Listing API (keyset pagination)
+# ============================================================
+APPROVALS_PAGE_SIZE = 50
+APPROVALS_MAX_PAGE_SIZE = 200
+
+APPROVAL_LISTINGS = {
+    # listing: (approval model, attachment model or None, attachment FK column name)
+    'requisitions': (RequisitionApproval, None, None),
+    'requisition_attachments': (RequisitionApproval, RequisitionAttachment, 'requisition_id'),
+    'claims': (ClaimApproval, None, None),
+    'claim_attachments': (ClaimApproval, ClaimAttachment, 'claim_id'),
+}
+
+def _parse_listing_date(value, end_of_day=False):
+    if not value:
+        return None
+    d = datetime.strptime(value, "%Y-%m-%d")
+    if end_of_day:
+        d = d.replace(hour=23, minute=59, second=59)
+    return d.replace(tzinfo=timezone.utc)
+
+def _serialize_approval(approval):
+    if isinstance(approval, RequisitionApproval):
+        requested_by = approval.program_officer.email if approval.program_officer else None
+    else:
+        requested_by = approval.lecturer.email if approval.lecturer else None
+
+    last_updated = to_utc_aware(approval.last_updated)
+    return {
+        'approval_id': approval.approval_id,
+        'requested_by': requested_by,
+        'department_code': approval.department.department_code if approval.department else None,
+        'file_name': approval.file_name,
+        'file_url': approval.file_url,
+        'status': approval.status,
+        'last_updated': approval.formatted_last_updated(),
+        # Same rule as /check_requisition_period: admin voiding closes after 30 days
+        'void_expired': bool(last_updated and datetime.now(timezone.utc) - last_updated > timedelta(days=30)),
+    }
+
+def _serialize_attachment(attachment, approval):
+    return {
+        'attachment_id': attachment.attachment_id,
+        'approval_id': approval.approval_id,
+        'attachment_name': attachment.attachment_name,
+        'attachment_url': attachment.attachment_url,
+        'lecturer': attachment.lecturer.name if attachment.lecturer else None,
+        'file_name': approval.file_name,
+        'file_url': approval.file_url,
+    }
+
+@app.route('/api/approvals/<listing>')
+@handle_db_connection
+def list_approvals(listing):
+    """
+    One page of an approvals listing, newest first.
+    Query params: limit, after (cursor from the previous page), status,
+    department_id, lecturer_id, date_from, date_to (YYYY-MM-DD), search.
+    Admins see every record; program officers only their own.
+    """
+    if listing not in APPROVAL_LISTINGS:
+        return jsonify({'error': 'Unknown listing.'}), 404
+    if 'admin_id' not in session and 'po_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    Approval, Attachment, fk_name = APPROVAL_LISTINGS[listing]
+
+    try:
+        limit = min(max(int(request.args.get('limit', APPROVALS_PAGE_SIZE)), 1), APPROVALS_MAX_PAGE_SIZE)
+        department_id = request.args.get('department_id', type=int)
+        lecturer_id = request.args.get('lecturer_id', type=int)
+        date_from = _parse_listing_date(request.args.get('date_from'))
+        date_to = _parse_listing_date(request.args.get('date_to'), end_of_day=True)
+        cursor = [int(part) for part in request.args.get('after', '').split(':') if part]
+    except ValueError:
+        return jsonify({'error': 'Invalid query parameters.'}), 400
+
+    status = (request.args.get('status') or '').strip()
+    search = (request.args.get('search') or '').strip()
+
+    if Attachment is None:
+        query = db.session.query(Approval).options(
+            joinedload(Approval.department),
+            joinedload(Approval.program_officer) if Approval is RequisitionApproval else joinedload(Approval.lecturer)
+        )
+    else:
+        fk = getattr(Attachment, fk_name)
+        query = (
+            db.session.query(Attachment, Approval)
+            .join(Approval, fk == Approval.approval_id)
+            .options(joinedload(Attachment.lecturer))
+        )
+
+    # Scope
+    if 'admin_id' not in session:
+        query = query.filter(Approval.po_id == session['po_id'])
+
+    # Filters
+    if status:
+        query = query.filter(Approval.status.ilike(f"%{status}%"))
+    if department_id:
+        query = query.filter(Approval.department_id == department_id)
+    if lecturer_id:
+        owner = Approval if Attachment is None else Attachment
+        query = query.filter(owner.lecturer_id == lecturer_id)
+    if date_from:
+        query = query.filter(Approval.last_updated >= date_from)
+    if date_to:
+        query = query.filter(Approval.last_updated <= date_to)
+    if search:
+        pattern = f"%{search}%"
+        if Attachment is None:
+            query = query.filter(Approval.file_name.ilike(pattern) | Approval.status.ilike(pattern))
+        else:
+            query = query.filter(Attachment.attachment_name.ilike(pattern) | Approval.file_name.ilike(pattern))
+
+    # Keyset: approvals by approval_id, attachments by (approval_id, attachment_id), newest first
+    if Attachment is None:
+        if cursor:
+            query = query.filter(Approval.approval_id < cursor[0])
+        query = query.order_by(Approval.approval_id.desc())
+    else:
+        if len(cursor) == 2:
+            query = query.filter(
+                (Approval.approval_id < cursor[0]) |
+                ((Approval.approval_id == cursor[0]) & (Attachment.attachment_id < cursor[1]))
+            )
+        query = query.order_by(Approval.approval_id.desc(), Attachment.attachment_id.desc())
+
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if Attachment is None:
+        items = [_serialize_approval(a) for a in rows]
+        next_cursor = str(rows[-1].approval_id) if rows and has_more else None
+    else:
+        items = [_serialize_attachment(att, a) for att, a in rows]
+        next_cursor = f"{rows[-1][1].approval_id}:{rows[-1][0].attachment_id}" if rows and has_more else None
+
+    return jsonify({'items': items, 'next': next_cursor, 'has_more': has_more})
+
 def delete_requisition_and_attachment(approval_id, suffix):
     # Fetch the approval record first
     approval = RequisitionApproval.query.get(approval_id)
@@ -930,15 +1055,13 @@ def delete_requisition_and_attachment(approval_id, suffix):
         name, ext = os.path.splitext(approval.file_name)
         new_file_name = f"{name}_{suffix}{ext}"
 
-        # Update Google Drive file name
+        # Update the stored file's name
         if approval.file_id:
             try:
-                drive_service = get_drive_service()
-                file_metadata = {"name": new_file_name}
-                drive_service.files().update(fileId=approval.file_id, body=file_metadata).execute()
-                logger.info(f"Renamed Google Drive file {approval.file_name} -> {new_file_name}")
+                get_storage().rename(approval.file_id, new_file_name)
+                logger.info(f"Renamed stored file {approval.file_name} -> {new_file_name}")
             except Exception as e:
-                logger.error(f"Failed to rename Google Drive file '{approval.file_name}': {e}")
+                logger.error(f"Failed to rename stored file '{approval.file_name}': {e}")
 
         # Update DB field
         approval.file_name = new_file_name
@@ -948,27 +1071,22 @@ def delete_requisition_and_attachment(approval_id, suffix):
 
     # Delete related attachments
     try:
-        drive_service = get_drive_service()
+        storage = get_storage()
         attachments_to_delete = RequisitionAttachment.query.filter_by(requisition_id=approval_id).all()
         for attachment in attachments_to_delete:
-            try:
-                # Extract file ID from Google Drive URL
-                match = re.search(r'/d/([a-zA-Z0-9_-]+)', attachment.attachment_url)
-                if not match:
-                    logger.warning(f"Invalid Google Drive URL format for attachment {attachment.attachment_name}")
-                    continue
-                drive_attachment_id = match.group(1)
-
-                # Delete file from Google Drive
-                drive_service.files().delete(fileId=drive_attachment_id).execute()
-
-                # Delete attachment record from database
+            # Extract file ID from the stored file URL
+            attachment_file_id = storage.file_id_from_url(attachment.attachment_url)
+            if not attachment_file_id:
+                logger.warning(f"Unrecognised file URL for attachment {attachment.attachment_name}")
+                continue
+
+            # Keep the record if the file could not be deleted
+            if storage.delete(attachment_file_id):
                 db.session.delete(attachment)
-
-            except Exception as e:
-                logger.error(f"Failed to delete Drive attachment '{attachment.attachment_name}': {e}")
+            else:
+                logger.error(f"Failed to delete stored attachment '{attachment.attachment_name}'")
     except Exception as e:
-        logger.error(f"Failed to initialize Drive service or delete attachments: {e}")
+        logger.error(f"Failed to initialize storage or delete attachments: {e}")
 
     # Commit DB changes
     db.session.commit()
@@ -48,46 +48,6 @@ function todayLocalISO() {
     return `${y}-${m}-${day}`; // e.g., 2025-08-26
 }
 
-// Table Filters (Department + Status)
-function initTableFilters(deptSelectorId, statusSelectorId) {
-    const departmentFilter = document.getElementById(deptSelectorId);
-    const statusFilter = document.getElementById(statusSelectorId);
-    if (!departmentFilter || !statusFilter) return;
-
-    const tableId = departmentFilter.dataset.tableId; // table ID is linked via data attribute
-    const rows = document.querySelectorAll(`#${tableId} tbody tr`);
-
-    // Mark all rows as searchable initially
-    rows.forEach(row => {
-        row.dataset.searchMatch = 'true';
-    });
-
-    function applyFilters() {
-        const selectedDept = departmentFilter.value.toLowerCase();
-        const selectedStatus = statusFilter.value.toLowerCase();
-
-        rows.forEach(row => {
-            // Row has data attributes for department and status
-            const dept = row.getAttribute("data-department")?.toLowerCase() || '';
-            const status = row.getAttribute("data-status")?.toLowerCase() || '';
-
-            // Match logic (blank filter = match all)
-            const matchDept = !selectedDept || dept === selectedDept;
-            const matchStatus = !selectedStatus || status.includes(selectedStatus);
-
-            // Show/hide rows
-            row.style.display = (matchDept && matchStatus) ? "" : "none";
-        });
-    }
-
-    // Attach listeners
-    departmentFilter.addEventListener("change", applyFilters);
-    statusFilter.addEventListener("change", applyFilters);
-
-    // Initial run to respect default selections
-    applyFilters();
-}
-
 // Course Structure Upload Form
 function setupCourseStructureForm() {
     const uploadCourseStructure = document.getElementById('uploadCourseStructure');
@@ -386,36 +386,6 @@ function initStatusFilterWithSearch(statusSelectorId, searchInputId) {
     applyFilters();
 }
 
-// Binds a lecturer dropdown and a search box to show/hide rows
-function initLecturerFilterWithSearch(lecturerSelectorId, searchInputId) {
-    const lecturerFilter = document.getElementById(lecturerSelectorId);
-    const searchInput = document.getElementById(searchInputId);
-    if (!lecturerFilter || !searchInput) return;
-
-    const tableId = lecturerFilter.dataset.tableId || searchInput.dataset.table;
-    const rows = document.querySelectorAll(`#${tableId} tbody tr`);
-
-    function applyFilters() {
-        const selectedLecturer = lecturerFilter.value.trim().toLowerCase();
-        const searchTerm = searchInput.value.trim().toLowerCase();
-
-        rows.forEach(row => {
-            const rowLecturer = row.getAttribute("data-lecturer")?.toLowerCase() || '';
-            const text = row.textContent.toLowerCase();
-
-            const matchLecturer = !selectedLecturer || rowLecturer === selectedLecturer;
-            const matchSearch = !searchTerm || text.includes(searchTerm);
-
-            row.style.display = (matchLecturer && matchSearch) ? "" : "none";
-        });
-    }
-
-    lecturerFilter.addEventListener('change', applyFilters);
-    searchInput.addEventListener('input', applyFilters);
-
-    applyFilters();
-}
-
 // Binds a lecturer dropdown and a status dropdown to show/hide rows
 function initLecturerStatusFilters(lecturerSelectorId, statusSelectorId) {
     const lecturerFilter = document.getElementById(lecturerSelectorId);
@@ -456,6 +426,103 @@ function initLecturerStatusFilters(lecturerSelectorId, statusSelectorId) {
     applyFilters();
 }
 
+// Escape text before putting it into row HTML
+function escapeHtml(value) {
+    return String(value ?? '')
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;')
+        .replace(/"/g, '&quot;')
+        .replace(/'/g, '&#39;');
+}
+
+// Loads a table page by page from /api/approvals/<listing> (keyset pagination).
+// filters maps query parameter names to element ids; renderRow(item, index) returns <tr> HTML.
+function initPagedTable({ tableId, listing, filters = {}, renderRow, pageSize = 50 }) {
+    const table = document.getElementById(tableId);
+    if (!table) return;
+
+    const tbody = table.querySelector('tbody');
+    const columns = table.querySelectorAll('thead th').length;
+    let cursor = null;
+    let loaded = 0;
+    let requestId = 0;
+
+    const loadMoreBtn = document.createElement('button');
+    loadMoreBtn.type = 'button';
+    loadMoreBtn.className = 'load-more';
+    loadMoreBtn.textContent = 'Load more';
+    loadMoreBtn.style.display = 'none';
+    (table.closest('.table-responsive') || table).after(loadMoreBtn);
+
+    function buildParams() {
+        const params = new URLSearchParams({ limit: pageSize });
+        Object.entries(filters).forEach(([name, elementId]) => {
+            const value = (document.getElementById(elementId)?.value || '').trim();
+            if (value) params.set(name, value);
+        });
+        if (cursor) params.set('after', cursor);
+        return params;
+    }
+
+    async function loadPage(reset) {
+        if (reset) {
+            cursor = null;
+            loaded = 0;
+        }
+        const thisRequest = ++requestId;
+        loadMoreBtn.disabled = true;
+
+        try {
+            const response = await fetch(`/api/approvals/${listing}?${buildParams()}`);
+            if (!response.ok) {
+                throw new Error(`Network response was not ok (status ${response.status})`);
+            }
+            const data = await response.json();
+
+            // Ignore responses for filters that have since changed
+            if (thisRequest !== requestId) return;
+
+            if (reset) tbody.innerHTML = '';
+            tbody.insertAdjacentHTML('beforeend', data.items.map(item => renderRow(item, ++loaded)).join(''));
+
+            if (!loaded) {
+                tbody.innerHTML = `<tr><td colspan="${columns}" style="text-align: center;">No records found.</td></tr>`;
+            }
+
+            cursor = data.next;
+            loadMoreBtn.style.display = data.has_more ? '' : 'none';
+        } catch (error) {
+            console.error(`[Approvals] Error loading ${listing}:`, error);
+            Swal.fire({
+                icon: 'error',
+                title: 'Error Loading Records',
+                text: 'An error occurred while loading the records. Please try again later.',
+                confirmButtonColor: '#d33'
+            });
+        } finally {
+            loadMoreBtn.disabled = false;
+        }
+    }
+
+    let searchTimer = null;
+    Object.values(filters).forEach(elementId => {
+        const el = document.getElementById(elementId);
+        if (!el) return;
+        if (el.tagName === 'INPUT' && el.type === 'text') {
+            el.addEventListener('input', () => {
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => loadPage(true), 300);
+            });
+        } else {
+            el.addEventListener('change', () => loadPage(true));
+        }
+    });
+    loadMoreBtn.addEventListener('click', () => loadPage(false));
+
+    loadPage(true);
+}
+
 // Handle select all checkbox
 document.querySelectorAll('.select-all').forEach(checkbox => {
     checkbox.addEventListener('change', function() {
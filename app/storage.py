@@ -0,0 +1,661 @@
+import hashlib, httplib2, json, logging, os, re, secrets, tempfile, threading
+from app import app, db
+from app.fake_drive import FakeDriveHttp
+from app.models import StoredBlob, StoredFile
+from datetime import datetime, timezone
+from flask import Response, request, send_file, url_for
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.oauth2.service_account import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload, MediaIoBaseUpload
+from io import BytesIO
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from urllib.parse import quote
+
+try:
+    import boto3  # only needed for STORAGE_BACKEND = "s3"
+except ImportError:
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+SHEETS_MIME = 'application/vnd.google-apps.spreadsheet'
+PDF_MIME = 'application/pdf'
+
+# ============================================================
+#  Google Drive Client
+# ============================================================
+# One service-account credential per worker process, shared by all threads,
+# so the access token is fetched once and refreshed in place when it expires.
+# httplib2 is not thread-safe, so each thread gets its own Drive service,
+# built once from the bundled discovery document (parsed once per process)
+# and reused along with its keep-alive HTTP connection.
+# DRIVE_BACKEND = "fake" swaps the transport for app.fake_drive (local files,
+# injectable latency and errors); no credentials are loaded in that mode.
+SERVICE_ACCOUNT_FILE = '/home/TomazHayden/coursexcel-459515-3d151d92b61f.json'
+DRIVE_SCOPES = ['https://www.googleapis.com/auth/drive']
+
+_drive_lock = threading.Lock()
+_drive_state = {'pid': None, 'credentials': None, 'discovery': None, 'generation': 0}
+_drive_local = threading.local()
+_drive_stats = {'credentials_loaded': 0, 'token_refreshes': 0, 'services_built': 0, 'service_reuses': 0}
+
+def _drive_credentials():
+    """Shared credentials with a valid token; loaded once per process, refreshed under the lock."""
+    with _drive_lock:
+        if _drive_state['pid'] != os.getpid():
+            # New process (e.g. forked gunicorn worker): never share tokens or sockets with the parent
+            _drive_state.update(pid=os.getpid(), credentials=None, generation=_drive_state['generation'] + 1)
+
+        if _drive_state['credentials'] is None and app.config['DRIVE_BACKEND'] != 'fake':
+            _drive_state['credentials'] = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=DRIVE_SCOPES)
+            _drive_stats['credentials_loaded'] += 1
+
+        if _drive_state['discovery'] is None:
+            _drive_state['discovery'] = json.loads(get_static_doc('drive', 'v3'))
+
+        creds = _drive_state['credentials']
+        if creds is not None and not creds.valid:
+            creds.refresh(GoogleAuthRequest())
+            _drive_stats['token_refreshes'] += 1
+
+        return creds, _drive_state['discovery'], _drive_state['generation']
+
+def get_drive_service():
+    """Drive v3 client for the calling thread, reused across calls."""
+    creds, discovery, generation = _drive_credentials()
+
+    service = getattr(_drive_local, 'service', None)
+    if service is not None and _drive_local.generation == generation:
+        with _drive_lock:
+            _drive_stats['service_reuses'] += 1
+        return service
+
+    if app.config['DRIVE_BACKEND'] == 'fake':
+        http = FakeDriveHttp.from_config(app.config)
+    else:
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=app.config['DRIVE_HTTP_TIMEOUT']))
+    service = build_from_document(discovery, http=http)
+    _drive_local.service = service
+    _drive_local.generation = generation
+    with _drive_lock:
+        _drive_stats['services_built'] += 1
+    return service
+
+def reset_drive_client(credentials=None):
+    """
+    Drop cached Drive clients in every thread (e.g. after rotating the key file).
+    Optional credentials replace the service-account file for this process.
+    """
+    with _drive_lock:
+        _drive_state.update(pid=os.getpid(), credentials=credentials, generation=_drive_state['generation'] + 1)
+
+def get_drive_client_stats():
+    with _drive_lock:
+        return dict(_drive_stats)
+
+
+# ============================================================
+#  File Storage
+# ============================================================
+# Approval workbooks, attachments and reports are kept in the backend named by
+# STORAGE_BACKEND and always addressed by the (file_url, file_id) pair stored
+# on the record:
+#   "drive" - Google Drive; workbooks become Google Sheets, files are shared by link
+#   "local" - content-addressed blobs under STORAGE_ROOT
+#   "s3"    - content-addressed blobs in an S3-compatible bucket (needs boto3)
+# Every backend offers the same methods: save_file / save_stream / save_bytes,
+# read_bytes / read_range, replace_bytes, describe (name, type and a content
+# version), rename, delete, delete_batch, file_id_from_url and quota. Files
+# already on Drive are copied across with run_storage_migration.py before
+# switching backends.
+
+def _now():
+    return datetime.now(timezone.utc)
+
+class DriveStorage:
+    """
+    Google Drive. Workbooks saved with save_file / save_bytes are converted to
+    Google Sheets and exported back to XLSX on read; streamed uploads
+    (attachments) are stored as they are.
+    """
+    name = "drive"
+
+    def file_id_from_url(self, url):
+        # Sheets url
+        m = re.search(r"docs\.google\.com/spreadsheets/d/([a-zA-Z0-9-_]+)", url or "")
+        if m: return m.group(1)
+        # Drive file url
+        m = re.search(r"drive\.google\.com/file/d/([a-zA-Z0-9-_]+)", url or "")
+        if m: return m.group(1)
+        # open?id=<ID>
+        m = re.search(r"[?&]id=([a-zA-Z0-9-_]+)", url or "")
+        if m: return m.group(1)
+        return None
+
+    def _create(self, media, file_name, convert):
+        """Create a Drive file (optionally as a Google Sheet) and make it publicly readable."""
+        logger.info(f"Uploading file to Drive: {file_name}")
+        try:
+            drive_service = get_drive_service()
+
+            file_metadata = {'name': file_name}
+            if convert:
+                file_metadata['mimeType'] = SHEETS_MIME  # Convert to Google Sheets
+
+            file = drive_service.files().create(
+                body=file_metadata,
+                media_body=media,
+                fields='id'
+            ).execute()
+
+            # Make file publicly accessible
+            drive_service.permissions().create(
+                fileId=file.get('id'),
+                body={'type': 'anyone', 'role': 'reader'},
+            ).execute()
+
+            file_id = file.get('id')
+            if convert:
+                file_url = f"https://docs.google.com/spreadsheets/d/{file_id}/edit"
+            else:
+                file_url = f"https://drive.google.com/file/d/{file_id}/view"
+            logger.info(f"File uploaded successfully. ID: {file_id}")
+
+            return file_url, file_id
+
+        except Exception as e:
+            logger.error(f"Failed to upload to Google Drive: {e}")
+            raise
+
+    def save_file(self, file_path, file_name, mime_type=XLSX_MIME):
+        # Small files go up in one multipart request; larger ones use a resumable session
+        resumable = os.path.getsize(file_path) > app.config['DRIVE_MULTIPART_MAX_BYTES']
+        media = MediaFileUpload(file_path, mimetype=mime_type, resumable=resumable)
+        return self._create(media, file_name, convert=mime_type == XLSX_MIME)
+
+    def save_stream(self, stream, file_name, mime_type):
+        # Sent in resumable chunks straight from the (seekable) stream, no temp copy
+        media = MediaIoBaseUpload(stream, mimetype=mime_type, chunksize=app.config['STORAGE_CHUNK_BYTES'], resumable=True)
+        return self._create(media, file_name, convert=False)
+
+    def save_bytes(self, data, file_name, mime_type=XLSX_MIME):
+        resumable = len(data) > app.config['DRIVE_MULTIPART_MAX_BYTES']
+        media = MediaIoBaseUpload(BytesIO(data), mimetype=mime_type, resumable=resumable)
+        return self._create(media, file_name, convert=mime_type == XLSX_MIME)
+
+    def replace_bytes(self, file_id, data, mime_type=XLSX_MIME):
+        """Replace a file's content, keeping its id, URL and sharing."""
+        logger.info(f"Updating Drive file in place: {file_id}")
+        resumable = len(data) > app.config['DRIVE_MULTIPART_MAX_BYTES']
+        get_drive_service().files().update(
+            fileId=file_id,
+            media_body=MediaIoBaseUpload(BytesIO(data), mimetype=mime_type, resumable=resumable),
+            fields='id'
+        ).execute()
+        logger.info(f"File updated successfully. ID: {file_id}")
+
+    def describe(self, file_id):
+        """
+        Name, download type and version; export_mime is set for Google-native
+        files (Sheets → XLSX, others → PDF). version changes whenever the content does.
+        """
+        meta = get_drive_service().files().get(fileId=file_id, fields="id, name, mimeType, modifiedTime, md5Checksum").execute()
+        mime_type = meta.get("mimeType", "")
+        if mime_type == SHEETS_MIME:
+            export_mime = XLSX_MIME
+        elif mime_type.startswith("application/vnd.google-apps."):
+            export_mime = PDF_MIME
+        else:
+            export_mime = None
+        version = f"{meta.get('modifiedTime', '')}/{meta.get('md5Checksum', '')}"
+        return {"name": meta.get("name"), "mime_type": export_mime or mime_type, "export_mime": export_mime, "version": version}
+
+    def read_bytes(self, file_id, export_mime=None):
+        """Download into memory; export_mime exports a Google-native file (e.g. XLSX for a Sheet)."""
+        svc = get_drive_service()
+        if export_mime:
+            request = svc.files().export_media(fileId=file_id, mimeType=export_mime)
+        else:
+            request = svc.files().get_media(fileId=file_id)
+
+        buffer = BytesIO()
+        downloader = MediaIoBaseDownload(buffer, request)
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+        return buffer.getvalue()
+
+    def read_range(self, file_id, start, end):
+        """Bytes start..end (inclusive) of a binary file."""
+        request = get_drive_service().files().get_media(fileId=file_id)
+        request.headers['Range'] = f"bytes={start}-{end}"
+        return request.execute()
+
+    def rename(self, file_id, file_name):
+        get_drive_service().files().update(fileId=file_id, body={"name": file_name}).execute()
+
+    def delete(self, file_id):
+        """Delete a file by id, logging (not raising) on failure."""
+        try:
+            get_drive_service().files().delete(fileId=file_id).execute()
+            logger.info(f"Deleted Drive file: {file_id}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to delete Drive file {file_id}: {e}")
+            return False
+
+    def delete_batch(self, file_ids):
+        """
+        Delete up to 100 files in one batch request. Returns {file_id: error or None};
+        files already gone report FileNotFoundError.
+        """
+        svc = get_drive_service()
+        errors = {}
+
+        def on_response(request_id, response, exception):
+            if isinstance(exception, HttpError) and getattr(exception.resp, "status", None) == 404:
+                exception = FileNotFoundError(request_id)
+            errors[request_id] = exception
+
+        batch = svc.new_batch_http_request(callback=on_response)
+        for file_id in file_ids:
+            batch.add(svc.files().delete(fileId=file_id), request_id=file_id)
+        batch.execute()
+        return errors
+
+    def quota(self):
+        about = get_drive_service().about().get(fields="storageQuota").execute()
+        q = (about or {}).get("storageQuota", {})
+        return {
+            "usage": int(q.get("usage") or 0),
+            "limit": int(q.get("limit") or 0),
+            "usage_in_drive": int(q.get("usageInDrive") or 0),
+            "usage_in_trash": int(q.get("usageInDriveTrash") or 0),
+        }
+
+# ============================================================
+#  Content-Addressed Storage (local disk / S3)
+# ============================================================
+# Bytes are kept once per SHA-256 in a blob store and files are rows in
+# stored_file pointing at a blob, so the same PDF attached to several
+# requests, or a workbook re-uploaded unchanged, costs its size only once.
+# stored_blob.ref_count is maintained on the engine's own connection (not the
+# request's session) under a row lock; a blob's bytes are deleted only after
+# the transaction dropping its last reference has committed. Uploads are hashed while being spooled to a temp file in
+# STORAGE_CHUNK_BYTES chunks, so request bodies are never held in memory.
+# Each backend keeps its own rows (stored_blob/stored_file.backend) and URLs,
+# so local and S3 can hold the same files side by side during a migration.
+# Files are served at /files/<backend>/<file_id> with Range support; like a
+# Drive share link, anyone with the URL can read the file.
+
+class LocalBlobStore:
+    """Blobs as files under root/<ab>/<cd>/<sha256>."""
+    def __init__(self, root):
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")  # same filesystem, so put() is a rename
+
+    def _path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def put(self, sha256, temp_path):
+        path = self._path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def read(self, sha256):
+        with open(self._path(sha256), "rb") as fh:
+            return fh.read()
+
+    def read_range(self, sha256, start, end):
+        with open(self._path(sha256), "rb") as fh:
+            fh.seek(start)
+            return fh.read(end - start + 1)
+
+    def delete(self, sha256):
+        try:
+            os.remove(self._path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def response(self, sha256, size, mime_type, file_name):
+        # send_file answers conditional and Range requests itself
+        return send_file(self._path(sha256), mimetype=mime_type, download_name=file_name,
+                         conditional=True, etag=sha256, max_age=0)
+
+class S3BlobStore:
+    """Blobs as objects <prefix><sha256> in an S3-compatible bucket (AWS S3, MinIO, R2, ...)."""
+    def __init__(self, bucket, prefix="", endpoint_url=None, region=None):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND 's3' requires the boto3 package")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND 's3' requires STORAGE_S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.temp_dir = tempfile.gettempdir()
+
+    def _key(self, sha256):
+        return f"{self.prefix}{sha256}"
+
+    def put(self, sha256, temp_path):
+        # upload_file streams from disk and switches to multipart for large files
+        self.client.upload_file(temp_path, self.bucket, self._key(sha256))
+
+    def read(self, sha256):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(sha256))["Body"].read()
+
+    def read_range(self, sha256, start, end):
+        obj = self.client.get_object(Bucket=self.bucket, Key=self._key(sha256), Range=f"bytes={start}-{end}")
+        return obj["Body"].read()
+
+    def delete(self, sha256):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(sha256))
+
+    def response(self, sha256, size, mime_type, file_name):
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f"inline; filename*=UTF-8''{quote(file_name)}",
+            "ETag": f'"{sha256}"',
+        }
+        byte_range = request.range
+        if byte_range and byte_range.units == "bytes" and len(byte_range.ranges) == 1:
+            span = byte_range.range_for_length(size)
+            if span is None:
+                return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+            start, stop = span
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            return Response(self.read_range(sha256, start, stop - 1), status=206, mimetype=mime_type, headers=headers)
+
+        body = self.client.get_object(Bucket=self.bucket, Key=self._key(sha256))["Body"]
+        headers["Content-Length"] = str(size)
+        return Response(body.iter_chunks(app.config['STORAGE_CHUNK_BYTES']), mimetype=mime_type, headers=headers)
+
+# /files/<backend>/<file_id>, or /files/<file_id> for links made before backends had their own URLs
+FILE_URL_RE = re.compile(r"/files/(?:(local|s3)/)?([A-Za-z0-9_-]+)")
+
+def stored_file_backend(file_id):
+    """Backend that owns a stored file id, or None."""
+    files = StoredFile.__table__
+    with app.app_context():
+        with db.engine.connect() as conn:
+            return conn.execute(select(files.c.backend).where(files.c.file_id == file_id)).scalar()
+
+class ContentAddressedStorage:
+    """stored_file / stored_blob index over a LocalBlobStore or S3BlobStore; rows are keyed by backend name."""
+    def __init__(self, name, blobs):
+        self.name = name
+        self.blobs = blobs
+
+    @property
+    def engine(self):
+        # Archive fetches and batch deletes call in from pool threads without an app context
+        with app.app_context():
+            return db.engine
+
+    def file_url(self, file_id):
+        with app.app_context():
+            return url_for('storage_file', backend=self.name, file_id=file_id, _external=True)
+
+    def file_id_from_url(self, url):
+        m = FILE_URL_RE.search(url or "")
+        if not m:
+            return None
+        backend, file_id = m.groups()
+        if backend is None:
+            # /files/<file_id> links predate per-backend URLs; the row says which backend owns them
+            backend = stored_file_backend(file_id)
+        return file_id if backend == self.name else None
+
+    def _file(self, file_id):
+        files = StoredFile.__table__
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(files).where(files.c.file_id == file_id, files.c.backend == self.name)
+            ).first()
+        if row is None:
+            raise FileNotFoundError(file_id)
+        return row
+
+    def _spool(self, stream):
+        """Copy a stream to a temp file chunk by chunk, hashing as it goes. Returns (sha256, size, temp path)."""
+        digest = hashlib.sha256()
+        size = 0
+        os.makedirs(self.blobs.temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.blobs.temp_dir)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                while True:
+                    chunk = stream.read(app.config['STORAGE_CHUNK_BYTES'])
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    fh.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            os.remove(temp_path)
+            raise
+        return digest.hexdigest(), size, temp_path
+
+    def _blob_key(self, sha256):
+        blobs = StoredBlob.__table__
+        return (blobs.c.backend == self.name) & (blobs.c.sha256 == sha256)
+
+    def _with_blob(self, sha256, size, temp_path, change):
+        """
+        Take a reference on the blob for spooled bytes and run change(conn, released)
+        in the same transaction. The bytes are only written to the blob store when
+        the content is new; blobs whose last reference `change` released are
+        deleted once the transaction has committed. Returns True if an existing
+        blob was reused.
+        """
+        blobs = StoredBlob.__table__
+        try:
+            for attempt in range(3):
+                released = []
+                stored = False
+                try:
+                    with self.engine.begin() as conn:
+                        row = conn.execute(select(blobs.c.ref_count).where(self._blob_key(sha256)).with_for_update()).first()
+                        if row is None:
+                            conn.execute(insert(blobs).values(backend=self.name, sha256=sha256, size=size, ref_count=1, created_at=_now()))
+                            self.blobs.put(sha256, temp_path)
+                            stored = True
+                        else:
+                            conn.execute(update(blobs).where(self._blob_key(sha256)).values(ref_count=blobs.c.ref_count + 1))
+                        change(conn, released)
+                except Exception as e:
+                    # The blob row was rolled back; don't leave its bytes behind
+                    if stored:
+                        self._purge([sha256])
+                    # A concurrent upload of the same content may have inserted the blob first
+                    if isinstance(e, IntegrityError) and attempt < 2:
+                        continue
+                    raise
+                self._purge(released)
+                return row is not None
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _release(self, conn, sha256, released):
+        """Drop one reference inside the caller's transaction; a blob losing its last one is added to `released`."""
+        blobs = StoredBlob.__table__
+        row = conn.execute(select(blobs.c.ref_count).where(self._blob_key(sha256)).with_for_update()).first()
+        if row is None:
+            return
+        if row.ref_count > 1:
+            conn.execute(update(blobs).where(self._blob_key(sha256)).values(ref_count=blobs.c.ref_count - 1))
+        else:
+            conn.execute(delete(blobs).where(self._blob_key(sha256)))
+            released.append(sha256)
+
+    def _purge(self, hashes):
+        """
+        Delete the bytes of blobs that have no stored_blob row, after the transaction
+        that dropped them has committed. Each row is re-checked under lock, so bytes
+        re-uploaded by a concurrent request in the meantime are kept.
+        """
+        for sha256 in hashes:
+            try:
+                with self.engine.begin() as conn:
+                    if conn.execute(select(StoredBlob.__table__.c.sha256).where(self._blob_key(sha256)).with_for_update()).first() is None:
+                        self.blobs.delete(sha256)
+            except Exception as e:
+                logger.warning(f"Could not delete unreferenced blob {self.name}:{sha256}: {e}")
+
+    def save_stream(self, stream, file_name, mime_type):
+        files = StoredFile.__table__
+        sha256, size, temp_path = self._spool(stream)
+        file_id = secrets.token_urlsafe(24)
+        now = _now()
+        reused = self._with_blob(sha256, size, temp_path, lambda conn, released: conn.execute(insert(files).values(
+            file_id=file_id, backend=self.name, name=file_name, mime_type=mime_type or "application/octet-stream",
+            sha256=sha256, size=size, created_at=now, updated_at=now
+        )))
+        logger.info(f"Stored {file_name} as {file_id} ({size} bytes{', deduplicated' if reused else ''})")
+        return self.file_url(file_id), file_id
+
+    def save_file(self, file_path, file_name, mime_type=XLSX_MIME):
+        with open(file_path, "rb") as fh:
+            return self.save_stream(fh, file_name, mime_type)
+
+    def save_bytes(self, data, file_name, mime_type=XLSX_MIME):
+        return self.save_stream(BytesIO(data), file_name, mime_type)
+
+    def replace_bytes(self, file_id, data, mime_type=XLSX_MIME):
+        """Point an existing file at new content, keeping its id and URL."""
+        files = StoredFile.__table__
+        sha256, size, temp_path = self._spool(BytesIO(data))
+        own_file = (files.c.file_id == file_id) & (files.c.backend == self.name)
+
+        def repoint(conn, released):
+            old = conn.execute(select(files.c.sha256).where(own_file).with_for_update()).first()
+            if old is None:
+                raise FileNotFoundError(file_id)
+            conn.execute(update(files).where(own_file).values(
+                sha256=sha256, size=size, mime_type=mime_type, updated_at=_now()
+            ))
+            self._release(conn, old.sha256, released)
+
+        self._with_blob(sha256, size, temp_path, repoint)
+        logger.info(f"File updated successfully. ID: {file_id}")
+
+    def describe(self, file_id):
+        row = self._file(file_id)
+        return {"name": row.name, "mime_type": row.mime_type, "export_mime": None, "version": row.sha256}
+
+    def read_bytes(self, file_id, export_mime=None):
+        """Stored bytes; export_mime is ignored (files are kept in their download format)."""
+        return self.blobs.read(self._file(file_id).sha256)
+
+    def read_range(self, file_id, start, end):
+        return self.blobs.read_range(self._file(file_id).sha256, start, end)
+
+    def response(self, file_id):
+        """Flask response serving the file, honouring Range requests."""
+        row = self._file(file_id)
+        return self.blobs.response(row.sha256, row.size, row.mime_type, row.name)
+
+    def rename(self, file_id, file_name):
+        files = StoredFile.__table__
+        with self.engine.begin() as conn:
+            conn.execute(update(files).where(files.c.file_id == file_id, files.c.backend == self.name)
+                         .values(name=file_name, updated_at=_now()))
+
+    def delete(self, file_id):
+        """Delete a file by id, logging (not raising) on failure."""
+        try:
+            errors = self.delete_batch([file_id])
+            if errors[file_id] is not None:
+                raise errors[file_id]
+            logger.info(f"Deleted stored file: {file_id}")
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to delete stored file {file_id}: {e}")
+            return False
+
+    def delete_batch(self, file_ids):
+        """
+        Delete files in one transaction; blob bytes go only after it commits.
+        Returns {file_id: None or FileNotFoundError}.
+        """
+        files = StoredFile.__table__
+        released = []
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(files.c.file_id, files.c.sha256)
+                .where(files.c.file_id.in_(list(file_ids)), files.c.backend == self.name)
+                .with_for_update()
+            ).all()
+            found = {row.file_id: row.sha256 for row in rows}
+            if found:
+                conn.execute(delete(files).where(files.c.file_id.in_(list(found))))
+            for sha256 in found.values():
+                self._release(conn, sha256, released)
+        self._purge(released)
+        return {file_id: None if file_id in found else FileNotFoundError(file_id) for file_id in file_ids}
+
+    def quota(self):
+        """Bytes held after deduplication; limit is STORAGE_QUOTA_BYTES (0 = unlimited)."""
+        blobs = StoredBlob.__table__
+        with self.engine.connect() as conn:
+            usage = int(conn.execute(select(func.coalesce(func.sum(blobs.c.size), 0)).where(blobs.c.backend == self.name)).scalar())
+        return {"usage": usage, "limit": app.config['STORAGE_QUOTA_BYTES'], "usage_in_drive": usage, "usage_in_trash": 0}
+
+# ============================================================
+#  Backend Selection & Helpers
+# ============================================================
+_storage_lock = threading.Lock()
+_storage = {}
+
+def get_storage(backend=None):
+    """The backend named by STORAGE_BACKEND (or `backend`), created once per process."""
+    backend = backend or app.config['STORAGE_BACKEND']
+    with _storage_lock:
+        if backend not in _storage:
+            if backend == "drive":
+                _storage[backend] = DriveStorage()
+            elif backend == "local":
+                _storage[backend] = ContentAddressedStorage("local", LocalBlobStore(app.config['STORAGE_ROOT']))
+            elif backend == "s3":
+                _storage[backend] = ContentAddressedStorage("s3", S3BlobStore(
+                    app.config['STORAGE_S3_BUCKET'], app.config['STORAGE_S3_PREFIX'],
+                    app.config['STORAGE_S3_ENDPOINT_URL'], app.config['STORAGE_S3_REGION']
+                ))
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+        return _storage[backend]
+
+def upload_file(file_path, file_name):
+    """Store a generated XLSX workbook. Returns (file_url, file_id)."""
+    return get_storage().save_file(file_path, file_name, XLSX_MIME)
+
+def delete_file(file_id):
+    """Delete a stored file by id, logging (not raising) on failure."""
+    return get_storage().delete(file_id)
+
+def upload_attachments(attachments):
+    """
+    Store request attachments (streamed, not copied to a temp file first).
+    Returns a list of (filename, file_url) tuples.
+    """
+    storage = get_storage()
+    attachment_urls = []
+    for attachment in attachments or []:
+        file_url, _ = storage.save_stream(attachment.stream, attachment.filename, attachment.mimetype)
+        attachment_urls.append((attachment.filename, file_url))
+    return attachment_urls
+
+def delete_uploaded_attachments(attachment_urls):
+    """Compensation for upload_attachments: remove the uploaded files again."""
+    storage = get_storage()
+    for filename, url in attachment_urls:
+        file_id = storage.file_id_from_url(url)
+        if file_id:
+            storage.delete(file_id)
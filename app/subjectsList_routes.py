@@ -1,9 +1,11 @@
+import numpy as np
 import pandas as pd
 import logging
 from app import app, db
 from app.database import handle_db_connection
 from app.models import Head, Subject
 from flask import jsonify, request
+from sqlalchemy import insert, update
 
 logger = logging.getLogger(__name__)
 
@@ -25,6 +27,20 @@ def convert_hours_weeks(value):
     except (ValueError, IndexError):
         return 0
 
+def convert_hours_weeks_column(column):
+    """convert_hours_weeks applied to a whole column at once (returns an int Series)"""
+    if not pd.api.types.is_numeric_dtype(column):
+        parts = column.astype(str).str.strip().str.lower().str.split('x')
+        # '2x1' style entries keep the hours; more than one 'x' is invalid, as in convert_hours_weeks
+        column = parts.str[0].str.strip().where(parts.str.len() <= 2)
+    values = pd.to_numeric(column, errors='coerce').astype(float)
+    values = values.replace([np.inf, -np.inf], np.nan).fillna(0)
+    return np.trunc(values).astype(int)
+
+def text_column(column):
+    """str(value).strip() for every cell, with empty cells as ''"""
+    return column.where(column.notna(), '').astype(str).str.strip()
+
 def determine_subject_level(sheet_name):
     """Determine subject level based on sheet name prefix"""
     sheet_name = sheet_name.strip().upper()   
@@ -42,6 +58,62 @@ def determine_subject_level(sheet_name):
 # ============================================================
 # Upload Subjects
 # ============================================================
+# Workbook header -> Subject column
+SUBJECT_TEXT_COLUMNS = {
+    'Subject Code': 'subject_code',
+    'Subject Title': 'subject_title',
+}
+SUBJECT_NUMBER_COLUMNS = {
+    'Lecture Hours': 'lecture_hours',
+    'Tutorial Hours': 'tutorial_hours',
+    'Practical Hours': 'practical_hours',
+    'Blended Hours': 'blended_hours',
+    'No of Lecture Weeks': 'lecture_weeks',
+    'No of Tutorial Weeks': 'tutorial_weeks',
+    'No of Practical Weeks': 'practical_weeks',
+    'No of Blended Weeks': 'blended_weeks',
+}
+EXPECTED_SUBJECT_COLUMNS = [*SUBJECT_TEXT_COLUMNS, *SUBJECT_NUMBER_COLUMNS, 'Head']
+SUBJECT_FIELDS = ['subject_code', 'subject_title', 'subject_level', *SUBJECT_NUMBER_COLUMNS.values(), 'head_id']
+
+def normalise_subject_sheet(df, subject_level):
+    """Subject columns for every row with a subject code, plus the head name and row number for errors"""
+    codes = text_column(df['Subject Code'])
+    df = df[codes != '']
+    frame = pd.DataFrame({
+        'subject_code': codes[codes != ''],
+        'subject_title': text_column(df['Subject Title']).str.title(),
+        'subject_level': subject_level,
+    })
+    for header, field in SUBJECT_NUMBER_COLUMNS.items():
+        frame[field] = convert_hours_weeks_column(df[header])
+    frame['head_name'] = text_column(df['Head'])
+    frame['row'] = df.index + 2
+    return frame
+
+def head_ids_by_name(names):
+    """{casefolded name: head_id} in one IN query; the lowest head_id wins, as .first() would return"""
+    heads = {}
+    if names:
+        rows = db.session.query(Head.head_id, Head.name).filter(Head.name.in_(names)).order_by(Head.head_id)
+        for head_id, name in rows:
+            heads.setdefault(name.casefold(), head_id)
+    return heads
+
+def subject_ids_by_code(codes):
+    """{casefolded code: subject_id} in one IN query; the lowest subject_id wins, as .first() would return"""
+    subjects = {}
+    if codes:
+        rows = db.session.query(Subject.subject_id, Subject.subject_code).filter(Subject.subject_code.in_(codes)).order_by(Subject.subject_id)
+        for subject_id, code in rows:
+            subjects.setdefault(code.casefold(), subject_id)
+    return subjects
+
+def subject_records(frame, fields):
+    """Rows as dicts of plain Python values (None for missing) for a bulk statement"""
+    frame = frame[fields].astype(object)
+    return frame.where(frame.notna(), None).to_dict('records')
+
 @app.route('/upload_subjects', methods=['POST'])
 @handle_db_connection
 def upload_subjects():
@@ -57,7 +129,7 @@ def upload_subjects():
             'success': False,
             'message': 'Invalid file format. Please upload an Excel (.xls or .xlsx) file.'
         })
-    
+
     try:
         excel_file = pd.ExcelFile(file)
         logger.info(f"File '{file.filename}' successfully read into memory.")
@@ -66,11 +138,10 @@ def upload_subjects():
             logger.warning("Uploaded Excel file contains no sheets.")
             return jsonify({'success': False, 'message': 'The uploaded Excel file contains no sheets.'})
 
-        errors = []
+        sheets = []  # (sheet_name, frame or None, errors) in workbook order
         sheets_processed = 0
-        subjects_to_add, subjects_to_update = [], []
 
-        # Process each sheet
+        # Read and normalise each sheet
         for sheet_name in excel_file.sheet_names:
             logger.info(f"Processing sheet: {sheet_name}")
             subject_level = determine_subject_level(sheet_name)
@@ -80,76 +151,38 @@ def upload_subjects():
                 df = pd.read_excel(excel_file, sheet_name=sheet_name, usecols="B:L", skiprows=1)
             except Exception as e:
                 msg = f"Sheet '{sheet_name}' does not have the required columns B to L."
-                errors.append(msg)
+                sheets.append((sheet_name, None, [msg]))
                 logger.warning(msg)
                 continue
 
             if df.empty:
                 logger.info(f"Sheet '{sheet_name}' is empty, skipping.")
                 continue
-            
-            expected_columns = [
-                'Subject Code', 'Subject Title',
-                'Lecture Hours', 'Tutorial Hours', 'Practical Hours', 'Blended Hours',
-                'No of Lecture Weeks', 'No of Tutorial Weeks',
-                'No of Practical Weeks', 'No of Blended Weeks', 'Head'
-            ]
-
-            if list(df.columns) != expected_columns:
-                msg = f"Incorrect headers in '{sheet_name}'. Expected: {expected_columns}, Found: {list(df.columns)}"
+
+            if list(df.columns) != EXPECTED_SUBJECT_COLUMNS:
+                msg = f"Incorrect headers in '{sheet_name}'. Expected: {EXPECTED_SUBJECT_COLUMNS}, Found: {list(df.columns)}"
                 logger.warning(f"{msg}")
-                errors.append(msg)
+                sheets.append((sheet_name, None, [msg]))
                 continue
 
-            df.columns = expected_columns
             sheets_processed += 1
+            sheets.append((sheet_name, normalise_subject_sheet(df, subject_level), []))
+
+        # Resolve every head named in the workbook at once
+        frames = [frame for _, frame, _ in sheets if frame is not None]
+        heads = head_ids_by_name(sorted({name for frame in frames for name in frame['head_name'] if name}))
 
-            for index, row in df.iterrows():
-                subject_code = str(row['Subject Code']).strip()
-                if pd.isna(subject_code) or not subject_code:
-                    continue  # skip empty subject code
-
-                head_name = str(row['Head']).strip()
-                head = Head.query.filter_by(name=head_name).first()
-                if not head and head_name:
-                    msg = f"Row {index + 2} in '{sheet_name}': Head '{head_name}' not found in system."
-                    errors.append(msg)
-                    logger.warning(f"{msg}")
-                    continue
-
-                existing_subject = Subject.query.filter_by(subject_code=subject_code).first()
-                if existing_subject:
-                    subjects_to_update.append({
-                        'instance': existing_subject,
-                        'data': {
-                            'subject_title': str(row['Subject Title']).strip().title(),
-                            'subject_level': subject_level,
-                            'lecture_hours': convert_hours_weeks(row['Lecture Hours']),
-                            'tutorial_hours': convert_hours_weeks(row['Tutorial Hours']),
-                            'practical_hours': convert_hours_weeks(row['Practical Hours']),
-                            'blended_hours': convert_hours_weeks(row['Blended Hours']),
-                            'lecture_weeks': convert_hours_weeks(row['No of Lecture Weeks']),
-                            'tutorial_weeks': convert_hours_weeks(row['No of Tutorial Weeks']),
-                            'practical_weeks': convert_hours_weeks(row['No of Practical Weeks']),
-                            'blended_weeks': convert_hours_weeks(row['No of Blended Weeks']),
-                            'head_id': head.head_id if head else None
-                        }
-                    })
-                else:
-                    subjects_to_add.append(Subject(
-                        subject_code=subject_code,
-                        subject_title=str(row['Subject Title']).strip().title(),
-                        subject_level=subject_level,
-                        lecture_hours=convert_hours_weeks(row['Lecture Hours']),
-                        tutorial_hours=convert_hours_weeks(row['Tutorial Hours']),
-                        practical_hours=convert_hours_weeks(row['Practical Hours']),
-                        blended_hours=convert_hours_weeks(row['Blended Hours']),
-                        lecture_weeks=convert_hours_weeks(row['No of Lecture Weeks']),
-                        tutorial_weeks=convert_hours_weeks(row['No of Tutorial Weeks']),
-                        practical_weeks=convert_hours_weeks(row['No of Practical Weeks']),
-                        blended_weeks=convert_hours_weeks(row['No of Blended Weeks']),
-                        head_id=head.head_id if head else None
-                    ))
+        for sheet_name, frame, sheet_errors in sheets:
+            if frame is None:
+                continue
+            frame['head_id'] = frame['head_name'].str.casefold().map(heads).astype('Int64')
+            missing = frame[(frame['head_name'] != '') & frame['head_id'].isna()]
+            for row, head_name in zip(missing['row'], missing['head_name']):
+                msg = f"Row {row} in '{sheet_name}': Head '{head_name}' not found in system."
+                sheet_errors.append(msg)
+                logger.warning(f"{msg}")
+
+        errors = [msg for _, _, sheet_errors in sheets for msg in sheet_errors]
 
         # Validation summary
         if sheets_processed == 0 and not errors:
@@ -164,15 +197,22 @@ def upload_subjects():
                 'errors': errors,
                 'message': 'Upload failed due to errors. No subjects were added or updated.'
             })
-        
-        # Database commit
+
+        # A code listed more than once is written once, from its last row
+        subjects = pd.concat(frames, ignore_index=True)
+        subjects['code_key'] = subjects['subject_code'].str.casefold()
+        subjects = subjects.drop_duplicates('code_key', keep='last')
+        existing = subject_ids_by_code(subjects['subject_code'].tolist())
+        subjects['subject_id'] = subjects['code_key'].map(existing).astype('Int64')
+        subjects_to_add = subjects[subjects['subject_id'].isna()]
+        subjects_to_update = subjects[subjects['subject_id'].notna()]
+
+        # Database commit: one bulk INSERT and one bulk UPDATE by primary key
         try:
-            for sub in subjects_to_add:
-                db.session.add(sub)
-            for update in subjects_to_update:
-                inst, data = update['instance'], update['data']
-                for key, val in data.items():
-                    setattr(inst, key, val)
+            if not subjects_to_add.empty:
+                db.session.execute(insert(Subject), subject_records(subjects_to_add, SUBJECT_FIELDS))
+            if not subjects_to_update.empty:
+                db.session.execute(update(Subject), subject_records(subjects_to_update, ['subject_id', *SUBJECT_FIELDS[1:]]))
             db.session.commit()
         except Exception as e:
             db.session.rollback()
@@ -180,7 +220,7 @@ def upload_subjects():
             return jsonify({'success': False, 'message': f"Database commit failed: {e}"})
 
         total_processed = len(subjects_to_add) + len(subjects_to_update)
-        logger.info(f"Successfully processed {total_processed} subject(s).")
+        logger.info(f"Successfully processed {total_processed} subject(s) ({len(subjects_to_add)} added, {len(subjects_to_update)} updated).")
         return jsonify({'success': True, 'message': f"Successfully processed {total_processed} subject(s)."})
 
     except Exception as e:
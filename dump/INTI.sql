@@ -206,6 +206,22 @@ CREATE TABLE `lecturer_claim` (
   CONSTRAINT `lecturer_claim_ibfk_5` FOREIGN KEY (`rate_id`) REFERENCES `rate` (`rate_id`) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
+CREATE TABLE `claim_monthly_total` (
+  `total_id` INT NOT NULL AUTO_INCREMENT,
+  `department_id` INT DEFAULT NULL,
+  `lecturer_id` INT NOT NULL,
+  `year` INT NOT NULL,
+  `month` INT NOT NULL,
+  `total_claims` INT DEFAULT 0,
+  `claim_rows` INT DEFAULT 0,
+  PRIMARY KEY (`total_id`),
+  UNIQUE KEY `uq_claim_monthly_total` (`department_id`, `lecturer_id`, `year`, `month`),
+  KEY `ix_claim_monthly_total_year_month` (`year`, `month`),
+  KEY `lecturer_id` (`lecturer_id`),
+  CONSTRAINT `claim_monthly_total_ibfk_1` FOREIGN KEY (`department_id`) REFERENCES `department` (`department_id`) ON DELETE CASCADE,
+  CONSTRAINT `claim_monthly_total_ibfk_2` FOREIGN KEY (`lecturer_id`) REFERENCES `lecturer` (`lecturer_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
 CREATE TABLE `claim_attachment` (
   `attachment_id` INT NOT NULL AUTO_INCREMENT,
   `attachment_name` VARCHAR(100) DEFAULT NULL,
@@ -226,7 +242,9 @@ CREATE TABLE `requisition_report` (
   `file_url` VARCHAR(500) DEFAULT NULL,
   `start_date` DATE DEFAULT NULL,
   `end_date` DATE DEFAULT NULL,
-  PRIMARY KEY (`report_id`)
+  `content_hash` VARCHAR(64) DEFAULT NULL,
+  PRIMARY KEY (`report_id`),
+  KEY `ix_requisition_report_content_hash` (`content_hash`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
 
 CREATE TABLE `claim_report` (
@@ -236,5 +254,117 @@ CREATE TABLE `claim_report` (
   `file_url` VARCHAR(500) DEFAULT NULL,
   `start_date` DATE DEFAULT NULL,
   `end_date` DATE DEFAULT NULL,
-  PRIMARY KEY (`report_id`)
+  `content_hash` VARCHAR(64) DEFAULT NULL,
+  PRIMARY KEY (`report_id`),
+  KEY `ix_claim_report_content_hash` (`content_hash`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `report_job` (
+  `job_id` INT NOT NULL AUTO_INCREMENT,
+  `report_type` VARCHAR(20) NOT NULL,
+  `start_date` DATE NOT NULL,
+  `end_date` DATE NOT NULL,
+  `status` VARCHAR(20) NOT NULL DEFAULT 'Queued',
+  `stage` VARCHAR(20) NOT NULL DEFAULT 'queued',
+  `progress` INT NOT NULL DEFAULT 0,
+  `message` VARCHAR(255) DEFAULT NULL,
+  `active_key` VARCHAR(60) DEFAULT NULL,
+  `report_id` INT DEFAULT NULL,
+  `file_url` VARCHAR(500) DEFAULT NULL,
+  `requested_by` INT DEFAULT NULL,
+  `worker` VARCHAR(100) DEFAULT NULL,
+  `attempts` INT NOT NULL DEFAULT 0,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  `started_at` DATETIME DEFAULT NULL,
+  `heartbeat_at` DATETIME DEFAULT NULL,
+  `finished_at` DATETIME DEFAULT NULL,
+  PRIMARY KEY (`job_id`),
+  UNIQUE KEY `active_key` (`active_key`),
+  KEY `ix_report_job_status` (`status`, `job_id`),
+  KEY `requested_by` (`requested_by`),
+  CONSTRAINT `report_job_ibfk_1` FOREIGN KEY (`requested_by`) REFERENCES `admin` (`admin_id`) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `archive_job` (
+  `job_id` INT NOT NULL AUTO_INCREMENT,
+  `status` VARCHAR(20) NOT NULL DEFAULT 'Queued',
+  `stage` VARCHAR(20) NOT NULL DEFAULT 'queued',
+  `progress` INT NOT NULL DEFAULT 0,
+  `message` VARCHAR(255) DEFAULT NULL,
+  `active_key` VARCHAR(60) DEFAULT NULL,
+  `total_files` INT NOT NULL DEFAULT 0,
+  `done_files` INT NOT NULL DEFAULT 0,
+  `archive_id` VARCHAR(32) DEFAULT NULL,
+  `archive_bytes` BIGINT DEFAULT NULL,
+  `download_name` VARCHAR(100) DEFAULT NULL,
+  `requisition_ids` TEXT,
+  `requested_by` INT DEFAULT NULL,
+  `worker` VARCHAR(100) DEFAULT NULL,
+  `attempts` INT NOT NULL DEFAULT 0,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  `started_at` DATETIME DEFAULT NULL,
+  `heartbeat_at` DATETIME DEFAULT NULL,
+  `finished_at` DATETIME DEFAULT NULL,
+  PRIMARY KEY (`job_id`),
+  UNIQUE KEY `active_key` (`active_key`),
+  KEY `ix_archive_job_status` (`status`, `job_id`),
+  KEY `requested_by` (`requested_by`),
+  CONSTRAINT `archive_job_ibfk_1` FOREIGN KEY (`requested_by`) REFERENCES `admin` (`admin_id`) ON DELETE SET NULL
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `stored_blob` (
+  `backend` VARCHAR(10) NOT NULL,
+  `sha256` CHAR(64) NOT NULL,
+  `size` BIGINT NOT NULL,
+  `ref_count` INT NOT NULL DEFAULT 0,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`backend`, `sha256`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `stored_file` (
+  `file_id` VARCHAR(64) NOT NULL,
+  `backend` VARCHAR(10) NOT NULL,
+  `name` VARCHAR(255) NOT NULL,
+  `mime_type` VARCHAR(100) NOT NULL,
+  `sha256` CHAR(64) NOT NULL,
+  `size` BIGINT NOT NULL,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`file_id`),
+  KEY `backend_sha256` (`backend`, `sha256`),
+  CONSTRAINT `stored_file_ibfk_1` FOREIGN KEY (`backend`, `sha256`) REFERENCES `stored_blob` (`backend`, `sha256`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `email_outbox` (
+  `outbox_id` INT NOT NULL AUTO_INCREMENT,
+  `recipients` TEXT NOT NULL,
+  `subject` VARCHAR(255) NOT NULL,
+  `body` TEXT NOT NULL,
+  `attachments` TEXT,
+  `status` VARCHAR(20) NOT NULL DEFAULT 'Queued',
+  `attempts` INT NOT NULL DEFAULT 0,
+  `last_error` VARCHAR(255) DEFAULT NULL,
+  `worker` VARCHAR(100) DEFAULT NULL,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  `next_attempt_at` DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `claimed_at` DATETIME DEFAULT NULL,
+  `sent_at` DATETIME DEFAULT NULL,
+  PRIMARY KEY (`outbox_id`),
+  KEY `ix_email_outbox_status` (`status`, `next_attempt_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+CREATE TABLE `scheduled_task` (
+  `name` VARCHAR(50) NOT NULL,
+  `schedule` VARCHAR(100) NOT NULL,
+  `next_run_at` DATETIME NOT NULL,
+  `lease_owner` VARCHAR(100) DEFAULT NULL,
+  `lease_expires_at` DATETIME DEFAULT NULL,
+  `last_started_at` DATETIME DEFAULT NULL,
+  `last_finished_at` DATETIME DEFAULT NULL,
+  `last_duration_ms` INT DEFAULT NULL,
+  `last_status` VARCHAR(20) DEFAULT NULL,
+  `last_error` VARCHAR(255) DEFAULT NULL,
+  `last_result` TEXT,
+  `run_count` INT NOT NULL DEFAULT 0,
+  PRIMARY KEY (`name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
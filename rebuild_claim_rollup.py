@@ -0,0 +1,21 @@
+from app import app
+from app.claim_rollup import rebuild_claim_rollup
+
+# ============================================================
+#  Rebuild claim_monthly_total from lecturer_claim
+# ============================================================
+# Usage: python rebuild_claim_rollup.py
+# Prints every bucket whose stored total differed from the source
+# before replacing the rollup with freshly computed values.
+if __name__ == "__main__":
+    with app.app_context():
+        buckets, mismatches = rebuild_claim_rollup()
+
+        for m in mismatches:
+            dept_id, lecturer_id, year, month = m["key"]
+            print(
+                f"dept={dept_id} lecturer={lecturer_id} {year}-{month:02d}: "
+                f"stored={m['stored']} source={m['source']}"
+            )
+
+        print(f"Rebuilt {buckets} buckets ({len(mismatches)} mismatches).")
@@ -0,0 +1,23 @@
+import argparse, logging
+from app import app
+from app.archive_jobs import run_archive_worker
+
+# ============================================================
+#  Archive Worker Entry Point
+# ============================================================
+# Builds queued approval/attachment archives (see app.archive_jobs) outside
+# the web request. Archives are written under app/temp/archives, so run the
+# worker on the same host (or shared disk) as the web app that serves them.
+#
+# Usage: python run_archive_worker.py [--once] [--poll SECONDS]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued archive jobs.")
+    parser.add_argument("--once", action="store_true", help="drain the queue and exit")
+    parser.add_argument("--poll", type=float, default=None, help="seconds to sleep when the queue is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    with app.app_context():
+        processed = run_archive_worker(poll_seconds=args.poll, once=args.once)
+        print(f"Processed {processed} archive job(s)")
@@ -0,0 +1,366 @@
+import argparse, base64, io, json, os, statistics, sys, time
+from app import app, db, storage
+from app.excel_generator import DEPARTMENT_SHEETS, clear_template_cache, generate_claim_excel, generate_report_excel, generate_requisition_excel
+from app.fake_drive import get_fake_drive_stats
+from app.models import Admin, ClaimApproval, Department, Head, Lecturer, Other, ProgramOfficer, Rate, RequisitionApproval, Subject
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2.service_account import Credentials
+from datetime import date, datetime, timedelta, timezone
+from googleapiclient.discovery import build
+from PIL import Image
+
+# ============================================================
+#  Timing helpers
+# ============================================================
+def _time_ms(fn, repeat, setup=None):
+    """Run fn `repeat` times and return the per-run latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 3),
+        "min_ms": round(ordered[0], 3),
+    }
+
+# ============================================================
+#  Benchmark: Excel template cache (cold vs warm generation)
+# ============================================================
+SAMPLE_COURSE = {
+    "subject_title": "Benchmark Subject", "subject_code": "BM101", "subject_level": "Degree",
+    "start_date": "2025-01-06", "end_date": "2025-04-11",
+    "lecture_hours": 2, "tutorial_hours": 1, "practical_hours": 0, "blended_hours": 0,
+    "lecture_weeks": 14, "tutorial_weeks": 14, "practical_weeks": 0, "blended_weeks": 0,
+    "hourly_rate": 100,
+}
+SAMPLE_CLAIM = {
+    "date": "2025-01-06", "subject_code": "BM101",
+    "lecture_hours": 2, "tutorial_hours": 1, "practical_hours": 0, "blended_hours": 0,
+    "remarks": "", "rate_id": None,
+}
+
+def _requisition_once():
+    path, _ = generate_requisition_excel("SOC", "Benchmark", "Lecturer", "000000-00-0000", "Degree",
+                                         [SAMPLE_COURSE] * 3, "PO", "HOP", "Dean", "AD", "HR")
+    os.remove(path)
+
+def _claim_once():
+    path, _ = generate_claim_excel("Benchmark", "SOC", "Degree", [SAMPLE_CLAIM] * 10, "PO", "HOP", "Dean", "HR")
+    os.remove(path)
+
+def bench_excel_templates(repeat=20):
+    """Requisition (3 courses) and claim (10 rows) generation with a cold vs warm template cache."""
+    results = {}
+    for name, fn in (("requisition", _requisition_once), ("claim", _claim_once)):
+        cold = _time_ms(fn, repeat, setup=clear_template_cache)
+        fn()  # prime the cache
+        warm = _time_ms(fn, repeat)
+        results[name] = {"cold": _summary(cold), "warm": _summary(warm)}
+    return results
+
+# ============================================================
+#  Benchmark: Report generation by number of detail rows
+# ============================================================
+def _report_details(rows):
+    return [
+        {
+            "department_code": DEPARTMENT_SHEETS[i * len(DEPARTMENT_SHEETS) // rows],
+            "lecturer_name": f"Lecturer {i}", "total_subjects": 2,
+            "total_lecture_hours": 28, "total_tutorial_hours": 14,
+            "total_practical_hours": 0, "total_blended_hours": 0,
+            "rate": 100, "total_cost": 4200,
+        }
+        for i in range(rows)
+    ]
+
+def bench_report_excel(repeat=5, sizes=(10, 200, 2000)):
+    """Claim report generation (Overall + department sheets) for growing numbers of detail rows."""
+    results = {}
+    for rows in sizes:
+        details = _report_details(rows)
+
+        def run():
+            os.remove(generate_report_excel("claim", "2025-01-01", "2025-06-30", details))
+
+        run()  # prime the template cache
+        results[f"{rows}_rows"] = _summary(_time_ms(run, repeat))
+    return results
+
+# ============================================================
+#  Benchmark: Drive client construction (per call vs cached)
+# ============================================================
+# No Drive requests are made; this measures the client overhead paid before
+# every API call. Without the service-account key file, anonymous credentials
+# stand in and the key parsing/token fetch of the old path is not counted.
+def bench_drive_client(repeat=200):
+    """Old get_drive_service() (credentials + discovery build per call) vs the cached client."""
+    key_file = storage.SERVICE_ACCOUNT_FILE
+    if os.path.exists(key_file):
+        load_credentials = lambda: Credentials.from_service_account_file(key_file, scopes=storage.DRIVE_SCOPES)
+    else:
+        load_credentials = AnonymousCredentials
+
+    per_call = _time_ms(lambda: build('drive', 'v3', credentials=load_credentials()), repeat)
+
+    storage.reset_drive_client(None if os.path.exists(key_file) else AnonymousCredentials())
+    storage.get_drive_service()  # first call builds the thread's client
+    cached = _time_ms(storage.get_drive_service, repeat)
+    storage.reset_drive_client()
+
+    return {
+        "credentials": "service account" if os.path.exists(key_file) else "anonymous",
+        "per_call_build": _summary(per_call),
+        "cached": _summary(cached),
+        "client_stats": storage.get_drive_client_stats(),
+    }
+
+# ============================================================
+#  Benchmark: End-to-end flows on the fake Drive
+# ============================================================
+# Drives the real routes through the Flask test client: requisition and claim
+# submission, both five-step approval chains, then Export & Clear (ZIP build
+# and cleanup of everything archivable). These write to the database and to
+# Drive, so they only run against a scratch database (COURSEXCEL_DATABASE_URI)
+# with COURSEXCEL_DRIVE_BACKEND=fake; set FAKE_DRIVE_* to model Drive latency
+# and failures. Outgoing mail is suppressed.
+FLOW_EMAIL_DOMAIN = "benchmark.invalid"
+
+REQUISITION_CHAIN = [
+    ("po", "/api/po_review_requisition/{}", None),
+    ("head", "/api/head_review_requisition/{}", "approve"),
+    ("dean", "/api/dean_review_requisition/{}", "approve"),
+    ("ad", "/api/ad_review_requisition/{}", "approve"),
+    ("hr", "/api/hr_review_requisition/{}", "confirm"),
+]
+CLAIM_CHAIN = [
+    ("lecturer", "/api/lecturer_review_claim/{}", None),
+    ("po", "/api/po_review_claim/{}", "approve"),
+    ("head", "/api/head_review_claim/{}", "approve"),
+    ("dean", "/api/dean_review_claim/{}", "approve"),
+    ("hr", "/api/hr_review_claim/{}", "approve"),
+]
+
+def _get_or_create(model, defaults=None, **key):
+    row = model.query.filter_by(**key).first()
+    if row is None:
+        row = model(**key, **(defaults or {}))
+        db.session.add(row)
+        db.session.flush()
+    return row
+
+def _seed_flow_fixtures():
+    """Department, people, subject and rate used by every flow run; reused across runs."""
+    email = lambda who: f"{who}@{FLOW_EMAIL_DOMAIN}"
+    department = _get_or_create(Department, {"department_name": "Benchmark Department", "dean_name": "Bench Dean",
+                                             "dean_email": email("dean")}, department_code="BENCH")
+    head = _get_or_create(Head, {"name": "Bench Head", "level": "Degree", "department_id": department.department_id}, email=email("head"))
+    po = _get_or_create(ProgramOfficer, {"name": "Bench PO", "department_id": department.department_id}, email=email("po"))
+    lecturer = _get_or_create(Lecturer, {"name": "Bench Lecturer", "level": "II", "department_id": department.department_id}, email=email("lecturer"))
+    subject = _get_or_create(Subject, {"subject_title": "Benchmark Subject", "subject_level": "Degree", "head_id": head.head_id,
+                                       "lecture_hours": 2, "lecture_weeks": 14}, subject_code="BENCH101")
+    for role in ("Academic Director", "Human Resources", "Head of Human Resources"):
+        _get_or_create(Other, {"name": f"Bench {role}", "role": role}, email=email(role.lower().replace(" ", ".")))
+    rate = _get_or_create(Rate, {"status": True}, amount=100)
+    admin = _get_or_create(Admin, email=email("admin"))
+    db.session.commit()
+    return {"department": department.department_code, "po_id": po.po_id, "lecturer_id": lecturer.lecturer_id,
+            "admin_id": admin.admin_id, "subject_id": subject.subject_id, "rate_id": rate.rate_id}
+
+def _signature_data_url():
+    buf = io.BytesIO()
+    Image.new("RGBA", (300, 100), (0, 0, 0, 255)).save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+def _flow_client(**session_values):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update(session_values)
+    return client
+
+def _requisition_form(fixtures):
+    # Taught a year ago so the finished requisition is old enough to archive
+    start = date.today() - timedelta(days=365)
+    return {
+        "department_code": fixtures["department"], "lecturer_id": fixtures["lecturer_id"],
+        "name": "Bench Lecturer", "designation": "Lecturer", "ic_number": "000000-00-0000",
+        "subjectCode1": "BENCH101", "subjectTitle1": "Benchmark Subject", "subjectLevel1": "Degree",
+        "lectureWeeks1": 14, "lectureHours1": 2, "hourlyRate1": 100,
+        "startDate1": start.isoformat(), "endDate1": (start + timedelta(weeks=14)).isoformat(),
+    }
+
+def _claim_form(fixtures, requisition_id):
+    # Claims every requisitioned hour (one row per subject) so the requisition becomes archivable
+    return {
+        "subject_level": "Degree", "date1": (date.today() - timedelta(days=300)).isoformat(),
+        "subjectIdHidden1": fixtures["subject_id"], "requisitionIdHidden1": requisition_id,
+        "rateIdHidden1": fixtures["rate_id"], "subjectCodeText1": "BENCH101",
+        "lectureHours1": 28, "remarks1": "",
+    }
+
+def _timed(fn):
+    """Run fn(); return (elapsed ms, Drive requests made, ok flag)."""
+    before = get_fake_drive_stats()["requests"]
+    start = time.perf_counter()
+    ok = fn()
+    return (time.perf_counter() - start) * 1000, get_fake_drive_stats()["requests"] - before, ok
+
+def _approved(response):
+    if response.is_json:
+        return response.status_code == 200 and response.get_json().get("success") is True
+    return response.status_code == 200
+
+def _run_chain(chain, approval_id, signature):
+    """Walk one record through every review step; returns [(step, ms, drive requests, ok)], stopping at a failure."""
+    steps = []
+    client = app.test_client()
+    for step, url, action in chain:
+        url = url.format(approval_id)
+        if action is None:
+            call = lambda: _approved(client.post(url, json={"image": signature}))
+        else:
+            call = lambda: _approved(client.post(url, data={"action": action, "signature_data": signature}))
+        ms, requests, ok = _timed(call)
+        steps.append((step, ms, requests, ok))
+        if not ok:
+            break
+    return steps
+
+def _flow_result(samples, drive_requests, failures):
+    result = {"failures": failures, "drive_requests_per_run": round(statistics.mean(drive_requests), 1) if drive_requests else 0}
+    if samples:
+        result.update(_summary(samples))
+    return result
+
+def _chain_result(chains):
+    completed = [steps for steps in chains if steps and all(ok for *_, ok in steps)]
+    result = _flow_result([sum(ms for _, ms, _, _ in steps) for steps in completed],
+                          [sum(r for _, _, r, _ in steps) for steps in completed],
+                          len(chains) - len(completed))
+    result["steps"] = {
+        step: _summary([ms for steps in completed for name, ms, _, _ in steps if name == step])
+        for step, *_ in (completed[0] if completed else [])
+    }
+    return result
+
+def bench_flows(runs=5):
+    """Submission, approval chain, ZIP export and cleanup latencies against the fake Drive."""
+    if not os.environ.get("COURSEXCEL_DATABASE_URI") or (app.config["STORAGE_BACKEND"] == "drive" and app.config["DRIVE_BACKEND"] != "fake"):
+        return {"skipped": "set COURSEXCEL_DATABASE_URI to a scratch database and COURSEXCEL_DRIVE_BACKEND=fake (or a local STORAGE_BACKEND)"}
+
+    mail_state = app.extensions["mail"]
+    suppress = mail_state.suppress
+    mail_state.suppress = True
+    try:
+        db.create_all()
+        fixtures = _seed_flow_fixtures()
+        signature = _signature_data_url()
+        po_client = _flow_client(po_id=fixtures["po_id"])
+        lecturer_client = _flow_client(lecturer_id=fixtures["lecturer_id"])
+        admin_client = _flow_client(admin_id=fixtures["admin_id"])
+        results = {"fake_drive": {key.lower(): app.config[key] for key in (
+            "FAKE_DRIVE_LATENCY", "FAKE_DRIVE_JITTER", "FAKE_DRIVE_BYTES_PER_SECOND", "FAKE_DRIVE_ERROR_RATE", "FAKE_DRIVE_SEED")}}
+
+        # Requisitions: submit, then approve each through PO, HOP, Dean / HOS, AD and HR
+        samples, drive_requests, requisition_ids = [], [], []
+        for _ in range(runs):
+            ms, requests, ok = _timed(lambda: _approved(po_client.post("/requisitionFormConversionResult", data=_requisition_form(fixtures))))
+            if ok:
+                samples.append(ms)
+                drive_requests.append(requests)
+                requisition_ids.append(RequisitionApproval.query.filter_by(po_id=fixtures["po_id"])
+                                       .order_by(RequisitionApproval.approval_id.desc()).first().approval_id)
+            db.session.remove()
+        results["requisition_submit"] = _flow_result(samples, drive_requests, runs - len(samples))
+        results["requisition_approval_chain"] = _chain_result([_run_chain(REQUISITION_CHAIN, rid, signature) for rid in requisition_ids])
+        db.session.remove()
+
+        # Claims: one per completed requisition, covering all of its hours
+        completed_ids = [rid for rid in requisition_ids if db.session.get(RequisitionApproval, rid).status == "Completed"]
+        samples, drive_requests, claim_ids = [], [], []
+        for rid in completed_ids:
+            ms, requests, ok = _timed(lambda: _approved(lecturer_client.post("/claimFormConversionResult", data=_claim_form(fixtures, rid))))
+            if ok:
+                samples.append(ms)
+                drive_requests.append(requests)
+                claim_ids.append(ClaimApproval.query.filter_by(lecturer_id=fixtures["lecturer_id"])
+                                 .order_by(ClaimApproval.approval_id.desc()).first().approval_id)
+            db.session.remove()
+        results["claim_submit"] = _flow_result(samples, drive_requests, len(completed_ids) - len(samples))
+        results["claim_approval_chain"] = _chain_result([_run_chain(CLAIM_CHAIN, cid, signature) for cid in claim_ids])
+        db.session.remove()
+
+        # Export & Clear: one pass over everything archivable in the scratch database
+        response = None
+        def export():
+            nonlocal response
+            response = admin_client.post("/api/download_files_zip")
+            return response.status_code == 200
+        ms, requests, ok = _timed(export)
+        results["zip_export"] = {"ms": round(ms, 3), "drive_requests": requests, "ok": ok,
+                                 "archive_bytes": len(response.data) if ok else 0}
+
+        cleanup = {}
+        def clear():
+            cleanup.update(admin_client.post("/api/cleanup_downloaded_files").get_json() or {})
+            return cleanup.get("success") is True and not cleanup.get("partial")
+        ms, requests, ok = _timed(clear)
+        results["cleanup"] = {"ms": round(ms, 3), "drive_requests": requests, "ok": ok,
+                              "requisitions": len(cleanup.get("deleted_requisition_ids", [])),
+                              "claims": len(cleanup.get("deleted_claim_ids", []))}
+        results["fake_drive_totals"] = get_fake_drive_stats()
+        return results
+    finally:
+        mail_state.suppress = suppress
+        db.session.remove()
+
+BENCHMARKS = {
+    "excel_templates": bench_excel_templates,
+    "report_excel": bench_report_excel,
+    "drive_client": bench_drive_client,
+    "flows": bench_flows,
+}
+
+# ============================================================
+#  Entry Point
+# ============================================================
+# Usage: python run_benchmarks.py [benchmark ...] [--json results.json]
+# The JSON file holds one run (timestamp plus results per benchmark) for trend tracking.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run CourseXcel benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON to PATH")
+    parser.add_argument("--drive-latency", type=float, help="fake Drive seconds per request (FAKE_DRIVE_LATENCY)")
+    parser.add_argument("--drive-error-rate", type=float, help="fake Drive failure fraction (FAKE_DRIVE_ERROR_RATE)")
+    parser.add_argument("--drive-seed", type=int, help="fake Drive random seed (FAKE_DRIVE_SEED)")
+    args = parser.parse_args()
+
+    for option, key in (("drive_latency", "FAKE_DRIVE_LATENCY"), ("drive_error_rate", "FAKE_DRIVE_ERROR_RATE"), ("drive_seed", "FAKE_DRIVE_SEED")):
+        if getattr(args, option) is not None:
+            app.config[key] = getattr(args, option)
+
+    selected = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown benchmark(s): {', '.join(unknown)}. Available: {', '.join(BENCHMARKS)}")
+
+    report = {"timestamp": datetime.now(timezone.utc).isoformat(), "drive_backend": app.config["DRIVE_BACKEND"], "storage_backend": app.config["STORAGE_BACKEND"], "results": {}}
+    with app.app_context():
+        for name in selected:
+            print(f"== {name} ==")
+            report["results"][name] = BENCHMARKS[name]()
+            for case, result in report["results"][name].items():
+                print(f"{case}: {result}")
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2, default=str)
+        print(f"Results written to {args.json}")
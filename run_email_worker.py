@@ -0,0 +1,24 @@
+import argparse, logging
+from app import app
+from app.email_outbox import run_email_worker
+
+# ============================================================
+#  Email Worker Entry Point
+# ============================================================
+# Delivers emails queued by send_email (see app.email_outbox) over one
+# long-lived SMTP connection. Run it as an always-on task; several workers
+# can share the outbox since rows are claimed with SELECT ... FOR UPDATE
+# SKIP LOCKED.
+#
+# Usage: python run_email_worker.py [--once] [--poll SECONDS]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deliver queued emails.")
+    parser.add_argument("--once", action="store_true", help="send the emails that are due and exit")
+    parser.add_argument("--poll", type=float, default=None, help="seconds to sleep when the outbox is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    with app.app_context():
+        sent = run_email_worker(poll_seconds=args.poll, once=args.once)
+        print(f"Sent {sent} email(s)")
@@ -0,0 +1,23 @@
+import argparse, logging
+from app import app
+from app.report_jobs import run_report_worker
+
+# ============================================================
+#  Report Worker Entry Point
+# ============================================================
+# Runs queued report jobs (see app.report_jobs). Start one process per
+# worker wanted, e.g. as an always-on task; jobs are claimed with
+# SELECT ... FOR UPDATE SKIP LOCKED so several workers can share the queue.
+#
+# Usage: python run_report_worker.py [--once] [--poll SECONDS]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process queued report jobs.")
+    parser.add_argument("--once", action="store_true", help="drain the queue and exit")
+    parser.add_argument("--poll", type=float, default=None, help="seconds to sleep when the queue is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    with app.app_context():
+        processed = run_report_worker(poll_seconds=args.poll, once=args.once)
+        print(f"Processed {processed} report job(s)")
@@ -0,0 +1,24 @@
+import argparse, json, logging
+from app import app
+from app.scheduler import run_scheduler
+
+# ============================================================
+#  Scheduler Entry Point
+# ============================================================
+# Runs the periodic jobs in app.scheduler (overdue reminders, Drive quota
+# alert) on the cron expressions in SCHEDULER_JOBS. Run it as an always-on
+# task; extra instances are safe since each job run is guarded by a lease
+# in scheduled_task. Last-run durations are served by /api/scheduler_status.
+#
+# Usage: python run_scheduler.py [--once] [--poll SECONDS]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run scheduled jobs.")
+    parser.add_argument("--once", action="store_true", help="run every job now and exit")
+    parser.add_argument("--poll", type=float, default=None, help="seconds between checks for due jobs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    with app.app_context():
+        ran = run_scheduler(poll_seconds=args.poll, once=args.once)
+        print(json.dumps(ran, indent=2, default=str))
@@ -0,0 +1,139 @@
+import argparse, logging
+from app import app, db
+from app.drive_archive import ArchiveMetrics, RateLimiter, storage_call
+from app.models import ClaimApproval, ClaimAttachment, ClaimReport, ReportJob, RequisitionApproval, RequisitionAttachment, RequisitionReport
+from app.storage import PDF_MIME, XLSX_MIME, get_storage
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import update
+
+logger = logging.getLogger(__name__)
+
+# ============================================================
+#  Storage Migration
+# ============================================================
+# Copies every file referenced by approvals, reports and attachments from one
+# storage backend to another (see app.storage) and repoints the records.
+# Files are fetched by a thread pool under the same rate limiter and retry
+# policy as archive downloads; records are rewritten in batches of
+# --batch-size, each in its own commit, so an interrupted run keeps its
+# progress. URLs the target already recognises are skipped, so the tool can be
+# re-run until nothing is left; local and S3 keep separate blob indexes and
+# serve /files/local/<id> and /files/s3/<id>, so either can be the source or
+# the target. Source files are left in place; delete them
+# once the migration has been checked.
+#
+# Usage: python run_storage_migration.py --to local [--from drive] [--workers N] [--batch-size N] [--dry-run]
+
+# (model, primary key, url column, id column or None, kind); workbooks are exported to XLSX
+SOURCES = [
+    (RequisitionApproval, "approval_id", "file_url", "file_id", "workbook"),
+    (ClaimApproval, "approval_id", "file_url", "file_id", "workbook"),
+    (RequisitionReport, "report_id", "file_url", "file_id", "workbook"),
+    (ClaimReport, "report_id", "file_url", "file_id", "workbook"),
+    (RequisitionAttachment, "attachment_id", "attachment_url", None, "attachment"),
+    (ClaimAttachment, "attachment_id", "attachment_url", None, "attachment"),
+]
+
+def collect_references(source, target):
+    """
+    Map each source file id to its kind and the (source entry, pk, url) rows
+    pointing at it. Rows already on the target are skipped.
+    """
+    references = {}
+    for entry in SOURCES:
+        model, pk, url_column, id_column, kind = entry
+        columns = [getattr(model, pk), getattr(model, url_column)]
+        if id_column:
+            columns.append(getattr(model, id_column))
+        for row in db.session.query(*columns).all():
+            url = row[1]
+            if not url or target.file_id_from_url(url):
+                continue
+            file_id = (row[2] if id_column else None) or source.file_id_from_url(url)
+            if not file_id:
+                logger.warning(f"Skipping {model.__tablename__} {row[0]}: unrecognised URL {url}")
+                continue
+            ref = references.setdefault(file_id, {"kind": kind, "rows": []})
+            ref["rows"].append((entry, row[0], url))
+    return references
+
+def copy_file(source, target, file_id, kind, limiter, metrics):
+    """Copy one file; returns (new_url, new_id). Runs on a pool thread."""
+    with app.app_context():
+        meta = storage_call(lambda: source.describe(file_id), limiter, metrics, "metadata", file_id)
+        export_mime = meta["export_mime"]
+        if kind == "workbook":
+            # Sheets are exported to XLSX; anything else is copied as it is
+            mime_type = XLSX_MIME if export_mime else meta["mime_type"]
+            export_mime = XLSX_MIME if export_mime else None
+        else:
+            mime_type = PDF_MIME if export_mime else meta["mime_type"]
+        data = storage_call(lambda: source.read_bytes(file_id, export_mime), limiter, metrics, "download", file_id)
+        metrics.add(bytes_fetched=len(data))
+        result = target.save_bytes(data, meta["name"] or file_id, mime_type)
+        metrics.add(files=1, bytes_written=len(data))
+        return result
+
+def repoint_rows(rows, new_url, new_id):
+    """Point every record that referenced the copied file at its new location."""
+    for (model, pk, url_column, id_column, _), key, old_url in rows:
+        values = {url_column: new_url}
+        if id_column:
+            values[id_column] = new_id
+        db.session.execute(update(model).where(getattr(model, pk) == key).values(**values))
+        db.session.execute(update(ReportJob).where(ReportJob.file_url == old_url).values(file_url=new_url))
+
+def migrate(source_name, target_name, workers=4, batch_size=100, dry_run=False):
+    source = get_storage(source_name)
+    target = get_storage(target_name)
+    references = collect_references(source, target)
+    rows = sum(len(ref["rows"]) for ref in references.values())
+    logger.info(f"{len(references)} file(s) referenced by {rows} record(s) to migrate from {source_name} to {target_name}")
+    if dry_run or not references:
+        return {"files": len(references), "records": rows, "copied": 0, "failed": 0}
+
+    rate = app.config['DRIVE_REQUESTS_PER_SECOND'] if source.name == "drive" else 0
+    limiter = RateLimiter(rate)
+    metrics = ArchiveMetrics()
+    file_ids = list(references)
+    copied = failed = 0
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="storage-migrate") as pool:
+        for start in range(0, len(file_ids), batch_size):
+            batch = file_ids[start:start + batch_size]
+            futures = {
+                file_id: pool.submit(copy_file, source, target, file_id, references[file_id]["kind"], limiter, metrics)
+                for file_id in batch
+            }
+            for file_id, future in futures.items():
+                try:
+                    new_url, new_id = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to copy {file_id}: {e}")
+                    failed += 1
+                    continue
+                repoint_rows(references[file_id]["rows"], new_url, new_id)
+                copied += 1
+            db.session.commit()
+            logger.info(f"Migrated {copied}/{len(file_ids)} file(s) ({failed} failed)")
+
+    summary = metrics.summary()
+    logger.info(f"Storage migration finished: {summary}")
+    return {"files": len(references), "records": rows, "copied": copied, "failed": failed, "metrics": summary}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy stored files to another storage backend and repoint the records.")
+    parser.add_argument("--from", dest="source", default="drive", choices=["drive", "local", "s3"], help="backend the files are on now")
+    parser.add_argument("--to", dest="target", required=True, choices=["drive", "local", "s3"], help="backend to copy them to")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent copy threads")
+    parser.add_argument("--batch-size", type=int, default=100, help="files copied per database commit")
+    parser.add_argument("--dry-run", action="store_true", help="only count the files that would be copied")
+    args = parser.parse_args()
+    if args.source == args.target:
+        parser.error("--from and --to must differ")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    with app.app_context():
+        result = migrate(args.source, args.target, args.workers, args.batch_size, args.dry_run)
+        print(f"Files: {result['files']}, records: {result['records']}, copied: {result['copied']}, failed: {result['failed']}")
@@ -0,0 +1,38 @@
+import os, tempfile
+from contextlib import contextmanager
+
+# Point the app at a throwaway SQLite database and local storage before it is imported
+_TMP = tempfile.mkdtemp(prefix="coursexcel-tests-")
+os.environ.setdefault("COURSEXCEL_DATABASE_URI", f"sqlite:///{os.path.join(_TMP, 'test.db')}")
+os.environ.setdefault("COURSEXCEL_STORAGE_BACKEND", "local")
+os.environ.setdefault("COURSEXCEL_STORAGE_ROOT", os.path.join(_TMP, "storage"))
+
+import pytest
+from app import app as flask_app, db
+from sqlalchemy import event
+
+@pytest.fixture
+def app():
+    """App context with freshly created tables; outgoing mail is suppressed."""
+    flask_app.config["TESTING"] = True
+    flask_app.extensions["mail"].suppress = True
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@contextmanager
+def count_statements():
+    """Collect every SQL statement sent to the database inside the block."""
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
@@ -0,0 +1,78 @@
+from datetime import date
+from app import db
+from app.models import (Admin, ClaimApproval, Department, Head, Lecturer, LecturerClaim, LecturerSubject,
+                        ProgramOfficer, Rate, RequisitionApproval, Subject)
+from conftest import count_statements
+
+# ============================================================
+#  Remaining-hours pages issue a fixed number of statements
+# ============================================================
+# adminApprovalsPage, poApprovalsPage and lecturerClaimsPage list every
+# completed assignment with its remaining hours (see get_remaining_hours).
+# The claimed hours must come from one grouped query, so the statement count
+# may not grow with the number of assignments.
+
+def seed_assignments(count):
+    """One completed requisition with `count` assignments, half of them partly claimed."""
+    department = Department(department_code="TEST", department_name="Test Department")
+    db.session.add(department)
+    db.session.flush()
+    head = Head(name="Test Head", email="head@test.invalid", level="Degree", department_id=department.department_id)
+    po = ProgramOfficer(name="Test PO", email="po@test.invalid", department_id=department.department_id)
+    lecturer = Lecturer(name="Test Lecturer", email="lecturer@test.invalid", level="II", department_id=department.department_id)
+    admin = Admin(email="admin@test.invalid")
+    rate = Rate(amount=100, status=True)
+    db.session.add_all([head, po, lecturer, admin, rate])
+    db.session.flush()
+
+    requisition = RequisitionApproval(department_id=department.department_id, lecturer_id=lecturer.lecturer_id, po_id=po.po_id,
+                                      head_id=head.head_id, subject_level="Degree", status="Completed")
+    claim = ClaimApproval(department_id=department.department_id, lecturer_id=lecturer.lecturer_id, po_id=po.po_id,
+                          head_id=head.head_id, subject_level="Degree", status="Completed")
+    db.session.add_all([requisition, claim])
+    db.session.flush()
+
+    for i in range(count):
+        subject = Subject(subject_code=f"SUB{i:04d}", subject_title=f"Subject {i}", subject_level="Degree", head_id=head.head_id)
+        db.session.add(subject)
+        db.session.flush()
+        db.session.add(LecturerSubject(lecturer_id=lecturer.lecturer_id, requisition_id=requisition.approval_id, subject_id=subject.subject_id,
+                                       start_date=date(2026, 1, 5), end_date=date(2026, 4, 10), total_lecture_hours=28,
+                                       total_tutorial_hours=14, rate_id=rate.rate_id, total_cost=4200))
+        if i % 2 == 0:
+            db.session.add(LecturerClaim(lecturer_id=lecturer.lecturer_id, requisition_id=requisition.approval_id, claim_id=claim.approval_id,
+                                         subject_id=subject.subject_id, date=date(2026, 2, 2), lecture_hours=2, tutorial_hours=1,
+                                         rate_id=rate.rate_id, total_cost=300))
+    db.session.commit()
+    return {"admin_id": admin.admin_id, "po_id": po.po_id, "lecturer_id": lecturer.lecturer_id}
+
+def page_statements(app, url, session_key, count):
+    """Statements issued to render `url` with `count` assignments in the database."""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    ids = seed_assignments(count)
+    db.session.remove()
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[session_key] = ids[session_key]
+    with count_statements() as statements:
+        response = client.get(url)
+    assert response.status_code == 200
+    return len(statements)
+
+def assert_constant(app, url, session_key, budget):
+    small = page_statements(app, url, session_key, 5)
+    large = page_statements(app, url, session_key, 50)
+    assert small == large
+    assert large <= budget
+
+def test_admin_approvals_page_statement_count(app):
+    assert_constant(app, "/adminApprovalsPage", "admin_id", budget=4)
+
+def test_po_approvals_page_statement_count(app):
+    assert_constant(app, "/poApprovalsPage", "po_id", budget=3)
+
+def test_lecturer_claims_page_statement_count(app):
+    assert_constant(app, "/lecturerClaimsPage", "lecturer_id", budget=4)
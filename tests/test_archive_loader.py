@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+from app import db
+from app.drive_archive import collect_archive_items, get_archivable_requisitions
+from app.models import (ClaimApproval, ClaimAttachment, Department, Lecturer, LecturerClaim, LecturerSubject,
+                        RequisitionApproval, RequisitionAttachment, Subject)
+from conftest import count_statements
+
+# ============================================================
+#  Archive / cleanup loader issues a fixed number of statements
+# ============================================================
+# Export & Clear loads every eligible requisition with its department,
+# attachments, completed claims and claim attachments. That must take the
+# same five statements (base query, requisition attachments, claim links,
+# claims, claim attachments) however many requisitions qualify.
+LOADER_STATEMENTS = 5
+
+def seed_archivable(count):
+    """`count` fully claimed, completed requisitions ended a year ago, each with attachments and one claim."""
+    department = Department(department_code="TEST", department_name="Test Department")
+    lecturer = Lecturer(name="Test Lecturer", email="lecturer@test.invalid", level="II")
+    subject = Subject(subject_code="SUB0001", subject_title="Subject", subject_level="Degree")
+    db.session.add_all([department, lecturer, subject])
+    db.session.flush()
+    ended = date.today() - timedelta(days=365)
+
+    for i in range(count):
+        requisition = RequisitionApproval(department_id=department.department_id, lecturer_id=lecturer.lecturer_id, status="Completed",
+                                          file_name=f"requisition_{i}.xlsx", file_url=f"https://example.invalid/r{i}")
+        claim = ClaimApproval(department_id=department.department_id, lecturer_id=lecturer.lecturer_id, status="Completed",
+                              file_name=f"claim_{i}.xlsx", file_url=f"https://example.invalid/c{i}")
+        db.session.add_all([requisition, claim])
+        db.session.flush()
+        db.session.add(LecturerSubject(lecturer_id=lecturer.lecturer_id, requisition_id=requisition.approval_id, subject_id=subject.subject_id,
+                                       start_date=ended - timedelta(days=90), end_date=ended, total_cost=1000))
+        db.session.add(LecturerClaim(lecturer_id=lecturer.lecturer_id, requisition_id=requisition.approval_id, claim_id=claim.approval_id,
+                                     subject_id=subject.subject_id, date=ended, total_cost=1000))
+        for n in range(2):
+            db.session.add(RequisitionAttachment(lecturer_id=lecturer.lecturer_id, requisition_id=requisition.approval_id,
+                                                 attachment_name=f"r{i}_{n}.pdf", attachment_url=f"https://example.invalid/ra{i}_{n}"))
+            db.session.add(ClaimAttachment(lecturer_id=lecturer.lecturer_id, claim_id=claim.approval_id,
+                                           attachment_name=f"c{i}_{n}.pdf", attachment_url=f"https://example.invalid/ca{i}_{n}"))
+    db.session.commit()
+    db.session.expunge_all()  # nothing may come from the identity map
+
+def load_archive(count):
+    """(statements issued, rows, items) for loading the archive with `count` eligible requisitions."""
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    seed_archivable(count)
+    today = date.today()
+    with count_statements() as statements:
+        rows = get_archivable_requisitions(today)
+        items = collect_archive_items(rows, today)
+    return len(statements), rows, items
+
+def test_archive_loader_statement_count_is_fixed(app):
+    for count in (3, 60):
+        statements, rows, items = load_archive(count)
+        assert len(rows) == count
+        assert all(len(claims) == 1 for _, claims in rows)
+        # requisition xlsx + 2 pdfs, claim xlsx + 2 pdfs
+        assert len(items) == count * 6
+        assert statements == LOADER_STATEMENTS
@@ -0,0 +1,71 @@
+from datetime import date
+from app import db
+from app.claim_rollup import add_claim_to_rollup, rebuild_claim_rollup, remove_claim_from_rollup
+from app.models import ClaimApproval, ClaimMonthlyTotal, Department, Lecturer, LecturerClaim, RequisitionApproval
+
+# ============================================================
+#  Claim rollup follows the lecturer's department
+# ============================================================
+# The dashboards file claims under the lecturer's current department (as
+# the baseline GROUP BY Lecturer.department_id did), so moving a lecturer
+# must move their buckets and a later void must still find them.
+
+def seed_completed_claims(months):
+    first = Department(department_code="ONE", department_name="First")
+    second = Department(department_code="TWO", department_name="Second")
+    db.session.add_all([first, second])
+    db.session.flush()
+    lecturer = Lecturer(name="Moving Lecturer", email="moving@test.invalid", level="II", department_id=first.department_id)
+    requisition = RequisitionApproval(status="Completed")
+    db.session.add_all([lecturer, requisition])
+    db.session.flush()
+
+    claims = []
+    for month in months:
+        claim = ClaimApproval(department_id=first.department_id, lecturer_id=lecturer.lecturer_id, status="Completed")
+        db.session.add(claim)
+        db.session.flush()
+        db.session.add_all([
+            LecturerClaim(lecturer_id=lecturer.lecturer_id, requisition_id=requisition.approval_id, claim_id=claim.approval_id,
+                          date=date(2026, month, day), total_cost=100 * day)
+            for day in (3, 17)
+        ])
+        db.session.flush()
+        add_claim_to_rollup(claim.approval_id)
+        claims.append(claim)
+    db.session.commit()
+    return lecturer, second, claims
+
+def void_claim(claim):
+    assert claim.status == "Completed"  # loaded first, as the void views do
+    claim.status = "Voided"
+    remove_claim_from_rollup(claim)
+    LecturerClaim.query.filter_by(claim_id=claim.approval_id).delete()
+    db.session.commit()
+
+def test_void_after_department_change_matches_rebuild(app):
+    lecturer, second, claims = seed_completed_claims([2, 3])
+
+    # As the lecturer bulk upload does
+    lecturer.department_id = second.department_id
+    db.session.commit()
+    assert {t.department_id for t in ClaimMonthlyTotal.query.all()} == {second.department_id}
+
+    void_claim(claims[0])
+
+    buckets = ClaimMonthlyTotal.query.all()
+    assert [(t.department_id, t.month, t.total_claims) for t in buckets] == [(second.department_id, 3, 2000)]
+    _, mismatches = rebuild_claim_rollup()
+    assert mismatches == []
+
+def test_department_change_through_update_record(app, client):
+    lecturer, second, claims = seed_completed_claims([4])
+
+    # The admin edit form posts every field as a string
+    response = client.put(f"/api/update_record/lecturers/{lecturer.lecturer_id}", data={"department_id": str(second.department_id)})
+    assert response.status_code == 200
+    db.session.expire_all()
+
+    void_claim(claims[0])
+    assert ClaimMonthlyTotal.query.count() == 0
+    assert rebuild_claim_rollup()[1] == []
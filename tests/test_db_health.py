@@ -0,0 +1,39 @@
+import logging
+import pytest
+from app import database, db
+from app.models import Admin
+
+# ============================================================
+#  Connection health counters are visible to operators
+# ============================================================
+def test_db_health_requires_an_admin(client):
+    assert client.get("/api/db_health").status_code == 401
+
+def test_db_health_reports_ping_counters(app, client):
+    db.session.add(Admin(email="admin@test.invalid"))
+    db.session.commit()
+    Admin.query.count()  # check out a pooled connection
+    with client.session_transaction() as session:
+        session["admin_id"] = 1
+
+    body = client.get("/api/db_health").get_json()
+
+    assert body["success"] and body["stale_seconds"] == app.config["DB_STALE_SECONDS"]
+    stats = body["stats"]
+    assert set(stats) == {"pings_performed", "pings_skipped", "ping_failures", "keepalive_runs", "keepalive_failures"}
+    assert stats["pings_performed"] + stats["pings_skipped"] > 0
+
+def test_keepalive_thread_logs_the_counters(app, monkeypatch, caplog):
+    monkeypatch.setitem(database._health_config, "log_seconds", 1e-9)
+    sleeps = []
+    def sleep(seconds):
+        if sleeps:
+            raise KeyboardInterrupt  # stop the loop after one round
+        sleeps.append(seconds)
+    monkeypatch.setattr(database.time, "sleep", sleep)
+
+    with caplog.at_level(logging.INFO, logger="app.database"), pytest.raises(KeyboardInterrupt):
+        database._keepalive_loop(db.engine, 120)
+
+    assert sleeps == [120]
+    assert any("Connection health" in r.message and "keepalive_runs" in r.message for r in caplog.records)
@@ -0,0 +1,46 @@
+import json
+from app import email_outbox
+from app.email_outbox import build_message, outbox_values
+from app.models import EmailOutbox
+from app.storage import get_storage
+
+# ============================================================
+#  Outbox attachments
+# ============================================================
+# Attachments on the configured backend are read from storage; Drive share
+# links left by rows written before a storage migration are downloaded from
+# Drive's direct download URL rather than the HTML viewer page.
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+def test_attachments_from_storage_and_leftover_drive_links(app, monkeypatch):
+    fetched = []
+    def fake_get(url, **kwargs):
+        fetched.append(url)
+        return FakeResponse(b"%PDF from " + url.encode())
+    monkeypatch.setattr(email_outbox.requests, "get", fake_get)
+
+    stored_url, _ = get_storage().save_bytes(b"%PDF stored", "stored.pdf", "application/pdf")
+    row = EmailOutbox(**outbox_values("someone@test.invalid", "Subject", "Body", [
+        {"filename": "stored.pdf", "url": stored_url},
+        {"filename": "drive.pdf", "url": "https://drive.google.com/file/d/AbC-123_x/view?usp=sharing"},
+        {"filename": "other.pdf", "url": "https://example.invalid/report.pdf"},
+    ]))
+
+    msg = build_message(row)
+
+    assert fetched == [
+        "https://drive.google.com/uc?export=download&id=AbC-123_x",
+        "https://example.invalid/report.pdf",
+    ]
+    assert [(a.filename, a.data) for a in msg.attachments] == [
+        ("stored.pdf", b"%PDF stored"),
+        ("drive.pdf", b"%PDF from https://drive.google.com/uc?export=download&id=AbC-123_x"),
+        ("other.pdf", b"%PDF from https://example.invalid/report.pdf"),
+    ]
+    assert json.loads(row.recipients) == ["someone@test.invalid"]
@@ -0,0 +1,81 @@
+import time
+from app import db, scheduler
+from app.email_outbox import outbox_values
+from app.models import EmailOutbox, ScheduledTask
+from app.scheduler import CronSchedule, run_task, sync_tasks
+from sqlalchemy import update
+
+# ============================================================
+#  Scheduler Leases
+# ============================================================
+CRON = CronSchedule("* * * * *")
+
+def queue_email():
+    db.session.add(EmailOutbox(**outbox_values("admin@example.com", "Digest", "body")))
+
+def take_over(name):
+    """Another instance takes the lease, on its own connection."""
+    with db.engine.begin() as conn:
+        conn.execute(update(ScheduledTask).where(ScheduledTask.name == name).values(lease_owner="other"))
+
+def test_lease_is_renewed_during_a_long_job(app, monkeypatch):
+    monkeypatch.setitem(app.config, "SCHEDULER_LEASE_RENEW_SECONDS", 0.05)
+    expiries = []
+
+    def slow_job():
+        for _ in range(2):
+            expiries.append(db.session.query(ScheduledTask.lease_expires_at).filter_by(name="slow").scalar())
+            db.session.rollback()
+            time.sleep(0.3)
+        return {"ok": True}
+
+    monkeypatch.setitem(scheduler.SCHEDULED_JOBS, "slow", slow_job)
+    sync_tasks({"slow": CRON})
+    summary = run_task("slow", CRON, "me", force=True)
+
+    assert summary["status"] == "Succeeded"
+    assert expiries[1] > expiries[0]
+    task = db.session.get(ScheduledTask, "slow")
+    assert task.lease_owner is None and task.run_count == 1
+
+def test_job_that_commits_after_losing_its_lease_is_rolled_back(app, monkeypatch):
+    def job():
+        take_over("reminders")
+        queue_email()
+        db.session.commit()
+
+    monkeypatch.setitem(scheduler.SCHEDULED_JOBS, "reminders", job)
+    sync_tasks({"reminders": CRON})
+
+    assert run_task("reminders", CRON, "me", force=True) is None
+    assert EmailOutbox.query.count() == 0
+    task = db.session.get(ScheduledTask, "reminders")
+    assert task.lease_owner == "other" and task.run_count == 0
+
+def test_uncommitted_work_is_dropped_when_the_lease_is_lost(app, monkeypatch):
+    def job():
+        queue_email()
+        take_over("alert")
+        return {"alerted": 1}
+
+    monkeypatch.setitem(scheduler.SCHEDULED_JOBS, "alert", job)
+    sync_tasks({"alert": CRON})
+
+    assert run_task("alert", CRON, "me", force=True) is None
+    assert EmailOutbox.query.count() == 0
+
+def test_job_commits_while_it_holds_the_lease(app, monkeypatch):
+    def job():
+        queue_email()
+        db.session.commit()
+        return {"sent": 1}
+
+    monkeypatch.setitem(scheduler.SCHEDULED_JOBS, "digest", job)
+    sync_tasks({"digest": CRON})
+
+    assert run_task("digest", CRON, "me", force=True)["status"] == "Succeeded"
+    assert EmailOutbox.query.count() == 1
+    # The fence is only armed while a job runs
+    queue_email()
+    db.session.commit()
+    assert EmailOutbox.query.count() == 2
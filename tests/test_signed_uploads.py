@@ -0,0 +1,69 @@
+import base64
+from io import BytesIO
+import pytest
+from app import db, lecturer_routes
+from app.models import ClaimApproval, StoredFile
+from app.storage import get_storage
+from openpyxl import Workbook
+from PIL import Image
+
+# ============================================================
+#  Signature stamping is undone with the review step
+# ============================================================
+# A review step stamps the reviewer's signature onto the approval sheet
+# before the DB changes commit (see process_signature_and_upload). When the
+# step fails, the sheet must be left as it was, whether the stamp replaced
+# the stored file in place or uploaded a new copy.
+
+def signature_data():
+    png = BytesIO()
+    Image.new("RGB", (20, 10), "black").save(png, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(png.getvalue()).decode()
+
+def seed_approval():
+    wb = Workbook()
+    wb.active["A1"] = "Claim"
+    sheet = BytesIO()
+    wb.save(sheet)
+    file_url, file_id = get_storage().save_bytes(sheet.getvalue(), "claim.xlsx")
+    approval = ClaimApproval(status="Pending Acknowledgement by HOP", sign_col=10, subject_level="Degree",
+                             file_id=file_id, file_name="claim.xlsx", file_url=file_url)
+    db.session.add(approval)
+    db.session.commit()
+    return approval.approval_id, file_id, sheet.getvalue()
+
+def approve(client, approval_id):
+    return client.post(f"/api/head_review_claim/{approval_id}", data={"action": "approve", "signature_data": signature_data()})
+
+def fail_after_stamping(monkeypatch):
+    def broken_clock():
+        raise RuntimeError("clock unavailable")
+    monkeypatch.setattr(lecturer_routes, "get_current_utc", broken_clock)
+
+@pytest.mark.parametrize("in_place", [True, False])
+def test_failed_review_leaves_the_sheet_unsigned(app, client, monkeypatch, in_place):
+    monkeypatch.setitem(app.config, "APPROVAL_UPDATE_IN_PLACE", in_place)
+    approval_id, file_id, original = seed_approval()
+    fail_after_stamping(monkeypatch)
+
+    assert approve(client, approval_id).status_code == 500
+
+    db.session.expire_all()
+    approval = db.session.get(ClaimApproval, approval_id)
+    assert approval.status == "Pending Acknowledgement by HOP" and approval.file_id == file_id
+    assert get_storage().read_bytes(file_id) == original
+    assert StoredFile.query.count() == 1
+
+@pytest.mark.parametrize("in_place", [True, False])
+def test_review_signs_the_sheet(app, client, monkeypatch, in_place):
+    monkeypatch.setitem(app.config, "APPROVAL_UPDATE_IN_PLACE", in_place)
+    approval_id, file_id, original = seed_approval()
+
+    assert approve(client, approval_id).status_code == 200
+
+    db.session.expire_all()
+    approval = db.session.get(ClaimApproval, approval_id)
+    assert approval.status == "Pending Acknowledgement by Dean / HOS"
+    assert (approval.file_id == file_id) == in_place
+    assert get_storage().read_bytes(approval.file_id) != original
+    assert StoredFile.query.count() == 1
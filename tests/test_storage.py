@@ -0,0 +1,109 @@
+import os
+import pytest
+from app import db, storage
+from app.models import RequisitionApproval, RequisitionAttachment, StoredBlob, StoredFile
+from app.storage import ContentAddressedStorage, LocalBlobStore, get_storage
+from run_storage_migration import migrate
+
+# ============================================================
+#  Content-addressed backends (local / S3)
+# ============================================================
+# The S3 backend is exercised through a ContentAddressedStorage named "s3"
+# over a second local directory: the index, URLs and migration logic are the
+# same, only the blob store differs.
+
+@pytest.fixture
+def backends(app, tmp_path):
+    local = ContentAddressedStorage("local", LocalBlobStore(str(tmp_path / "local")))
+    s3 = ContentAddressedStorage("s3", LocalBlobStore(str(tmp_path / "s3")))
+    saved = dict(storage._storage)
+    storage._storage.update(local=local, s3=s3)
+    yield local, s3
+    storage._storage.clear()
+    storage._storage.update(saved)
+
+def blob_exists(backend, data):
+    import hashlib
+    return os.path.exists(backend.blobs._path(hashlib.sha256(data).hexdigest()))
+
+def test_backends_keep_their_own_index_and_urls(backends):
+    local, s3 = backends
+    local_url, local_id = local.save_bytes(b"same bytes", "a.pdf", "application/pdf")
+    s3_url, s3_id = s3.save_bytes(b"same bytes", "a.pdf", "application/pdf")
+
+    assert "/files/local/" in local_url and "/files/s3/" in s3_url
+    assert blob_exists(local, b"same bytes") and blob_exists(s3, b"same bytes")
+    assert StoredBlob.query.count() == 2
+    assert local.file_id_from_url(local_url) == local_id and s3.file_id_from_url(local_url) is None
+    assert s3.file_id_from_url(s3_url) == s3_id and local.file_id_from_url(s3_url) is None
+    with pytest.raises(FileNotFoundError):
+        s3.read_bytes(local_id)
+
+def test_legacy_urls_resolve_to_the_owning_backend(backends, client):
+    local, s3 = backends
+    _, file_id = local.save_bytes(b"legacy", "old.pdf", "application/pdf")
+    legacy_url = f"https://example.invalid/files/{file_id}"
+
+    assert local.file_id_from_url(legacy_url) == file_id
+    assert s3.file_id_from_url(legacy_url) is None
+    assert client.get(f"/files/{file_id}").data == b"legacy"
+    assert client.get(f"/files/local/{file_id}").data == b"legacy"
+    assert client.get(f"/files/s3/{file_id}").status_code == 404
+
+def test_migration_between_content_addressed_backends(backends):
+    local, s3 = backends
+    requisition = RequisitionApproval(status="Completed")
+    db.session.add(requisition)
+    db.session.commit()
+    url, _ = local.save_bytes(b"%PDF attachment", "a.pdf", "application/pdf")
+    db.session.add(RequisitionAttachment(attachment_name="a.pdf", attachment_url=url, lecturer_id=1, requisition_id=requisition.approval_id))
+    db.session.commit()
+
+    result = migrate("local", "s3", workers=1)
+    assert result["copied"] == 1 and result["failed"] == 0
+    new_url = RequisitionAttachment.query.one().attachment_url
+    assert s3.file_id_from_url(new_url)
+    assert s3.read_bytes(s3.file_id_from_url(new_url)) == b"%PDF attachment"
+    assert blob_exists(s3, b"%PDF attachment")
+    assert migrate("local", "s3", workers=1)["files"] == 0
+
+def test_blob_bytes_survive_a_failed_delete(backends, monkeypatch):
+    local, _ = backends
+    _, first = local.save_bytes(b"first", "1.pdf", "application/pdf")
+    _, second = local.save_bytes(b"second", "2.pdf", "application/pdf")
+
+    release = local._release
+    calls = []
+    def failing_release(conn, sha256, released):
+        calls.append(sha256)
+        if len(calls) == 2:
+            raise RuntimeError("lost the connection")
+        release(conn, sha256, released)
+    monkeypatch.setattr(local, "_release", failing_release)
+
+    with pytest.raises(RuntimeError):
+        local.delete_batch([first, second])
+    # The transaction rolled back, so both files and their bytes are still there
+    assert StoredFile.query.count() == 2
+    assert blob_exists(local, b"first") and blob_exists(local, b"second")
+
+    monkeypatch.setattr(local, "_release", release)
+    assert local.delete_batch([first, second]) == {first: None, second: None}
+    assert not blob_exists(local, b"first") and not blob_exists(local, b"second")
+
+def test_failed_change_removes_the_new_blob(backends):
+    local, _ = backends
+    with pytest.raises(FileNotFoundError):
+        local.replace_bytes("missing", b"never referenced")
+    assert not blob_exists(local, b"never referenced")
+    assert StoredBlob.query.count() == 0
+
+def test_replace_keeps_shared_bytes(backends):
+    local, _ = backends
+    _, first = local.save_bytes(b"shared", "1.xlsx")
+    _, second = local.save_bytes(b"shared", "2.xlsx")
+    local.replace_bytes(first, b"updated")
+    assert blob_exists(local, b"shared") and blob_exists(local, b"updated")
+    local.replace_bytes(second, b"updated")
+    assert not blob_exists(local, b"shared")
+    assert get_storage("local").read_bytes(second) == b"updated"